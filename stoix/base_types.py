@@ -85,6 +85,17 @@ class RNNEvalState(NamedTuple):
     episode_return: chex.Array
 
 
+class RefillEvalState(NamedTuple):
+    """State of an evaluator lane that starts a new episode as soon as its episode ends."""
+
+    key: chex.PRNGKey
+    env_state: State
+    timestep: TimeStep
+    policy_state: Any
+    step_count: chex.Array
+    episode_return: chex.Array
+
+
 class ActorCriticParams(NamedTuple):
     """Parameters of an actor critic network."""
 
@@ -148,6 +159,20 @@ class OffPolicyLearnerState(NamedTuple):
     timestep: TimeStep
 
 
+class RNNOffPolicyLearnerState(NamedTuple):
+    """State of the `Learner` for recurrent off-policy architectures."""
+
+    params: Parameters
+    opt_states: OptStates
+    buffer_state: BufferState
+    key: chex.PRNGKey
+    env_state: LogEnvState
+    timestep: TimeStep
+    done: Done
+    truncated: Truncated
+    hstates: HiddenStates
+
+
 class OnlineAndTarget(NamedTuple):
     online: FrozenDict
     target: FrozenDict
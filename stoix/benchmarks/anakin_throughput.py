@@ -0,0 +1,332 @@
+"""Benchmark the training throughput of Anakin systems.
+
+Run with `python -m stoix.benchmarks.anakin_throughput` from the root of the repository. Each
+case runs the `learn` function of a system, set up by its `learner_setup`, on an environment
+for `--num_updates` updates per call. Compilation, and the warmup of off-policy systems, are not
+timed. Every case runs in a fresh process, so that its peak memory is its own. By default,
+discrete systems run on the debug environments and on gymnax CartPole, and continuous systems
+on gymnax Pendulum.
+
+The env steps per second, SGD steps per second and peak device memory of every case are written
+to a JSON table with `--output`, which can be checked in. CPU devices report no memory statistics,
+so their peak memory is null. With `--baseline`, the benchmark fails if the throughput of a case is
+lower than in the baseline table by more than `--tolerance`. The checked-in
+`anakin_throughput_baseline.json` holds the default grid measured on a single-core CPU machine.
+With `--cpu_devices`, the cases run on that many forced host devices, e.g. to compare the
+`pmap` and `jit` parallel backends across device counts, and `--model_axis_sizes` splits each
+replica of the `jit` backend across that many devices.
+"""
+
+import argparse
+import importlib
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional
+
+_REPO_ROOT = Path(__file__).resolve().parents[2]
+
+
+class BenchmarkSystem(NamedTuple):
+    """How to set up the learner of an Anakin system."""
+
+    module: str
+    # Number of keys taken by its `learner_setup`.
+    num_keys: int
+    continuous: bool = False
+    # Whether its `learner_setup` also takes the evaluation environment.
+    takes_eval_env: bool = False
+    # Name of the default config of its entry point, if it is not named after the system.
+    config_name: Optional[str] = None
+
+
+SYSTEMS: Dict[str, BenchmarkSystem] = {
+    "ff_dqn": BenchmarkSystem("stoix.systems.q_learning.ff_dqn", 2),
+    "ff_ddqn": BenchmarkSystem("stoix.systems.q_learning.ff_ddqn", 2),
+    "ff_dqn_reg": BenchmarkSystem("stoix.systems.q_learning.ff_dqn_reg", 2),
+    "ff_mdqn": BenchmarkSystem("stoix.systems.q_learning.ff_mdqn", 2),
+    "ff_c51": BenchmarkSystem("stoix.systems.q_learning.ff_c51", 2),
+    "ff_qr_dqn": BenchmarkSystem("stoix.systems.q_learning.ff_qr_dqn", 2),
+    "ff_rainbow": BenchmarkSystem("stoix.systems.q_learning.ff_rainbow", 3),
+    "rec_r2d2": BenchmarkSystem("stoix.systems.q_learning.rec_r2d2", 2),
+    "ff_ppo": BenchmarkSystem("stoix.systems.ppo.anakin.ff_ppo", 3),
+    "ff_ppo_penalty": BenchmarkSystem(
+        "stoix.systems.ppo.anakin.ff_ppo_penalty", 3, config_name="default_ff_ppo"
+    ),
+    "rec_ppo": BenchmarkSystem("stoix.systems.ppo.anakin.rec_ppo", 3),
+    "ff_reinforce": BenchmarkSystem("stoix.systems.vpg.ff_reinforce", 3),
+    "ff_awr": BenchmarkSystem("stoix.systems.awr.ff_awr", 3),
+    "ff_mpo": BenchmarkSystem("stoix.systems.mpo.ff_mpo", 3),
+    "ff_vmpo": BenchmarkSystem("stoix.systems.mpo.ff_vmpo", 3),
+    "ff_az": BenchmarkSystem("stoix.systems.search.ff_az", 3, takes_eval_env=True),
+    "ff_mz": BenchmarkSystem("stoix.systems.search.ff_mz", 4),
+    "ff_ppo_continuous": BenchmarkSystem("stoix.systems.ppo.anakin.ff_ppo_continuous", 3, True),
+    "ff_ppo_penalty_continuous": BenchmarkSystem(
+        "stoix.systems.ppo.anakin.ff_ppo_penalty_continuous",
+        3,
+        True,
+        config_name="default_ff_ppo_continuous",
+    ),
+    "ff_dpo_continuous": BenchmarkSystem("stoix.systems.ppo.anakin.ff_dpo_continuous", 3, True),
+    "ff_reinforce_continuous": BenchmarkSystem(
+        "stoix.systems.vpg.ff_reinforce_continuous", 3, True
+    ),
+    "ff_awr_continuous": BenchmarkSystem("stoix.systems.awr.ff_awr_continuous", 3, True),
+    "ff_mpo_continuous": BenchmarkSystem("stoix.systems.mpo.ff_mpo_continuous", 3, True),
+    "ff_vmpo_continuous": BenchmarkSystem("stoix.systems.mpo.ff_vmpo_continuous", 3, True),
+    "ff_ddpg": BenchmarkSystem("stoix.systems.ddpg.ff_ddpg", 3, True),
+    "ff_td3": BenchmarkSystem("stoix.systems.ddpg.ff_td3", 3, True),
+    "ff_d4pg": BenchmarkSystem("stoix.systems.ddpg.ff_d4pg", 3, True),
+    "ff_sac": BenchmarkSystem("stoix.systems.sac.ff_sac", 3, True),
+    "ff_sampled_az": BenchmarkSystem(
+        "stoix.systems.search.ff_sampled_az", 3, True, takes_eval_env=True
+    ),
+    "ff_sampled_mz": BenchmarkSystem("stoix.systems.search.ff_sampled_mz", 4, True),
+}
+
+DISCRETE_ENVS = ["debug/identity_game", "debug/sequence_game", "gymnax/cartpole"]
+CONTINUOUS_ENVS = ["gymnax/pendulum"]
+
+# The settings identifying a case, other than its results.
+_CASE_KEYS = (
+    "system",
+    "env",
+    "parallel_backend",
+    "model_axis_size",
+    "cpu_devices",
+    "total_num_envs",
+    "rollout_length",
+    "update_batch_size",
+    "num_updates",
+)
+
+
+def run_case(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Set up the learner of a case, then time its `learn` function and return its results."""
+    import hydra
+    import jax
+    from omegaconf import OmegaConf
+
+    from stoix.utils import make_env as environments
+    from stoix.utils.jax_utils import (
+        get_anakin_learner_devices,
+        get_num_learner_replicas,
+        get_peak_memory_metrics,
+    )
+    from stoix.utils.total_timestep_checker import check_total_timesteps
+
+    system = SYSTEMS[case["system"]]
+    overrides = [
+        f"env={case['env']}",
+        f"arch.parallel_backend={case['parallel_backend']}",
+        f"arch.model_axis_size={case['model_axis_size']}",
+        "arch.total_timesteps=null",
+        f"arch.num_updates={case['num_updates']}",
+        "arch.num_evaluation=1",
+    ]
+    for key, override in (
+        ("total_num_envs", "arch.total_num_envs"),
+        ("rollout_length", "system.rollout_length"),
+        ("update_batch_size", "arch.update_batch_size"),
+    ):
+        if case[key] is not None:
+            overrides.append(f"{override}={case[key]}")
+
+    # The default configs search for the other configs relative to the root of the repository.
+    with hydra.initialize_config_dir(
+        config_dir=str(_REPO_ROOT / "stoix/configs/default/anakin"), version_base="1.2"
+    ):
+        config_name = system.config_name or f"default_{case['system']}"
+        config = hydra.compose(config_name=config_name, overrides=overrides)
+    OmegaConf.set_struct(config, False)
+
+    # Set up the learner as `run_experiment` does.
+    config.num_devices = get_num_learner_replicas(config)
+    config = check_total_timesteps(config)
+    config.arch.num_updates_per_eval = config.arch.num_updates
+    if config.system.get("recurrent_chunk_size", 0) is None:
+        config.system.recurrent_chunk_size = config.system.rollout_length
+    env, eval_env = environments.make(config)
+    keys = tuple(jax.random.split(jax.random.PRNGKey(config.arch.seed), system.num_keys))
+    setup_args = (env, keys, config) + ((eval_env,) if system.takes_eval_env else ())
+    setup_outputs = importlib.import_module(system.module).learner_setup(*setup_args)
+    learn, learner_state = setup_outputs[0], setup_outputs[-1]
+
+    start_time = time.perf_counter()
+    learn = learn.lower(learner_state).compile()
+    compile_time = time.perf_counter() - start_time
+    # The first call may still include one-off costs, e.g. transferring the learner state.
+    learner_state = jax.block_until_ready(learn(learner_state)).learner_state
+
+    start_time = time.perf_counter()
+    for _ in range(case["num_repeats"]):
+        learner_state = learn(learner_state).learner_state
+    jax.block_until_ready(learner_state)
+    elapsed_time = time.perf_counter() - start_time
+
+    num_updates = case["num_updates"] * case["num_repeats"]
+    env_steps = (
+        num_updates
+        * config.num_devices
+        * config.arch.update_batch_size
+        * config.arch.num_envs
+        * config.system.rollout_length
+    )
+    sgd_steps_per_update = config.system.get(
+        "updates_per_rollout", config.system.get("epochs", 1)
+    ) * config.system.get("num_minibatches", 1)
+    return {
+        **case,
+        "num_devices": len(get_anakin_learner_devices(config)),
+        "num_replicas": config.num_devices,
+        "device_kind": jax.devices()[0].device_kind,
+        "env_steps_per_second": env_steps / elapsed_time,
+        "sgd_steps_per_second": num_updates * sgd_steps_per_update / elapsed_time,
+        "peak_memory_gb": get_peak_memory_metrics(jax.local_devices()).get("peak_memory_gb"),
+        "compile_time": compile_time,
+    }
+
+
+def _run_case_in_subprocess(case: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a case in a fresh process and return its results, or the error it failed with."""
+    env = dict(os.environ)
+    if case["cpu_devices"] is not None:
+        env["JAX_PLATFORMS"] = "cpu"
+        env["XLA_FLAGS"] = (
+            env.get("XLA_FLAGS", "")
+            + f" --xla_force_host_platform_device_count={case['cpu_devices']}"
+        )
+    process = subprocess.run(
+        [sys.executable, "-m", "stoix.benchmarks.anakin_throughput", "--case", json.dumps(case)],
+        cwd=_REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        error = process.stderr.strip().splitlines()
+        return {**case, "error": error[-1] if error else f"exit code {process.returncode}"}
+    # Systems print while they are set up, the results are the last line.
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def _case_id(result: Dict[str, Any]) -> str:
+    return json.dumps([result.get(key) for key in _CASE_KEYS])
+
+
+def _find_regressions(
+    results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float
+) -> List[str]:
+    """Describe the cases whose throughput is lower than in the baseline by more than the
+    tolerance, as a fraction of the baseline throughput."""
+    baseline_results = {_case_id(result): result for result in baseline if "error" not in result}
+    regressions = []
+    for result in results:
+        baseline_result = baseline_results.get(_case_id(result))
+        if baseline_result is None:
+            continue
+        if "error" in result:
+            regressions.append(f"{result['system']} on {result['env']} failed: {result['error']}")
+            continue
+        for metric in ("env_steps_per_second", "sgd_steps_per_second"):
+            if result[metric] < (1 - tolerance) * baseline_result[metric]:
+                regressions.append(
+                    f"{result['system']} on {result['env']}: {metric} dropped from "
+                    f"{baseline_result[metric]:.1f} to {result[metric]:.1f}"
+                )
+    return regressions
+
+
+def _is_valid_case(backend: str, model_axis_size: int, cpu_devices: Optional[int]) -> bool:
+    """Only the jit backend has a model axis, which must divide the devices."""
+    if backend == "pmap" and model_axis_size > 1:
+        return False
+    return cpu_devices is None or cpu_devices % model_axis_size == 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--systems", nargs="+", choices=sorted(SYSTEMS), default=sorted(SYSTEMS))
+    parser.add_argument("--envs", nargs="+", default=None)
+    parser.add_argument("--parallel_backends", nargs="+", default=["pmap"])
+    parser.add_argument("--model_axis_sizes", type=int, nargs="+", default=[1])
+    parser.add_argument("--cpu_devices", type=int, nargs="+", default=[None])
+    parser.add_argument("--total_num_envs", type=int, nargs="+", default=[None])
+    parser.add_argument("--rollout_lengths", type=int, nargs="+", default=[None])
+    parser.add_argument("--update_batch_sizes", type=int, nargs="+", default=[None])
+    parser.add_argument("--num_updates", type=int, default=10)
+    parser.add_argument("--num_repeats", type=int, default=3)
+    parser.add_argument("--output", type=Path, default=Path("anakin_throughput.json"))
+    parser.add_argument("--baseline", type=Path, default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--case", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        print(json.dumps(run_case(json.loads(args.case))))
+        return
+
+    results = []
+    for system_name in args.systems:
+        default_envs = CONTINUOUS_ENVS if SYSTEMS[system_name].continuous else DISCRETE_ENVS
+        grid = itertools.product(
+            args.envs or default_envs,
+            args.parallel_backends,
+            args.model_axis_sizes,
+            args.cpu_devices,
+            args.total_num_envs,
+            args.rollout_lengths,
+            args.update_batch_sizes,
+        )
+        for (
+            env,
+            backend,
+            model_axis_size,
+            cpu_devices,
+            total_num_envs,
+            rollout_length,
+            update_batch_size,
+        ) in grid:
+            if not _is_valid_case(backend, model_axis_size, cpu_devices):
+                continue
+            case: Dict[str, Optional[Any]] = {
+                "system": system_name,
+                "env": env,
+                "parallel_backend": backend,
+                "model_axis_size": model_axis_size,
+                "cpu_devices": cpu_devices,
+                "total_num_envs": total_num_envs,
+                "rollout_length": rollout_length,
+                "update_batch_size": update_batch_size,
+                "num_updates": args.num_updates,
+                "num_repeats": args.num_repeats,
+            }
+            result = _run_case_in_subprocess(case)
+            results.append(result)
+            if "error" in result:
+                print(f"{system_name:>26} {env:>20} {backend:>9} failed: {result['error']}")
+            else:
+                print(
+                    f"{system_name:>26} {env:>20} {backend:>9} {result['num_devices']:>3} devices"
+                    f" {result['num_replicas']:>3} replicas"
+                    f" {result['env_steps_per_second']:>12.1f} env steps/s"
+                    f" {result['sgd_steps_per_second']:>10.1f} SGD steps/s"
+                )
+
+    args.output.write_text(json.dumps(results, indent=2) + "\n")
+    print(f"Results written to {args.output}")
+
+    if args.baseline is not None:
+        regressions = _find_regressions(
+            results, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        if regressions:
+            sys.exit("Throughput regressions:\n" + "\n".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
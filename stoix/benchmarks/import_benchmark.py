@@ -0,0 +1,102 @@
+"""Benchmark the time it takes to import a system and check that it imports no unused suites.
+
+Run with `python -m stoix.benchmarks.import_benchmark`. The module, by default
+`stoix.systems.q_learning.ff_dqn`, is imported `--repeats` times in fresh interpreters and the
+median import time is reported. The benchmark fails if any environment suite or logging backend,
+which `stoix.utils.make_env` and `stoix.utils.logger` only import when they are used, is
+imported by the module, or if the median import time is higher than in the `--baseline` table by
+more than `--tolerance`. The checked-in `import_baseline.json` was measured on a single-core CPU
+machine, a baseline for another machine can be written with `--output`.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Tuple
+
+# Packages that must not be imported until a run uses them. gymnasium is not included since
+# jumanji, which stoix is built on, may import it.
+LAZY_PACKAGES = (
+    "brax",
+    "craftax",
+    "envpool",
+    "gymnax",
+    "jaxmarl",
+    "marl_eval",
+    "navix",
+    "neptune",
+    "pgx",
+    "popjym",
+    "tensorboard_logger",
+    "wandb",
+    "xminigrid",
+)
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"time": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def _time_import(module: str) -> Tuple[float, List[str]]:
+    """Import the module in a fresh interpreter and return the time taken and the modules
+    imported by it."""
+    output = subprocess.run(
+        [sys.executable, "-c", _IMPORT_SCRIPT.format(module=module)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    # Modules may print when imported, the result is the last line.
+    result = json.loads(output.strip().splitlines()[-1])
+    return result["time"], result["modules"]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="stoix.systems.q_learning.ff_dqn")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument(
+        "--baseline", type=Path, default=Path(__file__).with_name("import_baseline.json")
+    )
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args()
+
+    times, modules = [], []
+    for _ in range(args.repeats):
+        import_time, modules = _time_import(args.module)
+        times.append(import_time)
+    median_time = statistics.median(times)
+    print(f"import {args.module}: {median_time:.2f}s (median of {args.repeats})")
+
+    failures = []
+    imported_lazy_packages = sorted(
+        {module.split(".")[0] for module in modules} & set(LAZY_PACKAGES)
+    )
+    if imported_lazy_packages:
+        failures.append(f"imports unused packages: {', '.join(imported_lazy_packages)}")
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    baseline_time = baseline.get(args.module)
+    if baseline_time is not None and median_time > (1 + args.tolerance) * baseline_time:
+        failures.append(f"regressed from {baseline_time:.2f}s to {median_time:.2f}s")
+
+    if args.output is not None:
+        # The output is a table of import times by module, to which this module is added.
+        results = json.loads(args.output.read_text()) if args.output.exists() else {}
+        results[args.module] = median_time
+        args.output.write_text(json.dumps(results, indent=2, sort_keys=True) + "\n")
+        print(f"Results written to {args.output}")
+
+    if failures:
+        sys.exit(f"import {args.module} " + " and ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
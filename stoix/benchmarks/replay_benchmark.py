@@ -0,0 +1,173 @@
+"""Benchmark the cost of sampling from and updating replay buffers.
+
+Run with `python -m stoix.benchmarks.replay_benchmark`. For each buffer size, the time of a jitted
+`sample` followed by `set_priorities` is reported for the sum-tree buffer of
+`stoix.utils.replay_buffers` and for the flashbax prioritised item buffer.
+
+With `--mode sampling`, the time of sampling the batches of `--epochs` epochs is instead reported
+for the flashbax item buffer and the sum-tree buffer, with a sample per epoch and with the fused
+sampling of `make_epoch_sample_fns`.
+"""
+
+import argparse
+import time
+from typing import Any, Callable, Tuple
+
+import chex
+import flashbax as fbx
+import jax
+import jax.numpy as jnp
+from omegaconf import OmegaConf
+
+from stoix.utils.replay_buffers import make_epoch_sample_fns, make_prioritised_buffer
+
+
+def _time_update(
+    buffer: Any, transition: chex.ArrayTree, add_batch_size: int, num_iterations: int
+) -> float:
+    """Fill the buffer and return the mean time, in ms, of a sample and priority update."""
+    # A single [1, add_batch_size] batch fills both buffers.
+    fill = jax.tree_util.tree_map(
+        lambda x: jnp.broadcast_to(x, (1, add_batch_size) + x.shape), transition
+    )
+    state = jax.jit(buffer.add)(buffer.init(transition), fill)
+
+    def update(state: Any, key: chex.PRNGKey) -> Tuple[Any, chex.PRNGKey]:
+        key, sample_key, priority_key = jax.random.split(key, 3)
+        sample = buffer.sample(state, sample_key)
+        priorities = jax.random.uniform(priority_key, sample.indices.shape)
+        return buffer.set_priorities(state, sample.indices, priorities), key
+
+    update_fn: Callable = jax.jit(update, donate_argnums=0)
+    key = jax.random.PRNGKey(0)
+    state, key = jax.block_until_ready(update_fn(state, key))
+    start = time.perf_counter()
+    for _ in range(num_iterations):
+        state, key = update_fn(state, key)
+    jax.block_until_ready(state)
+    return (time.perf_counter() - start) / num_iterations * 1000
+
+
+def _time_epoch_sampling(
+    make_buffer: Callable[[int], Any],
+    transition: chex.ArrayTree,
+    add_batch_size: int,
+    batch_size: int,
+    epochs: int,
+    fused: bool,
+    num_iterations: int,
+) -> float:
+    """Fill the buffer and return the mean time, in ms, of sampling the batches of all epochs."""
+    buffer = make_buffer(epochs * batch_size if fused else batch_size)
+    config = OmegaConf.create(
+        {"system": {"fused_sampling": fused, "epochs": epochs, "batch_size": batch_size}}
+    )
+    presample_fn, sample_fn = make_epoch_sample_fns(buffer, config)
+    fill = jax.tree_util.tree_map(
+        lambda x: jnp.broadcast_to(x, (1, add_batch_size) + x.shape), transition
+    )
+    state = jax.jit(buffer.add)(buffer.init(transition), fill)
+    weights = jnp.ones(transition["obs"].shape + (256,), dtype=jnp.float32)
+
+    def sample_epochs(key: chex.PRNGKey) -> Tuple[chex.PRNGKey, chex.Array]:
+        key, epoch_samples = presample_fn(state, key)
+
+        def sample_epoch(key: chex.PRNGKey, epoch_sample: Any) -> Tuple[chex.PRNGKey, chex.Array]:
+            key, sample_key = jax.random.split(key)
+            sample = sample_fn(state, sample_key, epoch_sample)
+            # Feed the observations to a dense layer, as a network would.
+            return key, jnp.mean(jnp.tanh(sample.experience["obs"] @ weights))
+
+        return jax.lax.scan(sample_epoch, key, epoch_samples, epochs)
+
+    sample_fn_jit: Callable = jax.jit(sample_epochs)
+    key = jax.random.PRNGKey(0)
+    key, _ = jax.block_until_ready(sample_fn_jit(key))
+    start = time.perf_counter()
+    for _ in range(num_iterations):
+        key, means = sample_fn_jit(key)
+    jax.block_until_ready(means)
+    return (time.perf_counter() - start) / num_iterations * 1000
+
+
+def _sampling_benchmark(args: argparse.Namespace, transition: chex.ArrayTree) -> None:
+    """Compare sampling a batch per epoch against the fused sampling of all the epochs."""
+    print(f"{'buffer size':>12} {'buffer':>10} {'per epoch (ms)':>15} {'fused (ms)':>11}")
+    for buffer_size in args.buffer_sizes:
+        make_buffers = {
+            "flashbax": lambda sample_batch_size, buffer_size=buffer_size: fbx.make_item_buffer(
+                max_length=buffer_size,
+                min_length=args.batch_size,
+                sample_batch_size=sample_batch_size,
+                add_batches=True,
+                add_sequences=True,
+            ),
+            "sum-tree": lambda sample_batch_size, buffer_size=buffer_size: make_prioritised_buffer(
+                max_length=buffer_size,
+                min_length=args.batch_size,
+                sample_batch_size=sample_batch_size,
+                priority_exponent=0.5,
+            ),
+        }
+        for name, make_buffer in make_buffers.items():
+            per_epoch_ms, fused_ms = (
+                _time_epoch_sampling(
+                    make_buffer,
+                    transition,
+                    buffer_size,
+                    args.batch_size,
+                    args.epochs,
+                    fused,
+                    args.num_iterations,
+                )
+                for fused in (False, True)
+            )
+            print(f"{buffer_size:>12} {name:>10} {per_epoch_ms:>15.3f} {fused_ms:>11.3f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch_size", type=int, default=256)
+    parser.add_argument("--obs_dim", type=int, default=64)
+    parser.add_argument("--num_iterations", type=int, default=100)
+    parser.add_argument(
+        "--buffer_sizes", type=int, nargs="+", default=[2**14, 2**16, 2**18, 2**20]
+    )
+    parser.add_argument("--mode", choices=["priorities", "sampling"], default="priorities")
+    parser.add_argument("--epochs", type=int, default=16)
+    args = parser.parse_args()
+
+    transition = {
+        "obs": jnp.zeros((args.obs_dim,), dtype=jnp.float32),
+        "action": jnp.zeros((), dtype=jnp.int32),
+        "reward": jnp.zeros((), dtype=jnp.float32),
+    }
+    print(f"Backend: {jax.default_backend()}, batch size: {args.batch_size}")
+    if args.mode == "sampling":
+        print(f"Epochs: {args.epochs}")
+        _sampling_benchmark(args, transition)
+        return
+    print(f"{'buffer size':>12} {'sum-tree (ms)':>14} {'flashbax (ms)':>14}")
+    for buffer_size in args.buffer_sizes:
+        sum_tree_buffer = make_prioritised_buffer(
+            max_length=buffer_size,
+            min_length=args.batch_size,
+            sample_batch_size=args.batch_size,
+            priority_exponent=0.5,
+        )
+        flashbax_buffer = fbx.make_prioritised_item_buffer(
+            max_length=buffer_size,
+            min_length=args.batch_size,
+            sample_batch_size=args.batch_size,
+            add_batches=True,
+            add_sequences=True,
+            priority_exponent=0.5,
+            device=jax.default_backend(),
+        )
+        sum_tree_ms = _time_update(sum_tree_buffer, transition, buffer_size, args.num_iterations)
+        flashbax_ms = _time_update(flashbax_buffer, transition, buffer_size, args.num_iterations)
+        print(f"{buffer_size:>12} {sum_tree_ms:>14.3f} {flashbax_ms:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
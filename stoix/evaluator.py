@@ -1,13 +1,11 @@
-import math
 import time
-from typing import Any, Dict, Optional, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
 
 import chex
 import flax.linen as nn
 import jax
 import jax.numpy as jnp
 import numpy as np
-from colorama import Fore, Style
 from flax.core.frozen_dict import FrozenDict
 from jumanji.env import Environment
 from omegaconf import DictConfig
@@ -15,17 +13,32 @@ from omegaconf import DictConfig
 from stoix.base_types import (
     ActFn,
     ActorApply,
+    AnakinExperimentOutput,
     EvalFn,
     EvalState,
     EvaluationOutput,
     RecActFn,
     RecActorApply,
+    RefillEvalState,
     RNNEvalState,
     RNNObservation,
     SebulbaEvalFn,
 )
+from stoix.utils.checkpointing import Checkpointer
 from stoix.utils.env_factory import EnvFactory
-from stoix.utils.jax_utils import unreplicate_batch_dim
+from stoix.utils.jax_utils import (
+    device_map,
+    evaluation_overlaps_training,
+    get_anakin_evaluator_devices,
+    get_num_evaluator_replicas,
+    get_num_learner_replicas,
+    get_peak_memory_metrics,
+    unreplicate_batch_dim,
+    unreplicate_n_dims,
+)
+from stoix.utils.logger import LogEvent, StoixLogger
+from stoix.utils.sebulba_utils import AsyncEvaluator, ThreadLifetime
+from stoix.wrappers.episode_metrics import get_final_step_metrics
 
 
 def get_distribution_act_fn(
@@ -87,6 +100,23 @@ def get_ff_evaluator_fn(
             performance during training for 10 times more episodes than were used at a
             single evaluation step.
     """
+    if config.arch.evaluation_mode == "refill":
+
+        def select_action(
+            params: FrozenDict,
+            policy_state: None,
+            env_state: Any,
+            observation: chex.Array,
+            key: chex.PRNGKey,
+        ) -> Tuple[None, chex.Array]:
+            """Select the action of a single lane."""
+            observation = jax.tree_util.tree_map(lambda x: x[jnp.newaxis, ...], observation)
+            action = act_fn(params, observation, key)
+            return policy_state, action.squeeze()
+
+        return get_refill_evaluator_fn(
+            env, select_action, lambda: None, config, log_solve_rate, eval_multiplier
+        )
 
     def eval_one_episode(params: FrozenDict, init_eval_state: EvalState) -> Dict:
         """Evaluate one episode. It is vectorized over the number of evaluation episodes."""
@@ -138,7 +168,7 @@ def get_ff_evaluator_fn(
         """Evaluator function."""
 
         # Initialise environment states and timesteps.
-        n_devices = len(jax.devices())
+        n_devices = get_num_evaluator_replicas(config)
 
         eval_batch = (config.arch.num_eval_episodes // n_devices) * eval_multiplier
 
@@ -182,6 +212,33 @@ def get_rnn_evaluator_fn(
     eval_multiplier: int = 1,
 ) -> EvalFn:
     """Get the evaluator function for recurrent networks."""
+    if config.arch.evaluation_mode == "refill":
+
+        def select_action(
+            params: FrozenDict,
+            hstate: chex.Array,
+            env_state: Any,
+            observation: chex.Array,
+            key: chex.PRNGKey,
+        ) -> Tuple[chex.Array, chex.Array]:
+            """Select the action of a single lane. The hidden state is reset by the refill
+            evaluator when an episode ends, so the dones are always False."""
+            # Add a batch dimension and env dimension to the observation.
+            batched_observation = jax.tree_util.tree_map(
+                lambda x: jnp.expand_dims(x, axis=0)[jnp.newaxis, :], observation
+            )
+            ac_in = (batched_observation, jnp.zeros((1, 1), dtype=bool))
+            hstate, action = rec_act_fn(params, hstate, ac_in, key)
+            return hstate, action[-1].squeeze(0)
+
+        return get_refill_evaluator_fn(
+            env,
+            select_action,
+            lambda: scanned_rnn.initialize_carry(1),
+            config,
+            log_solve_rate,
+            eval_multiplier,
+        )
 
     def eval_one_episode(params: FrozenDict, init_eval_state: RNNEvalState) -> Dict:
         """Evaluate one episode. It is vectorized over the number of evaluation episodes."""
@@ -252,7 +309,7 @@ def get_rnn_evaluator_fn(
         """Evaluator function."""
 
         # Initialise environment states and timesteps.
-        n_devices = len(jax.devices())
+        n_devices = get_num_evaluator_replicas(config)
 
         eval_batch = config.arch.num_eval_episodes // n_devices * eval_multiplier
 
@@ -297,6 +354,173 @@ def get_rnn_evaluator_fn(
     return evaluator_fn
 
 
+def get_refill_evaluator_fn(
+    env: Environment,
+    select_action_fn: Callable[
+        [FrozenDict, Any, Any, chex.Array, chex.PRNGKey], Tuple[Any, chex.Array]
+    ],
+    init_policy_state_fn: Callable[[], Any],
+    config: DictConfig,
+    log_solve_rate: bool = False,
+    eval_multiplier: int = 1,
+) -> EvalFn:
+    """Get an evaluator function that runs the evaluation episodes on a fixed pool of env lanes.
+
+    Vmapping one `while_loop` per episode keeps every lane running until the longest episode
+    ends. Instead, `config.arch.eval_num_lanes` lanes are stepped in chunks of
+    `config.arch.eval_scan_length` steps and a lane starts a new episode as soon as its episode
+    ends. Each lane runs a fixed number of episodes so that the evaluation is not biased
+    towards short episodes, and the results of finished episodes are written to fixed-size
+    buffers with masks. Evaluation stops after the first chunk in which all episodes are done.
+
+    Args:
+        env (Environment): An environment instance for evaluation.
+        select_action_fn (callable): Selects the action of a single lane given the params,
+            the policy state, the env state, the observation and a key. Returns the new
+            policy state and the action.
+        init_policy_state_fn (callable): Returns the policy state of a lane at the start
+            of an episode, e.g. the initial RNN hidden state.
+        config (dict): Experiment configuration.
+        eval_multiplier (int): A scalar that will increase the number of evaluation
+            episodes by a fixed factor.
+    """
+    n_devices = get_num_evaluator_replicas(config)
+    num_episodes = (config.arch.num_eval_episodes // n_devices) * eval_multiplier
+    num_lanes = min(config.arch.eval_num_lanes, num_episodes)
+    # The episodes are spread as evenly as possible across the lanes and each lane
+    # writes its episodes to a contiguous range of the result buffers.
+    episodes_per_lane = np.full(num_lanes, num_episodes // num_lanes)
+    episodes_per_lane[: num_episodes % num_lanes] += 1
+    lane_offsets = np.cumsum(episodes_per_lane) - episodes_per_lane
+
+    def lane_step(
+        params: FrozenDict, lane_state: RefillEvalState
+    ) -> Tuple[RefillEvalState, Tuple[chex.Array, chex.Array, chex.Array]]:
+        """Step a single lane, starting a new episode if its episode ended."""
+        key, env_state, last_timestep, policy_state, step_count, episode_return = lane_state
+
+        # Select action.
+        key, policy_key, reset_key = jax.random.split(key, num=3)
+        policy_state, action = select_action_fn(
+            params, policy_state, env_state, last_timestep.observation, policy_key
+        )
+
+        # Step environment.
+        env_state, timestep = env.step(env_state, action)
+
+        # Log episode metrics.
+        episode_return += timestep.reward
+        step_count += 1
+        done = timestep.last()
+        finished_episode = (done, episode_return, step_count)
+
+        # Start a new episode if the episode ended.
+        reset_env_state, reset_timestep = env.reset(reset_key)
+        env_state, timestep, policy_state = jax.tree_util.tree_map(
+            lambda reset_x, x: jnp.where(done, reset_x, x),
+            (reset_env_state, reset_timestep, init_policy_state_fn()),
+            (env_state, timestep, policy_state),
+        )
+        episode_return = jnp.where(done, jnp.zeros_like(episode_return), episode_return)
+        step_count = jnp.where(done, jnp.zeros_like(step_count), step_count)
+
+        lane_state = RefillEvalState(
+            key, env_state, timestep, policy_state, step_count, episode_return
+        )
+        return lane_state, finished_episode
+
+    def evaluator_fn(
+        trained_params: FrozenDict, key: chex.PRNGKey
+    ) -> EvaluationOutput[RefillEvalState]:
+        """Evaluator function."""
+
+        def _env_step(carry: Tuple, _: Any) -> Tuple[Tuple, None]:
+            """Step all the lanes and record the episodes that ended."""
+            eval_state, episodes_done, episode_returns, episode_lengths = carry
+            eval_state, (done, episode_return, step_count) = jax.vmap(lane_step, in_axes=(None, 0))(
+                trained_params, eval_state
+            )
+
+            # Only record the episodes of lanes that have not run all their episodes yet.
+            # Unrecorded episodes are written out of bounds and dropped.
+            record = jnp.logical_and(done, episodes_done < episodes_per_lane)
+            slots = jnp.where(record, lane_offsets + episodes_done, num_episodes)
+            episode_returns = episode_returns.at[slots].set(episode_return, mode="drop")
+            episode_lengths = episode_lengths.at[slots].set(step_count, mode="drop")
+            episodes_done += record
+
+            return (eval_state, episodes_done, episode_returns, episode_lengths), None
+
+        def _run_chunk(carry: Tuple) -> Tuple:
+            """Step all the lanes for a fixed number of steps."""
+            carry, _ = jax.lax.scan(_env_step, carry, None, config.arch.eval_scan_length)
+            return carry
+
+        def not_done(carry: Tuple) -> bool:
+            """Check if any lane has episodes left to run."""
+            episodes_done = carry[1]
+            is_not_done: bool = jnp.any(episodes_done < episodes_per_lane)
+            return is_not_done
+
+        # Initialise environment states and timesteps.
+        key, *env_keys = jax.random.split(key, num_lanes + 1)
+        env_states, timesteps = jax.vmap(env.reset)(jnp.stack(env_keys))
+        # Split keys for each lane.
+        key, *lane_keys = jax.random.split(key, num_lanes + 1)
+        policy_states = jax.tree_util.tree_map(
+            lambda x: jnp.stack([x] * num_lanes), init_policy_state_fn()
+        )
+
+        eval_state = RefillEvalState(
+            key=jnp.stack(lane_keys),
+            env_state=env_states,
+            timestep=timesteps,
+            policy_state=policy_states,
+            step_count=jnp.zeros(num_lanes, dtype=int),
+            episode_return=jnp.zeros_like(timesteps.reward),
+        )
+        init_carry = (
+            eval_state,
+            jnp.zeros(num_lanes, dtype=int),
+            jnp.zeros((num_episodes,) + timesteps.reward.shape[1:], timesteps.reward.dtype),
+            jnp.zeros(num_episodes, dtype=int),
+        )
+        eval_state, _, episode_returns, episode_lengths = jax.lax.while_loop(
+            not_done, _run_chunk, init_carry
+        )
+
+        eval_metrics = {
+            "episode_return": episode_returns,
+            "episode_length": episode_lengths,
+        }
+        # Log solve episode if solve rate is required.
+        if log_solve_rate:
+            eval_metrics["solve_episode"] = (
+                episode_returns >= config.env.solved_return_threshold
+            ).astype(int)
+
+        return EvaluationOutput(
+            learner_state=eval_state,
+            episode_metrics=eval_metrics,
+        )
+
+    return evaluator_fn
+
+
+def evaluate_on_devices(evaluator: EvalFn, devices: Sequence[jax.Device]) -> EvalFn:
+    """Wrap a pmapped evaluator so that it runs on `devices` while taking the params and keys
+    replicated across the learner devices, like an evaluator running on the learner devices."""
+
+    def evaluator_fn(trained_params: FrozenDict, key: chex.PRNGKey) -> EvaluationOutput:
+        # Copy a single replica of the params to the evaluator devices.
+        params = jax.tree_util.tree_map(lambda x: x[0], trained_params)
+        params = jax.device_put_replicated(params, devices)
+        keys = jax.random.split(key[0], len(devices))
+        return evaluator(params, keys)
+
+    return evaluator_fn
+
+
 def evaluator_setup(
     eval_env: Environment,
     key_e: chex.PRNGKey,
@@ -308,7 +532,7 @@ def evaluator_setup(
 ) -> Tuple[EvalFn, EvalFn, Tuple[FrozenDict, chex.Array]]:
     """Initialise evaluator_fn."""
     # Get available TPU cores.
-    n_devices = len(jax.devices())
+    n_devices = get_num_learner_replicas(config)
     # Check if solve rate is required for evaluation.
     if hasattr(config.env, "solved_return_threshold"):
         log_solve_rate = True
@@ -344,8 +568,19 @@ def evaluator_setup(
             10,
         )
 
-    evaluator = jax.pmap(evaluator, axis_name="device")
-    absolute_metric_evaluator = jax.pmap(absolute_metric_evaluator, axis_name="device")
+    evaluator_devices = get_anakin_evaluator_devices(config)
+    if evaluation_overlaps_training(config):
+        # Dedicated evaluation devices each evaluate a full copy of the params.
+        evaluator = evaluate_on_devices(
+            jax.pmap(evaluator, axis_name="device", devices=evaluator_devices), evaluator_devices
+        )
+        absolute_metric_evaluator = evaluate_on_devices(
+            jax.pmap(absolute_metric_evaluator, axis_name="device", devices=evaluator_devices),
+            evaluator_devices,
+        )
+    else:
+        evaluator = device_map(evaluator, config, evaluator_devices)
+        absolute_metric_evaluator = device_map(absolute_metric_evaluator, config, evaluator_devices)
 
     # Broadcast trained params to cores and split keys for each core.
     trained_params = unreplicate_batch_dim(params)
@@ -355,6 +590,120 @@ def evaluator_setup(
     return evaluator, absolute_metric_evaluator, (trained_params, eval_keys)
 
 
+class AnakinExperimentLogger:
+    """Logs the training and evaluations of an Anakin system, checkpoints the evaluated learner
+    states and keeps the best params for the absolute metric.
+
+    When the evaluation overlaps training, see `evaluation_overlaps_training`, the evaluation
+    of a snapshot is only waited for and logged once the next training chunk is done.
+    """
+
+    def __init__(
+        self,
+        config: DictConfig,
+        logger: StoixLogger,
+        steps_per_rollout: int,
+        initial_params: FrozenDict,
+    ):
+        """
+        Args:
+            config: The experiment config.
+            logger: The logger of the experiment.
+            steps_per_rollout: The number of environment steps per training chunk.
+            initial_params: The evaluated params before training, i.e. the best params until a
+                snapshot is evaluated.
+        """
+        self.config = config
+        self.logger = logger
+        self.steps_per_rollout = steps_per_rollout
+        self.checkpointer: Optional[Checkpointer] = None
+        if config.logger.checkpointing.save_model:
+            self.checkpointer = Checkpointer(
+                metadata=config,  # Save all config as metadata in the checkpoint
+                model_name=config.system.system_name,
+                **config.logger.checkpointing.save_args,  # Checkpoint args
+            )
+        self.overlap_evaluation = evaluation_overlaps_training(config)
+        self.max_episode_return = jnp.float32(-1e7)
+        # The best params are kept on the host to not hold a copy of them on the devices.
+        self.best_params = jax.device_get(initial_params)
+        # Evaluations waiting to be logged.
+        self._pending_evaluations: List[Tuple] = []
+
+    def log_training(
+        self, learner_output: AnakinExperimentOutput, eval_step: int, elapsed_time: float
+    ) -> None:
+        """Log the timestep, peak memory, acting and training metrics of a training chunk."""
+        t = int(self.steps_per_rollout * (eval_step + 1))
+        episode_metrics, ep_completed = get_final_step_metrics(learner_output.episode_metrics)
+        episode_metrics["steps_per_second"] = self.steps_per_rollout / elapsed_time
+
+        # Separately log timesteps, actoring metrics and training metrics.
+        misc_metrics = {"timestep": t, **get_peak_memory_metrics(jax.local_devices())}
+        self.logger.log(misc_metrics, t, eval_step, LogEvent.MISC)
+        if ep_completed:  # only log episode metrics if an episode was completed in the rollout.
+            self.logger.log(episode_metrics, t, eval_step, LogEvent.ACT)
+        self.logger.log(learner_output.train_metrics, t, eval_step, LogEvent.TRAIN)
+
+    def add_evaluation(
+        self,
+        eval_step: int,
+        start_time: float,
+        trained_params: FrozenDict,
+        learner_state: Any,
+        evaluator_output: EvaluationOutput,
+    ) -> None:
+        """Add a dispatched evaluation of a snapshot and log the evaluations that are due.
+
+        The learner state is donated to the next training chunk, so the state to checkpoint is
+        unreplicated now, and copied to the host if it is only saved after that chunk.
+        """
+        checkpoint_state = None
+        if self.checkpointer is not None:
+            checkpoint_state = unreplicate_n_dims(learner_state)
+            if self.overlap_evaluation:
+                checkpoint_state = jax.device_get(checkpoint_state)
+        self._pending_evaluations.append(
+            (eval_step, start_time, trained_params, checkpoint_state, evaluator_output)
+        )
+        # Overlapping evaluations are logged once the next training chunk is done.
+        num_to_log = len(self._pending_evaluations)
+        if self.overlap_evaluation and eval_step < self.config.arch.num_evaluation - 1:
+            num_to_log -= 1
+        for _ in range(num_to_log):
+            self._log_evaluation(*self._pending_evaluations.pop(0))
+
+    def _log_evaluation(
+        self,
+        eval_step: int,
+        start_time: float,
+        trained_params: FrozenDict,
+        checkpoint_state: Any,
+        evaluator_output: EvaluationOutput,
+    ) -> None:
+        """Wait for an evaluation and log it against the step the snapshot was taken at."""
+        jax.block_until_ready(evaluator_output)
+
+        elapsed_time = time.time() - start_time
+        t = int(self.steps_per_rollout * (eval_step + 1))
+        episode_return = jnp.mean(evaluator_output.episode_metrics["episode_return"])
+
+        steps_per_eval = int(jnp.sum(evaluator_output.episode_metrics["episode_length"]))
+        evaluator_output.episode_metrics["steps_per_second"] = steps_per_eval / elapsed_time
+        self.logger.log(evaluator_output.episode_metrics, t, eval_step, LogEvent.EVAL)
+
+        if self.checkpointer is not None:
+            self.checkpointer.save(
+                timestep=t,
+                unreplicated_learner_state=checkpoint_state,
+                episode_return=episode_return,
+            )
+
+        if self.config.arch.absolute_metric and self.max_episode_return <= episode_return:
+            self.best_params = jax.device_get(trained_params)
+            self.max_episode_return = episode_return
+
+
 def get_sebulba_eval_fn(
     env_factory: EnvFactory,
     act_fn: ActFn,
@@ -364,73 +713,60 @@ def get_sebulba_eval_fn(
     eval_multiplier: float = 1.0,
 ) -> Tuple[SebulbaEvalFn, Any]:
 
-    eval_episodes = config.arch.num_eval_episodes * eval_multiplier
+    eval_episodes = int(config.arch.num_eval_episodes * eval_multiplier)
 
     # We calculate here the number of parallel envs we can run in parallel.
     # If the total number of episodes is less than the number of parallel envs
     # we will run all episodes in parallel.
-    # Otherwise we will run `num_envs` parallel envs and loop enough times
-    # so that we do at least `eval_episodes` number of episodes.
+    # Otherwise we will run `num_envs` parallel envs which start new episodes
+    # once they finish until exactly `eval_episodes` episodes are done.
     n_parallel_envs = int(min(eval_episodes, config.arch.total_num_envs))
-    episode_loops = math.ceil(eval_episodes / n_parallel_envs)
     envs = env_factory(n_parallel_envs)
     cpu = jax.devices("cpu")[0]
     act_fn = jax.jit(act_fn, device=device)
 
-    # Warnings if num eval episodes is not divisible by num parallel envs.
-    if eval_episodes % n_parallel_envs != 0:
-        msg = (
-            f"Please note that the number of evaluation episodes ({eval_episodes}) is not "
-            f"evenly divisible by `num_envs`. As a result, some additional evaluations will be "
-            f"conducted. The adjusted number of evaluation episodes is now "
-            f"{episode_loops * n_parallel_envs}."
-        )
-        print(f"{Fore.YELLOW}{Style.BRIGHT}{msg}{Style.RESET_ALL}")
-
     def eval_fn(params: FrozenDict, key: chex.PRNGKey) -> Dict:
-        def _run_episodes(key: chex.PRNGKey) -> Tuple[chex.PRNGKey, Dict]:
-            """Simulates `num_envs` episodes."""
-            with jax.default_device(device):
-                # Reset the environment.
-                seeds = np_rng.integers(np.iinfo(np.int32).max, size=n_parallel_envs).tolist()
-                timestep = envs.reset(seed=seeds)
-
-                all_metrics = [timestep.extras["metrics"]]
-                all_dones = [timestep.last()]
-                finished_eps = timestep.last()
-
-                # Loop until all episodes are done.
-                while not finished_eps.all():
-                    key, act_key = jax.random.split(key)
-                    action = act_fn(params, timestep.observation, act_key)
-                    action_cpu = np.asarray(jax.device_put(action, cpu))
-                    timestep = envs.step(action_cpu)
-                    all_metrics.append(timestep.extras["metrics"])
-                    all_dones.append(timestep.last())
-                    finished_eps = np.logical_or(finished_eps, timestep.last())
-
-                metrics = jax.tree.map(lambda *x: np.stack(x), *all_metrics)
-                dones = np.stack(all_dones)
-
-                # find the first instance of done to get the metrics at that timestep, we don't
-                # care about subsequent steps because we only the results from the first episode
-                done_idx = np.argmax(dones, axis=0)
-                metrics = jax.tree_map(lambda m: m[done_idx, np.arange(n_parallel_envs)], metrics)
-                del metrics["is_terminal_step"]  # unneeded for logging
-
-                return key, metrics
-
-        # This loop is important because we don't want too many parallel envs.
-        # So in evaluation we have num_envs parallel envs and loop enough times
-        # so that we do at least `eval_episodes` number of episodes.
-        metrics = []
-        for _ in range(episode_loops):
-            key, metric = _run_episodes(key)
-            metrics.append(metric)
-
-        metrics: Dict = jax.tree_map(
-            lambda *x: np.array(x).reshape(-1), *metrics
-        )  # flatten metrics
+        with jax.default_device(device):
+            # Reset the environment.
+            seeds = np_rng.integers(np.iinfo(np.int32).max, size=n_parallel_envs).tolist()
+            timestep = envs.reset(seed=seeds)
+
+            # An episode is counted when it starts, as long as episodes remain to be run.
+            # Envs that finish early pick up the remaining episodes. Counting episodes in the
+            # order they start, rather than the order they finish, avoids biasing the
+            # evaluation towards short episodes.
+            counted = np.ones(n_parallel_envs, dtype=bool)
+            episodes_remaining = eval_episodes - n_parallel_envs
+            all_metrics = []
+
+            # Loop until every counted episode is done. Envs start a new episode as
+            # soon as they finish one.
+            while counted.any():
+                key, act_key = jax.random.split(key)
+                action = act_fn(params, timestep.observation, act_key)
+                action_cpu = np.asarray(jax.device_put(action, cpu))
+                timestep = envs.step(action_cpu)
+
+                finished = np.asarray(timestep.last())
+                if not finished.any():
+                    continue
+                finished_counted = np.logical_and(finished, counted)
+                if finished_counted.any():
+                    all_metrics.append(
+                        jax.tree.map(
+                            lambda m, mask=finished_counted: np.asarray(m)[mask],
+                            timestep.extras["metrics"],
+                        )
+                    )
+
+                # The finished envs start new episodes, which are counted while any remain.
+                (restarted,) = np.nonzero(finished)
+                counted[restarted] = False
+                counted[restarted[:episodes_remaining]] = True
+                episodes_remaining -= min(len(restarted), episodes_remaining)
+
+        metrics: Dict = jax.tree.map(lambda *x: np.concatenate(x), *all_metrics)
+        del metrics["is_terminal_step"]  # unneeded for logging
         return metrics
 
     def timed_eval_fn(params: FrozenDict, key: chex.PRNGKey) -> Any:
@@ -445,3 +781,27 @@ def get_sebulba_eval_fn(
         return metrics
 
     return timed_eval_fn, envs
+
+
+def get_sebulba_async_evaluator(
+    env_factory: EnvFactory,
+    act_fn: ActFn,
+    config: DictConfig,
+    np_rng: np.random.Generator,
+    devices: Sequence[jax.Device],
+    lifetime: ThreadLifetime,
+) -> Tuple[AsyncEvaluator, List[Any]]:
+    """Create an `AsyncEvaluator` whose workers are spread round-robin over `devices`.
+    Each worker has its own environments and random number generator."""
+    eval_fns = []
+    worker_envs = []
+    for i in range(config.arch.evaluator.num_workers):
+        worker_rng = np.random.default_rng(np_rng.integers(np.iinfo(np.int32).max))
+        eval_fn, envs = get_sebulba_eval_fn(
+            env_factory, act_fn, config, worker_rng, devices[i % len(devices)]
+        )
+        eval_fns.append(eval_fn)
+        worker_envs.append(envs)
+
+    evaluator = AsyncEvaluator(eval_fns, config.arch.evaluator.max_pending_snapshots, lifetime)
+    return evaluator, worker_envs
@@ -4,7 +4,6 @@ from typing import Any, Callable, Dict, Tuple
 
 import chex
 import flashbax as fbx
-import flax
 import hydra
 import jax
 import jax.numpy as jnp
@@ -27,18 +26,28 @@ from stoix.base_types import (
     LearnerFn,
     LogEnvState,
 )
-from stoix.evaluator import evaluator_setup, get_distribution_act_fn
+from stoix.evaluator import (
+    AnakinExperimentLogger,
+    evaluator_setup,
+    get_distribution_act_fn,
+)
 from stoix.networks.base import FeedForwardActor as Actor
 from stoix.networks.base import FeedForwardCritic as Critic
 from stoix.systems.awr.awr_types import AWRLearnerState, SequenceStep
 from stoix.utils import make_env as environments
 from stoix.utils.checkpointing import Checkpointer
-from stoix.utils.jax_utils import unreplicate_batch_dim, unreplicate_n_dims
+from stoix.utils.compilation import compile_anakin_fns, configure_compilation_cache
+from stoix.utils.jax_utils import (
+    device_map,
+    get_anakin_learner_devices,
+    get_num_learner_replicas,
+    replicate_on_devices,
+    unreplicate_batch_dim,
+)
 from stoix.utils.logger import LogEvent, StoixLogger
 from stoix.utils.multistep import batch_truncated_generalized_advantage_estimation
 from stoix.utils.total_timestep_checker import check_total_timesteps
 from stoix.utils.training import make_learning_rate
-from stoix.wrappers.episode_metrics import get_final_step_metrics
 
 
 def get_warmup_fn(
@@ -350,7 +359,8 @@ def learner_setup(
 ) -> Tuple[LearnerFn[AWRLearnerState], Actor, AWRLearnerState]:
     """Initialise learner_fn, network, optimiser, environment and states."""
     # Get available TPU cores.
-    n_devices = len(jax.devices())
+    learner_devices = get_anakin_learner_devices(config)
+    n_devices = get_num_learner_replicas(config)
 
     # Get number of actions or action dimension from the environment.
     action_dim = int(env.action_spec().num_values)
@@ -444,10 +454,11 @@ def learner_setup(
 
     # Get batched iterated update and replicate it to pmap it over cores.
     learn = get_learner_fn(env, apply_fns, update_fns, buffer_fns, config)
-    learn = jax.pmap(learn, axis_name="device")
+    # The learner state is donated, so that its buffers are reused by the updated state.
+    learn = device_map(learn, config, learner_devices, donate_argnums=0)
 
     warmup = get_warmup_fn(env, params, actor_network_apply_fn, buffer_fn.add, config)
-    warmup = jax.pmap(warmup, axis_name="device")
+    warmup = device_map(warmup, config, learner_devices, donate_argnums=(0, 1, 2))
 
     # Initialise environment states and timesteps: across devices and batches.
     key, *env_keys = jax.random.split(
@@ -489,7 +500,7 @@ def learner_setup(
     replicate_learner = jax.tree_util.tree_map(broadcast, replicate_learner)
 
     # Duplicate learner across devices.
-    replicate_learner = flax.jax_utils.replicate(replicate_learner, devices=jax.devices())
+    replicate_learner = replicate_on_devices(replicate_learner, config, learner_devices)
 
     # Initialise learner state.
     params, opt_states, buffer_states = replicate_learner
@@ -507,9 +518,11 @@ def learner_setup(
 def run_experiment(_config: DictConfig) -> float:
     """Runs experiment."""
     config = copy.deepcopy(_config)
+    # The compilation cache must be configured before anything is compiled.
+    configure_compilation_cache(config)
 
     # Calculate total timesteps.
-    n_devices = len(jax.devices())
+    n_devices = get_num_learner_replicas(config)
     config.num_devices = n_devices
     config = check_total_timesteps(config)
     assert (
@@ -548,24 +561,31 @@ def run_experiment(_config: DictConfig) -> float:
         * config.arch.num_envs
     )
 
+    # Compile the learner and evaluators, ahead of time with `arch.aot_compile`.
+    learn, evaluator, absolute_metric_evaluator, compile_metrics = compile_anakin_fns(
+        config,
+        learn,
+        learner_state,
+        evaluator,
+        absolute_metric_evaluator,
+        (trained_params, eval_keys),
+    )
+
     # Logger setup
     logger = StoixLogger(config)
     cfg: Dict = OmegaConf.to_container(config, resolve=True)
     cfg["arch"]["devices"] = jax.devices()
     pprint(cfg)
+    # Log the compilation time separately from the training time.
+    if compile_metrics:
+        logger.log(compile_metrics, 0, 0, LogEvent.MISC)
 
-    # Set up checkpointer
-    save_checkpoint = config.logger.checkpointing.save_model
-    if save_checkpoint:
-        checkpointer = Checkpointer(
-            metadata=config,  # Save all config as metadata in the checkpoint
-            model_name=config.system.system_name,
-            **config.logger.checkpointing.save_args,  # Checkpoint args
-        )
+    # Set up the logging, checkpointing and best params tracking of the training and evaluation.
+    experiment_logger = AnakinExperimentLogger(
+        config, logger, steps_per_rollout, unreplicate_batch_dim(learner_state.params.actor_params)
+    )
 
     # Run experiment for a total number of evaluations.
-    max_episode_return = jnp.float32(-1e6)
-    best_params = unreplicate_batch_dim(learner_state.params.actor_params)
     for eval_step in range(config.arch.num_evaluation):
         # Train.
         start_time = time.time()
@@ -575,15 +595,7 @@ def run_experiment(_config: DictConfig) -> float:
 
         # Log the results of the training.
         elapsed_time = time.time() - start_time
-        t = int(steps_per_rollout * (eval_step + 1))
-        episode_metrics, ep_completed = get_final_step_metrics(learner_output.episode_metrics)
-        episode_metrics["steps_per_second"] = steps_per_rollout / elapsed_time
-
-        # Separately log timesteps, actoring metrics and training metrics.
-        logger.log({"timestep": t}, t, eval_step, LogEvent.MISC)
-        if ep_completed:  # only log episode metrics if an episode was completed in the rollout.
-            logger.log(episode_metrics, t, eval_step, LogEvent.ACT)
-        logger.log(learner_output.train_metrics, t, eval_step, LogEvent.TRAIN)
+        experiment_logger.log_training(learner_output, eval_step, elapsed_time)
 
         # Prepare for evaluation.
         start_time = time.time()
@@ -594,28 +606,13 @@ def run_experiment(_config: DictConfig) -> float:
         eval_keys = jnp.stack(eval_keys)
         eval_keys = eval_keys.reshape(n_devices, -1)
 
-        # Evaluate.
+        # Evaluate. The evaluation is dispatched asynchronously, so when it runs on devices
+        # that are not used for training it overlaps with the next training chunk.
         evaluator_output = evaluator(trained_params, eval_keys)
-        jax.block_until_ready(evaluator_output)
-
-        # Log the results of the evaluation.
-        elapsed_time = time.time() - start_time
-        episode_return = jnp.mean(evaluator_output.episode_metrics["episode_return"])
-
-        steps_per_eval = int(jnp.sum(evaluator_output.episode_metrics["episode_length"]))
-        evaluator_output.episode_metrics["steps_per_second"] = steps_per_eval / elapsed_time
-        logger.log(evaluator_output.episode_metrics, t, eval_step, LogEvent.EVAL)
-
-        if save_checkpoint:
-            checkpointer.save(
-                timestep=int(steps_per_rollout * (eval_step + 1)),
-                unreplicated_learner_state=unreplicate_n_dims(learner_output.learner_state),
-                episode_return=episode_return,
-            )
-
-        if config.arch.absolute_metric and max_episode_return <= episode_return:
-            best_params = copy.deepcopy(trained_params)
-            max_episode_return = episode_return
+        # Log the evaluation once it is done, against the step the snapshot was taken at.
+        experiment_logger.add_evaluation(
+            eval_step, start_time, trained_params, learner_output.learner_state, evaluator_output
+        )
 
         # Update runner state to continue training.
         learner_state = learner_output.learner_state
@@ -628,7 +625,7 @@ def run_experiment(_config: DictConfig) -> float:
         eval_keys = jnp.stack(eval_keys)
         eval_keys = eval_keys.reshape(n_devices, -1)
 
-        evaluator_output = absolute_metric_evaluator(best_params, eval_keys)
+        evaluator_output = absolute_metric_evaluator(experiment_logger.best_params, eval_keys)
         jax.block_until_ready(evaluator_output)
 
         elapsed_time = time.time() - start_time
@@ -3,8 +3,6 @@ import time
 from typing import Any, Callable, Dict, Tuple
 
 import chex
-import flashbax as fbx
-import flax
 import hydra
 import jax
 import jax.numpy as jnp
@@ -28,7 +26,11 @@ from stoix.base_types import (
     OffPolicyLearnerState,
     OnlineAndTarget,
 )
-from stoix.evaluator import evaluator_setup, get_distribution_act_fn
+from stoix.evaluator import (
+    AnakinExperimentLogger,
+    evaluator_setup,
+    get_distribution_act_fn,
+)
 from stoix.networks.base import CompositeNetwork
 from stoix.networks.base import FeedForwardActor as Actor
 from stoix.networks.base import MultiNetwork
@@ -37,11 +39,22 @@ from stoix.systems.ddpg.ddpg_types import DDPGOptStates, DDPGParams
 from stoix.systems.q_learning.dqn_types import Transition
 from stoix.utils import make_env as environments
 from stoix.utils.checkpointing import Checkpointer
-from stoix.utils.jax_utils import unreplicate_batch_dim, unreplicate_n_dims
+from stoix.utils.compilation import compile_anakin_fns, configure_compilation_cache
+from stoix.utils.jax_utils import (
+    device_map,
+    get_anakin_learner_devices,
+    get_num_learner_replicas,
+    replicate_on_devices,
+    unreplicate_batch_dim,
+)
 from stoix.utils.logger import LogEvent, StoixLogger
+from stoix.utils.replay_buffers import (
+    make_epoch_sample_fns,
+    make_item_buffer,
+    make_priority_fns,
+)
 from stoix.utils.total_timestep_checker import check_total_timesteps
-from stoix.utils.training import make_learning_rate
-from stoix.wrappers.episode_metrics import get_final_step_metrics
+from stoix.utils.training import make_learning_rate, scan_update_epochs
 
 
 def get_default_behavior_policy(config: DictConfig, actor_apply_fn: ActorApply) -> Callable:
@@ -119,7 +132,7 @@ def get_learner_fn(
     env: Environment,
     apply_fns: Tuple[ActorApply, ContinuousQApply],
     update_fns: Tuple[optax.TransformUpdateFn, optax.TransformUpdateFn],
-    buffer_fns: Tuple[Callable, Callable],
+    buffer_fns: Tuple[Callable, Callable, Callable, Callable, Callable],
     config: DictConfig,
 ) -> LearnerFn[OffPolicyLearnerState]:
     """Get the learner function."""
@@ -127,11 +140,17 @@ def get_learner_fn(
     # Get apply and update functions for actor and critic networks.
     actor_apply_fn, q_apply_fn = apply_fns
     actor_update_fn, q_update_fn = update_fns
-    buffer_add_fn, buffer_sample_fn = buffer_fns
+    (
+        buffer_add_fn,
+        presample_fn,
+        buffer_sample_fn,
+        importance_weights_fn,
+        set_priorities_fn,
+    ) = buffer_fns
     exploratory_actor_apply = get_default_behavior_policy(config, actor_apply_fn)
 
     def _update_step(
-        learner_state: OffPolicyLearnerState, _: Any
+        learner_state: OffPolicyLearnerState, rollout_index: chex.Array
     ) -> Tuple[OffPolicyLearnerState, Tuple]:
         def _env_step(
             learner_state: OffPolicyLearnerState, _: Any
@@ -172,7 +191,7 @@ def get_learner_fn(
         # Add the trajectory to the buffer.
         buffer_state = buffer_add_fn(buffer_state, traj_batch)
 
-        def _update_epoch(update_state: Tuple, _: Any) -> Tuple:
+        def _update_epoch(update_state: Tuple, epoch_sample: Any) -> Tuple:
             """Update the network for a single epoch."""
 
             def _q_loss_fn(
@@ -180,6 +199,7 @@ def get_learner_fn(
                 target_q_params: FrozenDict,
                 target_actor_params: FrozenDict,
                 transitions: Transition,
+                importance_weights: chex.Array,
                 rng_key: chex.PRNGKey,
             ) -> jnp.ndarray:
 
@@ -211,12 +231,14 @@ def get_learner_fn(
 
                 target_q = jax.lax.stop_gradient(r_t + d_t * next_v)
                 q_error = q_tm1 - jnp.expand_dims(target_q, -1)
-                q_loss = 0.5 * jnp.mean(jnp.square(q_error))
+                batch_loss = 0.5 * jnp.mean(jnp.square(q_error), axis=-1)
+                q_loss = jnp.mean(importance_weights * batch_loss)
 
                 loss_info = {
                     "q_loss": q_loss,
                     "q1_pred": jnp.mean(q_t[..., 0]),
                     "q2_pred": jnp.mean(q_t[..., 1]),
+                    "priorities": jnp.mean(jnp.abs(q_error), axis=-1),
                 }
 
                 return q_loss, loss_info
@@ -246,8 +268,9 @@ def get_learner_fn(
             key, sample_key = jax.random.split(key, num=2)
 
             # SAMPLE TRANSITIONS
-            transition_sample = buffer_sample_fn(buffer_state, sample_key)
+            transition_sample = buffer_sample_fn(buffer_state, sample_key, epoch_sample)
             transitions: Transition = transition_sample.experience
+            importance_weights = importance_weights_fn(buffer_state, transition_sample)
 
             # CALCULATE ACTOR LOSS
             actor_grad_fn = jax.grad(_actor_loss_fn, has_aux=True)
@@ -265,9 +288,14 @@ def get_learner_fn(
                 params.q_params.target,
                 params.actor_params.target,
                 transitions,
+                importance_weights,
                 q_loss_key,
             )
 
+            # Update priorities in the buffer.
+            priorities = q_loss_info.pop("priorities")
+            buffer_state = set_priorities_fn(buffer_state, transition_sample, priorities)
+
             # Compute the parallel mean (pmean) over the batch.
             # This calculation is inspired by the Anakin architecture demo notebook.
             # available at https://tinyurl.com/26tdzs5x
@@ -313,11 +341,13 @@ def get_learner_fn(
             }
             return (new_params, new_opt_state, buffer_state, key), loss_info
 
+        # With fused sampling, the batches of all the epochs are sampled at once.
+        key, epoch_samples = presample_fn(buffer_state, key)
         update_state = (params, opt_states, buffer_state, key)
 
         # UPDATE EPOCHS
-        update_state, loss_info = jax.lax.scan(
-            _update_epoch, update_state, None, config.system.epochs
+        update_state, loss_info = scan_update_epochs(
+            _update_epoch, update_state, rollout_index, config, epoch_samples
         )
 
         params, opt_states, buffer_state, key = update_state
@@ -341,7 +371,7 @@ def get_learner_fn(
         batched_update_step = jax.vmap(_update_step, in_axes=(0, None), axis_name="batch")
 
         learner_state, (episode_info, loss_info) = jax.lax.scan(
-            batched_update_step, learner_state, None, config.arch.num_updates_per_eval
+            batched_update_step, learner_state, jnp.arange(config.arch.num_updates_per_eval)
         )
         return AnakinExperimentOutput(
             learner_state=learner_state,
@@ -357,7 +387,8 @@ def learner_setup(
 ) -> Tuple[LearnerFn[OffPolicyLearnerState], Actor, OffPolicyLearnerState]:
     """Initialise learner_fn, network, optimiser, environment and states."""
     # Get available TPU cores.
-    n_devices = len(jax.devices())
+    learner_devices = get_anakin_learner_devices(config)
+    n_devices = get_num_learner_replicas(config)
 
     # Get number of actions.
     action_dim = int(env.action_spec().shape[-1])
@@ -390,8 +421,8 @@ def learner_setup(
 
     double_q_network = MultiNetwork([create_q_network(config), create_q_network(config)])
 
-    actor_lr = make_learning_rate(config.system.actor_lr, config, config.system.epochs)
-    q_lr = make_learning_rate(config.system.q_lr, config, config.system.epochs)
+    actor_lr = make_learning_rate(config.system.actor_lr, config, config.system.updates_per_rollout)
+    q_lr = make_learning_rate(config.system.q_lr, config, config.system.updates_per_rollout)
 
     def delayed_policy_update(step_count: int) -> bool:
         should_update: bool = jnp.mod(step_count, config.system.policy_frequency) == 0
@@ -463,22 +494,21 @@ def learner_setup(
     config.system.batch_size = config.system.total_batch_size // (
         n_devices * config.arch.update_batch_size
     )
-    buffer_fn = fbx.make_item_buffer(
-        max_length=config.system.buffer_size,
-        min_length=config.system.batch_size,
-        sample_batch_size=config.system.batch_size,
-        add_batches=True,
-        add_sequences=True,
+    buffer_fn = make_item_buffer(config, env.observation_spec())
+    buffer_fns = (
+        buffer_fn.add,
+        *make_epoch_sample_fns(buffer_fn, config),
+        *make_priority_fns(buffer_fn, config),
     )
-    buffer_fns = (buffer_fn.add, buffer_fn.sample)
     buffer_states = buffer_fn.init(dummy_transition)
 
     # Get batched iterated update and replicate it to pmap it over cores.
     learn = get_learner_fn(env, apply_fns, update_fns, buffer_fns, config)
-    learn = jax.pmap(learn, axis_name="device")
+    # The learner state is donated, so that its buffers are reused by the updated state.
+    learn = device_map(learn, config, learner_devices, donate_argnums=0)
 
     warmup = get_warmup_fn(env, params, actor_network_apply_fn, buffer_fn.add, config)
-    warmup = jax.pmap(warmup, axis_name="device")
+    warmup = device_map(warmup, config, learner_devices, donate_argnums=(0, 1, 2))
 
     # Initialise environment states and timesteps: across devices and batches.
     key, *env_keys = jax.random.split(
@@ -520,7 +550,7 @@ def learner_setup(
     replicate_learner = jax.tree_util.tree_map(broadcast, replicate_learner)
 
     # Duplicate learner across devices.
-    replicate_learner = flax.jax_utils.replicate(replicate_learner, devices=jax.devices())
+    replicate_learner = replicate_on_devices(replicate_learner, config, learner_devices)
 
     # Initialise learner state.
     params, opt_states, buffer_states = replicate_learner
@@ -538,9 +568,11 @@ def learner_setup(
 def run_experiment(_config: DictConfig) -> float:
     """Runs experiment."""
     config = copy.deepcopy(_config)
+    # The compilation cache must be configured before anything is compiled.
+    configure_compilation_cache(config)
 
     # Calculate total timesteps.
-    n_devices = len(jax.devices())
+    n_devices = get_num_learner_replicas(config)
     config.num_devices = n_devices
     config = check_total_timesteps(config)
     assert (
@@ -579,24 +611,34 @@ def run_experiment(_config: DictConfig) -> float:
         * config.arch.num_envs
     )
 
+    # Compile the learner and evaluators, ahead of time with `arch.aot_compile`.
+    learn, evaluator, absolute_metric_evaluator, compile_metrics = compile_anakin_fns(
+        config,
+        learn,
+        learner_state,
+        evaluator,
+        absolute_metric_evaluator,
+        (trained_params, eval_keys),
+    )
+
     # Logger setup
     logger = StoixLogger(config)
     cfg: Dict = OmegaConf.to_container(config, resolve=True)
     cfg["arch"]["devices"] = jax.devices()
     pprint(cfg)
-
-    # Set up checkpointer
-    save_checkpoint = config.logger.checkpointing.save_model
-    if save_checkpoint:
-        checkpointer = Checkpointer(
-            metadata=config,  # Save all config as metadata in the checkpoint
-            model_name=config.system.system_name,
-            **config.logger.checkpointing.save_args,  # Checkpoint args
-        )
+    # Log the compilation time separately from the training time.
+    if compile_metrics:
+        logger.log(compile_metrics, 0, 0, LogEvent.MISC)
+
+    # Set up the logging, checkpointing and best params tracking of the training and evaluation.
+    experiment_logger = AnakinExperimentLogger(
+        config,
+        logger,
+        steps_per_rollout,
+        unreplicate_batch_dim(learner_state.params.actor_params.online),
+    )
 
     # Run experiment for a total number of evaluations.
-    max_episode_return = jnp.float32(-1e7)
-    best_params = unreplicate_batch_dim(learner_state.params.actor_params.online)
     for eval_step in range(config.arch.num_evaluation):
         # Train.
         start_time = time.time()
@@ -606,15 +648,7 @@ def run_experiment(_config: DictConfig) -> float:
 
         # Log the results of the training.
         elapsed_time = time.time() - start_time
-        t = int(steps_per_rollout * (eval_step + 1))
-        episode_metrics, ep_completed = get_final_step_metrics(learner_output.episode_metrics)
-        episode_metrics["steps_per_second"] = steps_per_rollout / elapsed_time
-
-        # Separately log timesteps, actoring metrics and training metrics.
-        logger.log({"timestep": t}, t, eval_step, LogEvent.MISC)
-        if ep_completed:  # only log episode metrics if an episode was completed in the rollout.
-            logger.log(episode_metrics, t, eval_step, LogEvent.ACT)
-        logger.log(learner_output.train_metrics, t, eval_step, LogEvent.TRAIN)
+        experiment_logger.log_training(learner_output, eval_step, elapsed_time)
 
         # Prepare for evaluation.
         start_time = time.time()
@@ -625,28 +659,13 @@ def run_experiment(_config: DictConfig) -> float:
         eval_keys = jnp.stack(eval_keys)
         eval_keys = eval_keys.reshape(n_devices, -1)
 
-        # Evaluate.
+        # Evaluate. The evaluation is dispatched asynchronously, so when it runs on devices
+        # that are not used for training it overlaps with the next training chunk.
         evaluator_output = evaluator(trained_params, eval_keys)
-        jax.block_until_ready(evaluator_output)
-
-        # Log the results of the evaluation.
-        elapsed_time = time.time() - start_time
-        episode_return = jnp.mean(evaluator_output.episode_metrics["episode_return"])
-
-        steps_per_eval = int(jnp.sum(evaluator_output.episode_metrics["episode_length"]))
-        evaluator_output.episode_metrics["steps_per_second"] = steps_per_eval / elapsed_time
-        logger.log(evaluator_output.episode_metrics, t, eval_step, LogEvent.EVAL)
-
-        if save_checkpoint:
-            checkpointer.save(
-                timestep=int(steps_per_rollout * (eval_step + 1)),
-                unreplicated_learner_state=unreplicate_n_dims(learner_output.learner_state),
-                episode_return=episode_return,
-            )
-
-        if config.arch.absolute_metric and max_episode_return <= episode_return:
-            best_params = copy.deepcopy(trained_params)
-            max_episode_return = episode_return
+        # Log the evaluation once it is done, against the step the snapshot was taken at.
+        experiment_logger.add_evaluation(
+            eval_step, start_time, trained_params, learner_output.learner_state, evaluator_output
+        )
 
         # Update runner state to continue training.
         learner_state = learner_output.learner_state
@@ -659,7 +678,7 @@ def run_experiment(_config: DictConfig) -> float:
         eval_keys = jnp.stack(eval_keys)
         eval_keys = eval_keys.reshape(n_devices, -1)
 
-        evaluator_output = absolute_metric_evaluator(best_params, eval_keys)
+        evaluator_output = absolute_metric_evaluator(experiment_logger.best_params, eval_keys)
         jax.block_until_ready(evaluator_output)
 
         elapsed_time = time.time() - start_time
@@ -0,0 +1,459 @@
+import copy
+import time
+from typing import Callable, Dict, Sequence, Tuple
+
+import chex
+import flax
+import hydra
+import jax
+import jax.numpy as jnp
+import numpy as np
+import optax
+import rlax
+from colorama import Fore, Style
+from flax.core.frozen_dict import FrozenDict
+from omegaconf import DictConfig, OmegaConf
+from rich.pretty import pprint
+
+from stoix.base_types import (
+    ActorApply,
+    ContinuousQApply,
+    CoreLearnerState,
+    Observation,
+    OnlineAndTarget,
+    SebulbaExperimentOutput,
+    SebulbaLearnerFn,
+)
+from stoix.evaluator import (
+    get_distribution_act_fn,
+    get_sebulba_async_evaluator,
+    get_sebulba_eval_fn,
+)
+from stoix.networks.base import CompositeNetwork
+from stoix.networks.base import FeedForwardActor as Actor
+from stoix.networks.base import MultiNetwork
+from stoix.networks.postprocessors import tanh_to_spec
+from stoix.systems.ddpg.ddpg_types import DDPGOptStates, DDPGParams
+from stoix.systems.q_learning.dqn_types import Transition
+from stoix.utils import make_env as environments
+from stoix.utils.checkpointing import Checkpointer
+from stoix.utils.env_factory import EnvFactory
+from stoix.utils.logger import LogEvent, StoixLogger
+from stoix.utils.sebulba_utils import (
+    ThreadLifetime,
+    get_off_policy_devices,
+    run_off_policy_training,
+)
+from stoix.utils.total_timestep_checker import check_total_timesteps
+from stoix.utils.training import make_learning_rate
+
+
+def get_act_fn(
+    actor_apply_fn: ActorApply,
+    config: DictConfig,
+) -> Callable[[FrozenDict, Observation, chex.PRNGKey], chex.Array]:
+    """Get the act function that is used by the actor threads."""
+
+    def actor_fn(params: FrozenDict, observation: Observation, rng_key: chex.PRNGKey) -> chex.Array:
+        """Get the deterministic action from the policy and add exploration noise."""
+        action = actor_apply_fn(params, observation).mode()
+        action_scale = (config.system.action_maximum - config.system.action_minimum) / 2
+        if config.system.exploration_noise != 0:
+            action = rlax.add_gaussian_noise(
+                rng_key, action, config.system.exploration_noise * action_scale
+            ).clip(config.system.action_minimum, config.system.action_maximum)
+        return action
+
+    return actor_fn
+
+
+def get_learner_step_fn(
+    apply_fns: Tuple[ActorApply, ContinuousQApply],
+    update_fns: Tuple[optax.TransformUpdateFn, optax.TransformUpdateFn],
+    config: DictConfig,
+) -> SebulbaLearnerFn[CoreLearnerState, Transition]:
+    """Get the learner update function which is used to update the actor and critic.
+    This function is used by the learner thread to update the networks."""
+
+    # Get apply and update functions for actor and critic networks.
+    actor_apply_fn, q_apply_fn = apply_fns
+    actor_update_fn, q_update_fn = update_fns
+
+    def _update_epoch(update_state: Tuple, transitions: Transition) -> Tuple:
+        """Update the network for a single epoch on a single sampled batch."""
+
+        def _q_loss_fn(
+            q_params: FrozenDict,
+            target_q_params: FrozenDict,
+            target_actor_params: FrozenDict,
+            transitions: Transition,
+            rng_key: chex.PRNGKey,
+        ) -> jnp.ndarray:
+
+            q_tm1 = q_apply_fn(q_params, transitions.obs, transitions.action)
+            action_scale = (config.system.action_maximum - config.system.action_minimum) / 2
+            noise = (
+                jax.random.normal(rng_key, transitions.action.shape) * config.system.policy_noise
+            )
+            clipped_noise = (
+                jnp.clip(noise, -config.system.noise_clip, config.system.noise_clip) * action_scale
+            )
+            next_action = (
+                actor_apply_fn(target_actor_params, transitions.next_obs).mode() + clipped_noise
+            )
+            next_action = jnp.clip(
+                next_action, config.system.action_minimum, config.system.action_maximum
+            )
+            q_t = q_apply_fn(target_q_params, transitions.next_obs, next_action)
+            next_v = jnp.min(q_t, axis=-1)
+
+            # Cast and clip rewards.
+            discount = 1.0 - transitions.done.astype(jnp.float32)
+            d_t = (discount * config.system.gamma).astype(jnp.float32)
+            r_t = jnp.clip(
+                transitions.reward, -config.system.max_abs_reward, config.system.max_abs_reward
+            ).astype(jnp.float32)
+
+            target_q = jax.lax.stop_gradient(r_t + d_t * next_v)
+            q_error = q_tm1 - jnp.expand_dims(target_q, -1)
+            q_loss = 0.5 * jnp.mean(jnp.square(q_error))
+
+            loss_info = {
+                "q_loss": q_loss,
+                "q1_pred": jnp.mean(q_t[..., 0]),
+                "q2_pred": jnp.mean(q_t[..., 1]),
+            }
+
+            return q_loss, loss_info
+
+        def _actor_loss_fn(
+            actor_params: FrozenDict,
+            q_params: FrozenDict,
+            transitions: Transition,
+        ) -> chex.Array:
+            o_t = transitions.obs
+            a_t = (
+                actor_apply_fn(actor_params, o_t)
+                .mode()
+                .clip(config.system.action_minimum, config.system.action_maximum)
+            )
+            q_value = q_apply_fn(q_params, o_t, a_t)
+
+            actor_loss = -jnp.mean(q_value)
+
+            loss_info = {
+                "actor_loss": actor_loss,
+            }
+            return actor_loss, loss_info
+
+        params, opt_states, key = update_state
+
+        # CALCULATE ACTOR LOSS
+        actor_grad_fn = jax.grad(_actor_loss_fn, has_aux=True)
+        actor_grads, actor_loss_info = actor_grad_fn(
+            params.actor_params.online,
+            params.q_params.online,
+            transitions,
+        )
+
+        # CALCULATE Q LOSS
+        key, q_loss_key = jax.random.split(key)
+        q_grad_fn = jax.grad(_q_loss_fn, has_aux=True)
+        q_grads, q_loss_info = q_grad_fn(
+            params.q_params.online,
+            params.q_params.target,
+            params.actor_params.target,
+            transitions,
+            q_loss_key,
+        )
+
+        # pmean over devices.
+        actor_grads, actor_loss_info = jax.lax.pmean(
+            (actor_grads, actor_loss_info), axis_name="device"
+        )
+        q_grads, q_loss_info = jax.lax.pmean((q_grads, q_loss_info), axis_name="device")
+
+        # UPDATE ACTOR PARAMS AND OPTIMISER STATE
+        actor_updates, actor_new_opt_state = actor_update_fn(
+            actor_grads, opt_states.actor_opt_state
+        )
+        actor_new_online_params = optax.apply_updates(params.actor_params.online, actor_updates)
+
+        # UPDATE Q PARAMS AND OPTIMISER STATE
+        q_updates, q_new_opt_state = q_update_fn(q_grads, opt_states.q_opt_state)
+        q_new_online_params = optax.apply_updates(params.q_params.online, q_updates)
+        # Target network polyak update.
+        new_target_actor_params, new_target_q_params = optax.incremental_update(
+            (actor_new_online_params, q_new_online_params),
+            (params.actor_params.target, params.q_params.target),
+            config.system.tau,
+        )
+
+        actor_new_params = OnlineAndTarget(actor_new_online_params, new_target_actor_params)
+        q_new_params = OnlineAndTarget(q_new_online_params, new_target_q_params)
+
+        # PACK NEW PARAMS AND OPTIMISER STATE
+        new_params = DDPGParams(actor_new_params, q_new_params)
+        new_opt_state = DDPGOptStates(actor_new_opt_state, q_new_opt_state)
+
+        # PACK LOSS INFO
+        loss_info = {
+            **actor_loss_info,
+            **q_loss_info,
+        }
+        return (new_params, new_opt_state, key), loss_info
+
+    def learner_step_fn(
+        learner_state: CoreLearnerState, traj_batch: Transition
+    ) -> SebulbaExperimentOutput[CoreLearnerState]:
+        """Learner function.
+
+        This function represents the learner, it updates the network parameters
+        by applying the `_update_epoch` function to each of the `epochs` batches
+        sampled from the replay buffer.
+
+        Args:
+            learner_state (NamedTuple):
+                - params (DDPGParams): The initial model parameters.
+                - opt_states (DDPGOptStates): The initial optimizer state.
+                - key (chex.PRNGKey): The random number generator state.
+                - timestep (TimeStep): Unused by off-policy learners.
+            traj_batch (Transition): The sampled transitions of shape [epochs, batch_size, ...].
+        """
+        params, opt_states, key, timestep = learner_state
+
+        # UPDATE EPOCHS
+        (params, opt_states, key), loss_info = jax.lax.scan(
+            _update_epoch, (params, opt_states, key), traj_batch
+        )
+
+        learner_state = CoreLearnerState(params, opt_states, key, timestep)
+
+        return SebulbaExperimentOutput(
+            learner_state=learner_state,
+            train_metrics=loss_info,
+        )
+
+    return learner_step_fn
+
+
+def learner_setup(
+    env_factory: EnvFactory,
+    keys: chex.Array,
+    learner_devices: Sequence[jax.Device],
+    config: DictConfig,
+) -> Tuple[SebulbaLearnerFn[CoreLearnerState, Transition], Actor, CoreLearnerState]:
+    """Setup for the learner state and networks."""
+
+    # Create a single environment just to get the observation and action specs.
+    env = env_factory(num_envs=1)
+    # Get number of actions or action dimension from the environment.
+    action_dim = int(env.action_spec().shape[-1])
+    config.system.action_dim = action_dim
+    config.system.action_minimum = float(np.min(env.action_spec().minimum))
+    config.system.action_maximum = float(np.max(env.action_spec().maximum))
+    example_obs = env.observation_spec().generate_value()
+    env.close()
+
+    # PRNG keys.
+    key, actor_net_key, q_net_key = keys
+
+    # Define actor_network, q_network and optimiser.
+    actor_torso = hydra.utils.instantiate(config.network.actor_network.pre_torso)
+    actor_action_head = hydra.utils.instantiate(
+        config.network.actor_network.action_head, action_dim=action_dim
+    )
+    action_head_post_processor = hydra.utils.instantiate(
+        config.network.actor_network.post_processor,
+        minimum=config.system.action_minimum,
+        maximum=config.system.action_maximum,
+        scale_fn=tanh_to_spec,
+    )
+    actor_action_head = CompositeNetwork([actor_action_head, action_head_post_processor])
+    actor_network = Actor(torso=actor_torso, action_head=actor_action_head)
+
+    def create_q_network(cfg: DictConfig) -> CompositeNetwork:
+        q_network_input = hydra.utils.instantiate(cfg.network.q_network.input_layer)
+        q_network_torso = hydra.utils.instantiate(cfg.network.q_network.pre_torso)
+        q_network_head = hydra.utils.instantiate(cfg.network.q_network.critic_head)
+        return CompositeNetwork([q_network_input, q_network_torso, q_network_head])
+
+    double_q_network = MultiNetwork([create_q_network(config), create_q_network(config)])
+
+    actor_lr = make_learning_rate(config.system.actor_lr, config, config.system.epochs)
+    q_lr = make_learning_rate(config.system.q_lr, config, config.system.epochs)
+
+    def delayed_policy_update(step_count: int) -> bool:
+        should_update: bool = jnp.mod(step_count, config.system.policy_frequency) == 0
+        return should_update
+
+    actor_optim = optax.conditionally_mask(
+        optax.chain(
+            optax.clip_by_global_norm(config.system.max_grad_norm),
+            optax.adam(actor_lr, eps=1e-5),
+        ),
+        should_transform_fn=delayed_policy_update,
+    )
+    q_optim = optax.chain(
+        optax.clip_by_global_norm(config.system.max_grad_norm),
+        optax.adam(q_lr, eps=1e-5),
+    )
+
+    # Initialise observation
+    init_x = example_obs
+    init_x = jax.tree_util.tree_map(lambda x: x[None, ...], init_x)
+    init_a = jnp.zeros((1, action_dim))
+
+    # Initialise actor params and optimiser state.
+    actor_online_params = actor_network.init(actor_net_key, init_x)
+    actor_target_params = actor_online_params
+    actor_opt_state = actor_optim.init(actor_online_params)
+
+    actor_params = OnlineAndTarget(actor_online_params, actor_target_params)
+
+    # Initialise critic params and optimiser state.
+    q_online_params = double_q_network.init(q_net_key, init_x, init_a)
+    q_target_params = q_online_params
+
+    q_params = OnlineAndTarget(q_online_params, q_target_params)
+
+    q_opt_state = q_optim.init(q_online_params)
+
+    params = DDPGParams(actor_params, q_params)
+    opt_states = DDPGOptStates(actor_opt_state, q_opt_state)
+
+    # Pack apply and update functions.
+    apply_fns = (actor_network.apply, double_q_network.apply)
+    update_fns = (actor_optim.update, q_optim.update)
+
+    # Get batched iterated update and replicate it to pmap it over cores.
+    learn_step = get_learner_step_fn(apply_fns, update_fns, config)
+    learn_step = jax.pmap(learn_step, axis_name="device", devices=learner_devices)
+
+    # Load model from checkpoint if specified.
+    if config.logger.checkpointing.load_model:
+        loaded_checkpoint = Checkpointer(
+            model_name=config.system.system_name,
+            **config.logger.checkpointing.load_args,  # Other checkpoint args
+        )
+        # Restore the learner state from the checkpoint
+        restored_params, _ = loaded_checkpoint.restore_params(TParams=DDPGParams)
+        # Update the params
+        params = restored_params
+
+    # Define params to be replicated across learner devices.
+    replicate_learner = (params, opt_states)
+
+    # Duplicate across learner devices.
+    replicate_learner = flax.jax_utils.replicate(replicate_learner, devices=learner_devices)
+
+    # Initialise learner state.
+    params, opt_states = replicate_learner
+    key, step_key = jax.random.split(key)
+    step_keys = jax.random.split(step_key, len(learner_devices))
+    init_learner_state = CoreLearnerState(params, opt_states, step_keys, None)
+
+    return learn_step, actor_network, init_learner_state
+
+
+def run_experiment(_config: DictConfig) -> float:
+    """Runs experiment."""
+    config = copy.deepcopy(_config)
+
+    # Get the actor, learner and evaluator devices
+    actor_devices, learner_devices, evaluator_devices = get_off_policy_devices(config)
+
+    # Perform some checks on the config
+    # This additionally calculates certains
+    # values based on the config
+    config = check_total_timesteps(config)
+
+    # Create the environment factory.
+    env_factory = environments.make_factory(config)
+    assert isinstance(
+        env_factory, EnvFactory
+    ), "Environment factory must be an instance of EnvFactory"
+
+    # PRNG keys.
+    key, key_e, actor_net_key, q_net_key = jax.random.split(
+        jax.random.PRNGKey(config.arch.seed), num=4
+    )
+    np_rng = np.random.default_rng(config.arch.seed)
+
+    # Setup learner.
+    learn_step, actor_network, learner_state = learner_setup(
+        env_factory, (key, actor_net_key, q_net_key), learner_devices, config
+    )
+    eval_act_fn = get_distribution_act_fn(config, actor_network.apply)
+    # Setup evaluator.
+    evaluator_lifetime = ThreadLifetime()
+    evaluator, evaluator_envs = get_sebulba_async_evaluator(
+        env_factory, eval_act_fn, config, np_rng, evaluator_devices, evaluator_lifetime
+    )
+    evaluator.start()
+
+    # Logger setup
+    logger = StoixLogger(config)
+    cfg: Dict = OmegaConf.to_container(config, resolve=True)
+    cfg["arch"]["devices"] = jax.devices()
+    pprint(cfg)
+
+    # Run the actors, the learner and the evaluator until training is done.
+    eval_metrics, best_params, t, eval_step = run_off_policy_training(
+        config,
+        env_factory,
+        learn_step,
+        learner_state,
+        get_act_fn(actor_network.apply, config),
+        Transition,
+        lambda params: params.actor_params.online,
+        evaluator,
+        logger,
+        key,
+        np_rng,
+        actor_devices,
+        learner_devices,
+    )
+    for envs in evaluator_envs:
+        envs.close()
+    eval_performance = float(jnp.mean(eval_metrics[config.env.eval_metric]))
+
+    # Measure absolute metric.
+    if config.arch.absolute_metric:
+        print(f"{Fore.MAGENTA}{Style.BRIGHT}Measuring absolute metric...{Style.RESET_ALL}")
+        abs_metric_evaluator, abs_metric_evaluator_envs = get_sebulba_eval_fn(
+            env_factory, eval_act_fn, config, np_rng, evaluator_devices[0], eval_multiplier=10
+        )
+        eval_metrics = abs_metric_evaluator(best_params, key_e)
+
+        logger.log(eval_metrics, t, eval_step, LogEvent.ABSOLUTE)
+        abs_metric_evaluator_envs.close()
+
+    # Stop the logger.
+    logger.stop()
+
+    return eval_performance
+
+
+@hydra.main(
+    config_path="../../../configs/default/sebulba",
+    config_name="default_ff_td3.yaml",
+    version_base="1.2",
+)
+def hydra_entry_point(cfg: DictConfig) -> float:
+    """Experiment entry point."""
+    # Allow dynamic attributes.
+    OmegaConf.set_struct(cfg, False)
+
+    # Run experiment.
+    start = time.monotonic()
+    eval_performance = run_experiment(cfg)
+    end = time.monotonic()
+    print(
+        f"{Fore.CYAN}{Style.BRIGHT}TD3 experiment completed in {end - start:.2f}s.{Style.RESET_ALL}"
+    )
+    return eval_performance
+
+
+if __name__ == "__main__":
+    hydra_entry_point()
@@ -5,7 +5,7 @@ import time
 import warnings
 from collections import defaultdict
 from queue import Queue
-from typing import Any, Callable, Dict, List, Sequence, Tuple
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 import chex
 import flax
@@ -16,7 +16,7 @@ import numpy as np
 import optax
 from colorama import Fore, Style
 from flax.core.frozen_dict import FrozenDict
-from flax.jax_utils import unreplicate
+from jumanji.types import TimeStep
 from omegaconf import DictConfig, OmegaConf
 from rich.pretty import pprint
 
@@ -30,26 +30,41 @@ from stoix.base_types import (
     SebulbaExperimentOutput,
     SebulbaLearnerFn,
 )
-from stoix.evaluator import get_distribution_act_fn, get_sebulba_eval_fn
+from stoix.evaluator import (
+    get_distribution_act_fn,
+    get_sebulba_async_evaluator,
+    get_sebulba_eval_fn,
+)
 from stoix.networks.base import FeedForwardActor as Actor
 from stoix.networks.base import FeedForwardCritic as Critic
 from stoix.systems.ppo.ppo_types import PPOTransition
 from stoix.utils import make_env as environments
 from stoix.utils.checkpointing import Checkpointer
 from stoix.utils.env_factory import EnvFactory
-from stoix.utils.jax_utils import merge_leading_dims
+from stoix.utils.jax_utils import merge_leading_dims, unreplicate_local
 from stoix.utils.logger import LogEvent, StoixLogger
 from stoix.utils.loss import clipped_value_loss, ppo_clip_loss
 from stoix.utils.multistep import batch_truncated_generalized_advantage_estimation
 from stoix.utils.sebulba_utils import (
+    EvaluationRecorder,
     OnPolicyPipeline,
     ParamsSource,
     RecordTimeTo,
     ThreadLifetime,
+    get_evaluator_devices,
+    get_global_learner_devices,
+    get_rollout_buffer_fns,
+    initialize_distributed,
+    stop_sebulba_threads,
 )
 from stoix.utils.total_timestep_checker import check_total_timesteps
 from stoix.utils.training import make_learning_rate
 from stoix.wrappers.episode_metrics import get_final_step_metrics
+from stoix.wrappers.jax_to_factory import (
+    JaxEnvFactory,
+    JaxToStateful,
+    JaxToStatefulState,
+)
 
 
 def get_act_fn(
@@ -74,6 +89,185 @@ def get_act_fn(
     return actor_fn
 
 
+def get_fused_rollout_fn(
+    envs: JaxToStateful,
+    apply_fns: Tuple[ActorApply, CriticApply],
+    config: DictConfig,
+) -> Callable[
+    [ActorCriticParams, JaxToStatefulState, TimeStep, chex.PRNGKey],
+    Tuple[JaxToStatefulState, TimeStep, chex.PRNGKey, PPOTransition],
+]:
+    """Get the fused rollout function used by actors with JAX environments. It scans the
+    policy sampling, the environment step and the metric accounting over the whole rollout
+    so that the trajectory is created on the actor device without any host round trips."""
+    act_fn = get_act_fn(apply_fns)
+
+    def fused_rollout_fn(
+        params: ActorCriticParams,
+        env_state: JaxToStatefulState,
+        timestep: TimeStep,
+        rng_key: chex.PRNGKey,
+    ) -> Tuple[JaxToStatefulState, TimeStep, chex.PRNGKey, PPOTransition]:
+        def _env_step(
+            carry: Tuple[JaxToStatefulState, TimeStep, chex.PRNGKey], _: Any
+        ) -> Tuple[Tuple[JaxToStatefulState, TimeStep, chex.PRNGKey], PPOTransition]:
+            """Step the environment."""
+            env_state, last_timestep, rng_key = carry
+
+            # SELECT ACTION
+            rng_key, policy_key = jax.random.split(rng_key)
+            action, value, log_prob = act_fn(params, last_timestep.observation, policy_key)
+
+            # STEP ENVIRONMENT
+            env_state, timestep = envs.pure_step(env_state, action)
+
+            # Get the next dones and truncation flags
+            dones = jnp.logical_and(timestep.last(), timestep.discount == 0.0)
+            trunc = jnp.logical_and(timestep.last(), timestep.discount == 1.0)
+
+            transition = PPOTransition(
+                dones,
+                trunc,
+                action,
+                value,
+                timestep.reward,
+                log_prob,
+                last_timestep.observation,
+                timestep.extras["metrics"],
+            )
+            return (env_state, timestep, rng_key), transition
+
+        (env_state, timestep, rng_key), traj = jax.lax.scan(
+            _env_step, (env_state, timestep, rng_key), None, config.system.rollout_length
+        )
+        return env_state, timestep, rng_key, traj
+
+    return fused_rollout_fn
+
+
+CollectRolloutFn = Callable[
+    [TimeStep, chex.PRNGKey, Optional[PPOTransition], Dict[str, List[float]], List[Dict]],
+    Tuple[TimeStep, chex.PRNGKey, PPOTransition],
+]
+
+
+def get_fused_collect_fn(
+    envs: JaxToStateful,
+    actor_device: jax.Device,
+    params_source: ParamsSource,
+    apply_fns: Tuple[ActorApply, CriticApply],
+    config: DictConfig,
+) -> CollectRolloutFn:
+    """Get the function that collects a rollout from JAX environments placed on the actor
+    device. Acting and stepping are fused into a single jitted call per rollout."""
+    fused_rollout_fn = get_fused_rollout_fn(envs, apply_fns, config)
+    fused_rollout_fn = jax.jit(fused_rollout_fn, device=actor_device)
+
+    def collect_fn(
+        timestep: TimeStep,
+        rng_key: chex.PRNGKey,
+        traj: Optional[PPOTransition],
+        actor_timings_dict: Dict[str, List[float]],
+        episode_metrics: List[Dict],
+    ) -> Tuple[TimeStep, chex.PRNGKey, PPOTransition]:
+        # Get the latest parameters from the source, they are used for the whole rollout
+        with RecordTimeTo(actor_timings_dict["get_params_time"]):
+            params = params_source.get()
+        actor_timings_dict["param_lag"].append(params_source.param_lag())
+
+        # Act and step the environments for the whole rollout in a single
+        # device call. Only the final env state and timestep are kept.
+        with RecordTimeTo(actor_timings_dict["fused_rollout_time"]):
+            env_state, timestep, rng_key, traj = fused_rollout_fn(
+                params, envs.get_state(), timestep, rng_key
+            )
+            envs.set_state(env_state)
+            traj = jax.block_until_ready(traj)
+        # [rollout_len, num_envs] --> [rollout_len * num_envs]
+        episode_metrics.append(jax.tree.map(lambda x: x.reshape(-1), traj.info))
+        return timestep, rng_key, traj
+
+    return collect_fn
+
+
+def get_stepwise_collect_fn(
+    envs: Any,
+    actor_device: jax.Device,
+    params_source: ParamsSource,
+    apply_fns: Tuple[ActorApply, CriticApply],
+    config: DictConfig,
+) -> CollectRolloutFn:
+    """Get the function that collects a rollout by acting on the actor device and stepping
+    the environments on the CPU, one step at a time."""
+    act_fn = get_act_fn(apply_fns)
+    act_fn = jax.jit(act_fn, device=actor_device)
+    cpu = jax.devices("cpu")[0]
+    move_to_device = lambda tree: jax.tree.map(lambda x: jax.device_put(x, actor_device), tree)
+    split_key_fn = jax.jit(jax.random.split, device=actor_device)
+    init_buffer_fn, write_buffer_fn = get_rollout_buffer_fns(
+        config.system.rollout_length, actor_device
+    )
+
+    def collect_fn(
+        timestep: TimeStep,
+        rng_key: chex.PRNGKey,
+        traj: Optional[PPOTransition],
+        actor_timings_dict: Dict[str, List[float]],
+        episode_metrics: List[Dict],
+    ) -> Tuple[TimeStep, chex.PRNGKey, PPOTransition]:
+        # Loop until the rollout length is reached
+        for step in range(config.system.rollout_length):
+            # Get the latest parameters from the source
+            with RecordTimeTo(actor_timings_dict["get_params_time"]):
+                params = params_source.get()
+            actor_timings_dict["param_lag"].append(params_source.param_lag())
+
+            # Move the environment data to the actor device
+            cached_obs = move_to_device(timestep.observation)
+
+            # Run the actor and critic networks to get the action, value and log_prob
+            with RecordTimeTo(actor_timings_dict["compute_action_time"]):
+                rng_key, policy_key = split_key_fn(rng_key)
+                action, value, log_prob = act_fn(params, cached_obs, policy_key)
+
+            # Move the action to the CPU
+            action_cpu = np.asarray(jax.device_put(action, cpu))
+
+            # Step the environment
+            with RecordTimeTo(actor_timings_dict["env_step_time"]):
+                timestep = envs.step(action_cpu)
+
+            # Get the next dones and truncation flags
+            dones = np.logical_and(
+                np.asarray(timestep.last()), np.asarray(timestep.discount == 0.0)
+            )
+            trunc = np.logical_and(
+                np.asarray(timestep.last()), np.asarray(timestep.discount == 1.0)
+            )
+
+            # Write the PPOTransition into the rollout buffer in place
+            reward = timestep.reward
+            metrics = timestep.extras["metrics"]
+            transition = PPOTransition(
+                dones,
+                trunc,
+                action,
+                value,
+                reward,
+                log_prob,
+                cached_obs,
+                metrics,
+            )
+            with RecordTimeTo(actor_timings_dict["buffer_write_time"]):
+                if traj is None:
+                    traj = init_buffer_fn(transition)
+                traj = write_buffer_fn(traj, transition, step)
+            episode_metrics.append(metrics)
+        return timestep, rng_key, traj
+
+    return collect_fn
+
+
 def get_rollout_fn(
     env_factory: EnvFactory,
     actor_device: jax.Device,
@@ -85,14 +279,14 @@ def get_rollout_fn(
     thread_lifetime: ThreadLifetime,
 ) -> Callable[[chex.PRNGKey], None]:
     """Get the rollout function that is used by the actor threads."""
-    # Unpack and set up the functions
-    act_fn = get_act_fn(apply_fns)
-    act_fn = jax.jit(act_fn, device=actor_device)
-    cpu = jax.devices("cpu")[0]
-    move_to_device = lambda tree: jax.tree.map(lambda x: jax.device_put(x, actor_device), tree)
-    split_key_fn = jax.jit(jax.random.split, device=actor_device)
-    # Build the environments
-    envs = env_factory(config.arch.actor.num_envs_per_actor)
+    # Build the environments. JAX environments can be placed on the actor device so that
+    # acting and stepping are fused into a single jitted call per rollout.
+    if config.arch.actor.fused_jax_rollout and isinstance(env_factory, JaxEnvFactory):
+        envs = env_factory(config.arch.actor.num_envs_per_actor, device=actor_device)
+        collect_fn = get_fused_collect_fn(envs, actor_device, params_source, apply_fns, config)
+    else:
+        envs = env_factory(config.arch.actor.num_envs_per_actor)
+        collect_fn = get_stepwise_collect_fn(envs, actor_device, params_source, apply_fns, config)
 
     # Create the rollout function
     def rollout_fn(rng_key: chex.PRNGKey) -> None:
@@ -100,63 +294,21 @@ def get_rollout_fn(
         with jax.default_device(actor_device):
             # Reset the environment
             timestep = envs.reset(seed=seeds)
+            # The rollout buffer is created from the first transition and then reused for every
+            # rollout. The pipeline copies the rollout when sharding it, so the buffer can be
+            # donated to the next write once it has been put.
+            traj: Optional[PPOTransition] = None
 
             # Loop until the thread is stopped
             while not thread_lifetime.should_stop():
-                # Create the list to store transitions
-                traj: List[PPOTransition] = []
                 # Create the dictionary to store timings for metrics
                 actor_timings_dict: Dict[str, List[float]] = defaultdict(list)
                 episode_metrics: List[Dict[str, List[float]]] = []
                 # Rollout the environment
                 with RecordTimeTo(actor_timings_dict["single_rollout_time"]):
-                    # Loop until the rollout length is reached
-                    for _ in range(config.system.rollout_length):
-                        # Get the latest parameters from the source
-                        with RecordTimeTo(actor_timings_dict["get_params_time"]):
-                            params = params_source.get()
-
-                        # Move the environment data to the actor device
-                        cached_obs = move_to_device(timestep.observation)
-
-                        # Run the actor and critic networks to get the action, value and log_prob
-                        with RecordTimeTo(actor_timings_dict["compute_action_time"]):
-                            rng_key, policy_key = split_key_fn(rng_key)
-                            action, value, log_prob = act_fn(params, cached_obs, policy_key)
-
-                        # Move the action to the CPU
-                        action_cpu = np.asarray(jax.device_put(action, cpu))
-
-                        # Step the environment
-                        with RecordTimeTo(actor_timings_dict["env_step_time"]):
-                            timestep = envs.step(action_cpu)
-
-                        # Get the next dones and truncation flags
-                        dones = np.logical_and(
-                            np.asarray(timestep.last()), np.asarray(timestep.discount == 0.0)
-                        )
-                        trunc = np.logical_and(
-                            np.asarray(timestep.last()), np.asarray(timestep.discount == 1.0)
-                        )
-                        cached_next_dones = move_to_device(dones)
-                        cached_next_trunc = move_to_device(trunc)
-
-                        # Append PPOTransition to the trajectory list
-                        reward = timestep.reward
-                        metrics = timestep.extras["metrics"]
-                        traj.append(
-                            PPOTransition(
-                                cached_next_dones,
-                                cached_next_trunc,
-                                action,
-                                value,
-                                reward,
-                                log_prob,
-                                cached_obs,
-                                metrics,
-                            )
-                        )
-                        episode_metrics.append(metrics)
+                    timestep, rng_key, traj = collect_fn(
+                        timestep, rng_key, traj, actor_timings_dict, episode_metrics
+                    )
 
                 # Send the trajectory to the pipeline
                 with RecordTimeTo(actor_timings_dict["rollout_put_time"]):
@@ -458,7 +610,7 @@ def get_learner_rollout_fn(
                     q_sizes.append(pipeline.qsize())
 
                     # After the update we need to update the params sources with the new params
-                    unreplicated_params = unreplicate(learner_state.params)
+                    unreplicated_params = unreplicate_local(learner_state.params)
                     # We loop over all params sources and update them with the new params
                     # This is so that all the actors can get the latest params
                     for source in params_sources:
@@ -515,6 +667,7 @@ def learner_setup(
     env_factory: EnvFactory,
     keys: chex.Array,
     learner_devices: Sequence[jax.Device],
+    global_learner_devices: Sequence[jax.Device],
     config: DictConfig,
 ) -> Tuple[
     SebulbaLearnerFn[CoreLearnerState, PPOTransition],
@@ -586,7 +739,8 @@ def learner_setup(
 
     # Get batched iterated update and replicate it to pmap it over cores.
     learn_step = get_learner_step_fn(apply_fns, update_fns, config)
-    learn_step = jax.pmap(learn_step, axis_name="device")
+    # In multi-process runs the pmap spans the learner devices of every process.
+    learn_step = jax.pmap(learn_step, axis_name="device", devices=global_learner_devices)
 
     # Load model from checkpoint if specified.
     if config.logger.checkpointing.load_model:
@@ -609,29 +763,76 @@ def learner_setup(
     # Initialise learner state.
     params, opt_states = replicate_learner
     key, step_key = jax.random.split(key)
+    step_key = jax.random.fold_in(step_key, jax.process_index())
     step_keys = jax.random.split(step_key, len(learner_devices))
     init_learner_state = CoreLearnerState(params, opt_states, step_keys, None)
 
     return learn_step, apply_fns, init_learner_state
 
 
+def log_training(
+    config: DictConfig,
+    logger: StoixLogger,
+    learner_output: Tuple[List, Dict[str, chex.Array], CoreLearnerState, Dict[str, float]],
+    eval_step: int,
+    num_evaluator_skipped: int,
+) -> int:
+    """Log the actor, learner and timing metrics put on the evaluation queue by the learner
+    and return the timestep they were logged at."""
+    episode_metrics, train_metrics, _, timings_dict = learner_output
+    # Get the number of steps consumed by the learners of all processes per learner step
+    steps_per_learner_step = (
+        config.system.rollout_length
+        * config.arch.actor.num_envs_per_actor
+        * config.arch.distributed.num_processes
+    )
+
+    # Log the metrics and timings
+    t = int(steps_per_learner_step * config.arch.num_updates_per_eval * (eval_step + 1))
+    timings_dict["timestep"] = t
+    timings_dict["evaluator_skipped_snapshots"] = num_evaluator_skipped
+    logger.log(timings_dict, t, eval_step, LogEvent.MISC)
+
+    episode_metrics, ep_completed = get_final_step_metrics(episode_metrics)
+    # Calculate steps per second for actor
+    # Here we use the number of steps pushed to the pipeline each time
+    # and the average time it takes to do a single rollout across
+    # all the updates per evaluation
+    episode_metrics["steps_per_second"] = (
+        steps_per_learner_step / timings_dict["single_rollout_time"]
+    )
+    if ep_completed:
+        logger.log(episode_metrics, t, eval_step, LogEvent.ACT)
+
+    train_metrics["learner_step"] = (eval_step + 1) * config.arch.num_updates_per_eval
+    train_metrics["sgd_steps_per_second"] = (config.arch.num_updates_per_eval) / timings_dict[
+        "learner_time_per_eval"
+    ]
+    logger.log(train_metrics, t, eval_step, LogEvent.TRAIN)
+    return t
+
+
 def run_experiment(_config: DictConfig) -> float:
     """Runs experiment."""
     config = copy.deepcopy(_config)
 
+    # Connect to the other processes when running on multiple hosts
+    initialize_distributed(config)
+    assert (
+        jax.process_count() == config.arch.distributed.num_processes
+    ), "The number of JAX processes must match arch.distributed.num_processes"
+
     # Get the learner and actor devices
     local_devices = jax.local_devices()
     global_devices = jax.devices()
-    assert len(local_devices) == len(
-        global_devices
-    ), "Local and global devices must be the same for now. We dont support multihost just yet"
-    # Extract the actor and learner devices
+    # Extract the actor and learner devices. Device ids are local to each process.
     actor_devices = [local_devices[device_id] for device_id in config.arch.actor.device_ids]
     local_learner_devices = [
         local_devices[device_id] for device_id in config.arch.learner.device_ids
     ]
-    # For evaluation we simply use the first learner device
-    evaluator_device = local_learner_devices[0]
+    global_learner_devices = get_global_learner_devices(config.arch.learner.device_ids)
+    # Get the devices used by the evaluator workers
+    evaluator_devices = get_evaluator_devices(config, local_learner_devices)
     print(f"{Fore.BLUE}{Style.BRIGHT}Actors devices: {actor_devices}{Style.RESET_ALL}")
     print(f"{Fore.GREEN}{Style.BRIGHT}Learner devices: {local_learner_devices}{Style.RESET_ALL}")
     print(f"{Fore.MAGENTA}{Style.BRIGHT}Global devices: {global_devices}{Style.RESET_ALL}")
@@ -655,18 +856,25 @@ def run_experiment(_config: DictConfig) -> float:
     key, key_e, actor_net_key, critic_net_key = jax.random.split(
         jax.random.PRNGKey(config.arch.seed), num=4
     )
-    np_rng = np.random.default_rng(config.arch.seed)
-
-    # Setup learner.
+    # Setup learner. The network keys are shared so that every process starts from the same
+    # params, while the remaining randomness is made process specific.
     learn_step, apply_fns, learner_state = learner_setup(
-        env_factory, (key, actor_net_key, critic_net_key), local_learner_devices, config
+        env_factory,
+        (key, actor_net_key, critic_net_key),
+        local_learner_devices,
+        global_learner_devices,
+        config,
     )
+    key = jax.random.fold_in(key, jax.process_index())
+    np_rng = np.random.default_rng(config.arch.seed + jax.process_index())
     actor_apply_fn, _ = apply_fns
     eval_act_fn = get_distribution_act_fn(config, actor_apply_fn)
     # Setup evaluator.
-    evaluator, evaluator_envs = get_sebulba_eval_fn(
-        env_factory, eval_act_fn, config, np_rng, evaluator_device
+    evaluator_lifetime = ThreadLifetime()
+    evaluator, evaluator_envs = get_sebulba_async_evaluator(
+        env_factory, eval_act_fn, config, np_rng, evaluator_devices, evaluator_lifetime
     )
+    evaluator.start()
 
     # Logger setup
     logger = StoixLogger(config)
@@ -674,29 +882,23 @@ def run_experiment(_config: DictConfig) -> float:
     cfg["arch"]["devices"] = jax.devices()
     pprint(cfg)
 
-    # Set up checkpointer
-    save_checkpoint = config.logger.checkpointing.save_model
-    if save_checkpoint:
-        checkpointer = Checkpointer(
-            metadata=config,  # Save all config as metadata in the checkpoint
-            model_name=config.system.system_name,
-            **config.logger.checkpointing.save_args,  # Checkpoint args
-        )
-
     # Get initial parameters
-    initial_params = unreplicate(learner_state.params)
+    initial_params = unreplicate_local(learner_state.params)
 
-    # Get the number of steps consumed by the learner per learner step
-    steps_per_learner_step = config.system.rollout_length * config.arch.actor.num_envs_per_actor
-    # Get the number of steps consumed by the learner per evaluation
-    steps_consumed_per_eval = steps_per_learner_step * config.arch.num_updates_per_eval
+    # Set up the logging, checkpointing and best params tracking of the evaluations
+    recorder = EvaluationRecorder(
+        config, logger, lambda params: params.actor_params, initial_params.actor_params
+    )
 
     # Creating the pipeline
     # First we create the lifetime so we can stop the pipeline when we want
     pipeline_lifetime = ThreadLifetime()
     # Now we create the pipeline
     pipeline = OnPolicyPipeline(
-        config.arch.pipeline_queue_size, local_learner_devices, pipeline_lifetime
+        config.arch.pipeline_queue_size,
+        local_learner_devices,
+        pipeline_lifetime,
+        config.arch.pipeline_parallel_put,
     )
     # Start the pipeline
     pipeline.start()
@@ -711,7 +913,12 @@ def run_experiment(_config: DictConfig) -> float:
     for actor_device in actor_devices:
         # Create 1 params source per actor device as this will be used
         # to pass the params to the actors
-        params_source = ParamsSource(initial_params, actor_device, params_sources_lifetime)
+        params_source = ParamsSource(
+            initial_params,
+            actor_device,
+            params_sources_lifetime,
+            config.arch.params_compression,
+        )
         params_source.start()
         params_sources.append(params_source)
         # Now for each device we choose to create multiple actor threads
@@ -743,98 +950,50 @@ def run_experiment(_config: DictConfig) -> float:
     )
     learner_thread.start()
 
-    # Run experiment for a total number of evaluations.
-    max_episode_return = jnp.float32(-1e7)
-    best_params = initial_params.actor_params
-    # This is the main loop, all it does is evaluation and logging.
-    # Acting and learning is happening in their own threads.
-    # This loop waits for the learner to finish an update before evaluation and logging.
-    for eval_step in range(config.arch.num_evaluation):
-        # Get the next set of params and metrics from the learner
-        episode_metrics, train_metrics, learner_state, timings_dict = eval_queue.get(block=True)
-
-        # Log the metrics and timings
-        t = int(steps_consumed_per_eval * (eval_step + 1))
-        timings_dict["timestep"] = t
-        logger.log(timings_dict, t, eval_step, LogEvent.MISC)
-
-        episode_metrics, ep_completed = get_final_step_metrics(episode_metrics)
-        # Calculate steps per second for actor
-        # Here we use the number of steps pushed to the pipeline each time
-        # and the average time it takes to do a single rollout across
-        # all the updates per evaluation
-        episode_metrics["steps_per_second"] = (
-            steps_per_learner_step / timings_dict["single_rollout_time"]
+    # This is the main loop, all it does is logging and submitting params for evaluation.
+    # Acting, learning and evaluation are happening in their own threads.
+    # This loop waits for the learner to finish an update before logging.
+    # The threads are stopped even if an evaluation fails.
+    try:
+        for eval_step in range(config.arch.num_evaluation):
+            # Get the next set of params and metrics from the learner
+            learner_output = eval_queue.get(block=True)
+            t = log_training(config, logger, learner_output, eval_step, evaluator.num_skipped)
+
+            # Submit the current model for evaluation along with the step it was taken at
+            learner_state = learner_output[2]
+            unreplicated_actor_params = unreplicate_local(learner_state.params.actor_params)
+            key, eval_key = jax.random.split(key, 2)
+            evaluator.submit(unreplicated_actor_params, eval_key, (eval_step, t, learner_state))
+            # The last model is always evaluated, so we wait for it once the learner is done
+            if eval_step == config.arch.num_evaluation - 1:
+                evaluator.wait()
+
+            # Log the metrics of the models evaluated so far against the step they were taken at
+            recorder.record(evaluator.get_results())
+    finally:
+        evaluator.stop()
+        for envs in evaluator_envs:
+            envs.close()
+        stop_sebulba_threads(
+            learner_thread,
+            actor_threads,
+            actors_lifetime,
+            pipeline,
+            pipeline_lifetime,
+            params_sources,
+            params_sources_lifetime,
         )
-        if ep_completed:
-            logger.log(episode_metrics, t, eval_step, LogEvent.ACT)
-
-        train_metrics["learner_step"] = (eval_step + 1) * config.arch.num_updates_per_eval
-        train_metrics["sgd_steps_per_second"] = (config.arch.num_updates_per_eval) / timings_dict[
-            "learner_time_per_eval"
-        ]
-        logger.log(train_metrics, t, eval_step, LogEvent.TRAIN)
-
-        # Evaluate the current model and log the metrics
-        unreplicated_actor_params = unreplicate(learner_state.params.actor_params)
-        key, eval_key = jax.random.split(key, 2)
-        eval_metrics = evaluator(unreplicated_actor_params, eval_key)
-        logger.log(eval_metrics, t, eval_step, LogEvent.EVAL)
-
-        episode_return = jnp.mean(eval_metrics["episode_return"])
-
-        if save_checkpoint:
-            # Save checkpoint of learner state
-            checkpointer.save(
-                timestep=steps_consumed_per_eval * (eval_step + 1),
-                unreplicated_learner_state=unreplicate(learner_state),
-                episode_return=episode_return,
-            )
-
-        if config.arch.absolute_metric and max_episode_return <= episode_return:
-            best_params = copy.deepcopy(unreplicated_actor_params)
-            max_episode_return = episode_return
-
-    evaluator_envs.close()
-    eval_performance = float(jnp.mean(eval_metrics[config.env.eval_metric]))
-
-    print(f"{Fore.MAGENTA}{Style.BRIGHT}Closing learner...{Style.RESET_ALL}")
-    # Now we stop the learner
-    learner_thread.join()
-
-    # First we stop all actors
-    actors_lifetime.stop()
-
-    # Now we stop the actors and params sources
-    print(f"{Fore.MAGENTA}{Style.BRIGHT}Closing actors...{Style.RESET_ALL}")
-    pipeline.clear()
-    for actor in actor_threads:
-        # We clear the pipeline before stopping each actor thread
-        # since actors can be blocked on the pipeline
-        pipeline.clear()
-        actor.join()
-
-    print(f"{Fore.MAGENTA}{Style.BRIGHT}Closing pipeline...{Style.RESET_ALL}")
-    # Stop the pipeline
-    pipeline_lifetime.stop()
-    pipeline.join()
-
-    print(f"{Fore.MAGENTA}{Style.BRIGHT}Closing params sources...{Style.RESET_ALL}")
-    # Stop the params sources
-    params_sources_lifetime.stop()
-    for param_source in params_sources:
-        param_source.join()
-
+    eval_performance = float(jnp.mean(recorder.eval_metrics[config.env.eval_metric]))
     # Measure absolute metric.
     if config.arch.absolute_metric:
         print(f"{Fore.MAGENTA}{Style.BRIGHT}Measuring absolute metric...{Style.RESET_ALL}")
         abs_metric_evaluator, abs_metric_evaluator_envs = get_sebulba_eval_fn(
-            env_factory, eval_act_fn, config, np_rng, evaluator_device, eval_multiplier=10
+            env_factory, eval_act_fn, config, np_rng, evaluator_devices[0], eval_multiplier=10
         )
         key, eval_key = jax.random.split(key, 2)
-        eval_metrics = abs_metric_evaluator(best_params, eval_key)
+        eval_metrics = abs_metric_evaluator(recorder.best_params, eval_key)
 
-        t = int(steps_consumed_per_eval * (eval_step + 1))
         logger.log(eval_metrics, t, eval_step, LogEvent.ABSOLUTE)
         abs_metric_evaluator_envs.close()
 
@@ -3,6 +3,8 @@ from typing import Dict
 import chex
 from typing_extensions import NamedTuple
 
+from stoix.base_types import Action, Done, HiddenStates, Truncated
+
 
 class Transition(NamedTuple):
     obs: chex.ArrayTree
@@ -11,3 +13,14 @@ class Transition(NamedTuple):
     done: chex.Array
     next_obs: chex.Array
     info: Dict
+
+
+class RNNSequenceStep(NamedTuple):
+    obs: chex.ArrayTree
+    action: Action
+    reward: chex.Array
+    done: Done
+    truncated: Truncated
+    reset_hidden_state: chex.Array  # Whether the hidden state is reset before this step.
+    hstate: HiddenStates  # Hidden state before this step.
+    info: Dict
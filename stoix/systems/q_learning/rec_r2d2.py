@@ -0,0 +1,775 @@
+import copy
+import time
+from typing import Any, Callable, Dict, Tuple
+
+import chex
+import hydra
+import jax
+import jax.numpy as jnp
+import optax
+import rlax
+from colorama import Fore, Style
+from flashbax.buffers.trajectory_buffer import BufferState
+from flax.core.frozen_dict import FrozenDict
+from jumanji.env import Environment
+from jumanji.types import TimeStep
+from omegaconf import DictConfig, OmegaConf
+from rich.pretty import pprint
+
+from stoix.base_types import (
+    AnakinExperimentOutput,
+    Done,
+    HiddenStates,
+    LearnerFn,
+    LogEnvState,
+    OnlineAndTarget,
+    RecActorApply,
+    RNNOffPolicyLearnerState,
+    Truncated,
+)
+from stoix.evaluator import (
+    AnakinExperimentLogger,
+    evaluator_setup,
+    get_rec_distribution_act_fn,
+)
+from stoix.networks.base import RecurrentActor, ScannedRNN
+from stoix.systems.q_learning.dqn_types import RNNSequenceStep
+from stoix.utils import make_env as environments
+from stoix.utils.checkpointing import Checkpointer
+from stoix.utils.compilation import compile_anakin_fns, configure_compilation_cache
+from stoix.utils.jax_utils import (
+    device_map,
+    get_anakin_learner_devices,
+    get_num_learner_replicas,
+    replicate_on_devices,
+    unreplicate_batch_dim,
+)
+from stoix.utils.logger import LogEvent, StoixLogger
+from stoix.utils.multistep import batch_n_step_bootstrapped_returns
+from stoix.utils.replay_buffers import (
+    make_epoch_sample_fns,
+    make_priority_fns,
+    make_trajectory_buffer,
+)
+from stoix.utils.total_timestep_checker import check_total_timesteps
+from stoix.utils.training import make_learning_rate, scan_update_epochs
+
+
+def get_warmup_fn(
+    env: Environment,
+    q_params: FrozenDict,
+    q_apply_fn: RecActorApply,
+    buffer_add_fn: Callable,
+    config: DictConfig,
+) -> Callable:
+    def warmup(
+        env_states: LogEnvState,
+        timesteps: TimeStep,
+        dones: Done,
+        truncated: Truncated,
+        hstates: HiddenStates,
+        buffer_states: BufferState,
+        keys: chex.PRNGKey,
+    ) -> Tuple[LogEnvState, TimeStep, Done, Truncated, HiddenStates, BufferState, chex.PRNGKey]:
+        def _env_step(carry: Tuple, _: Any) -> Tuple[Tuple, RNNSequenceStep]:
+            """Step the environment."""
+
+            env_state, last_timestep, last_done, last_truncated, hstate, key = carry
+            # SELECT ACTION
+            key, policy_key = jax.random.split(key)
+            batched_observation = jax.tree_util.tree_map(
+                lambda x: x[jnp.newaxis, :], last_timestep.observation
+            )
+            reset_hidden_state = jnp.logical_or(last_done, last_truncated)
+            q_in = (batched_observation, reset_hidden_state[jnp.newaxis, :])
+            next_hstate, actor_policy = q_apply_fn(q_params.online, hstate, q_in)
+            action = actor_policy.sample(seed=policy_key).squeeze(0)
+
+            # STEP ENVIRONMENT
+            env_state, timestep = jax.vmap(env.step, in_axes=(0, 0))(env_state, action)
+
+            # LOG EPISODE METRICS
+            done = (timestep.discount == 0.0).reshape(-1)
+            truncated = (timestep.last() & (timestep.discount != 0.0)).reshape(-1)
+            info = timestep.extras["episode_metrics"]
+
+            sequence_step = RNNSequenceStep(
+                last_timestep.observation,
+                action,
+                timestep.reward,
+                done,
+                truncated,
+                reset_hidden_state,
+                hstate,
+                info,
+            )
+
+            return (env_state, timestep, done, truncated, next_hstate, key), sequence_step
+
+        # STEP ENVIRONMENT FOR ROLLOUT LENGTH
+        (env_states, timesteps, dones, truncated, hstates, keys), traj_batch = jax.lax.scan(
+            _env_step,
+            (env_states, timesteps, dones, truncated, hstates, keys),
+            None,
+            config.system.warmup_steps,
+        )
+
+        # Add the trajectory to the buffer.
+        # Swap the batch and time axes.
+        traj_batch = jax.tree_util.tree_map(lambda x: jnp.swapaxes(x, 0, 1), traj_batch)
+        buffer_states = buffer_add_fn(buffer_states, traj_batch)
+
+        return env_states, timesteps, dones, truncated, hstates, buffer_states, keys
+
+    batched_warmup_step: Callable = jax.vmap(
+        warmup,
+        in_axes=(0, 0, 0, 0, 0, 0, 0),
+        out_axes=(0, 0, 0, 0, 0, 0, 0),
+        axis_name="batch",
+    )
+
+    return batched_warmup_step
+
+
+def get_learner_fn(
+    env: Environment,
+    q_apply_fn: RecActorApply,
+    q_update_fn: optax.TransformUpdateFn,
+    buffer_fns: Tuple[Callable, Callable, Callable, Callable, Callable],
+    config: DictConfig,
+) -> LearnerFn[RNNOffPolicyLearnerState]:
+    """Get the learner function."""
+
+    (
+        buffer_add_fn,
+        presample_fn,
+        buffer_sample_fn,
+        importance_weights_fn,
+        set_priorities_fn,
+    ) = buffer_fns
+
+    def _update_step(
+        learner_state: RNNOffPolicyLearnerState, rollout_index: chex.Array
+    ) -> Tuple[RNNOffPolicyLearnerState, Tuple]:
+        def _env_step(
+            learner_state: RNNOffPolicyLearnerState, _: Any
+        ) -> Tuple[RNNOffPolicyLearnerState, RNNSequenceStep]:
+            """Step the environment."""
+            (
+                q_params,
+                opt_states,
+                buffer_state,
+                key,
+                env_state,
+                last_timestep,
+                last_done,
+                last_truncated,
+                hstates,
+            ) = learner_state
+
+            # SELECT ACTION
+            key, policy_key = jax.random.split(key)
+            # Add a time dimension to the observation.
+            batched_observation = jax.tree_util.tree_map(
+                lambda x: x[jnp.newaxis, :], last_timestep.observation
+            )
+            reset_hidden_state = jnp.logical_or(last_done, last_truncated)
+            q_in = (batched_observation, reset_hidden_state[jnp.newaxis, :])
+            next_hstates, actor_policy = q_apply_fn(q_params.online, hstates, q_in)
+            action = actor_policy.sample(seed=policy_key).squeeze(0)
+
+            # STEP ENVIRONMENT
+            env_state, timestep = jax.vmap(env.step, in_axes=(0, 0))(env_state, action)
+
+            # LOG EPISODE METRICS
+            done = (timestep.discount == 0.0).reshape(-1)
+            truncated = (timestep.last() & (timestep.discount != 0.0)).reshape(-1)
+            info = timestep.extras["episode_metrics"]
+
+            # The hidden state before the step is stored so that sampled sequences can be
+            # unrolled from the state the actor was in when it collected them.
+            sequence_step = RNNSequenceStep(
+                last_timestep.observation,
+                action,
+                timestep.reward,
+                done,
+                truncated,
+                reset_hidden_state,
+                hstates,
+                info,
+            )
+
+            learner_state = RNNOffPolicyLearnerState(
+                q_params,
+                opt_states,
+                buffer_state,
+                key,
+                env_state,
+                timestep,
+                done,
+                truncated,
+                next_hstates,
+            )
+            return learner_state, sequence_step
+
+        # STEP ENVIRONMENT FOR ROLLOUT LENGTH
+        learner_state, traj_batch = jax.lax.scan(
+            _env_step, learner_state, None, config.system.rollout_length
+        )
+
+        (
+            params,
+            opt_states,
+            buffer_state,
+            key,
+            env_state,
+            last_timestep,
+            last_done,
+            last_truncated,
+            hstates,
+        ) = learner_state
+
+        # Add the trajectory to the buffer.
+        # Swap the batch and time axes.
+        traj_batch = jax.tree_util.tree_map(lambda x: jnp.swapaxes(x, 0, 1), traj_batch)
+        buffer_state = buffer_add_fn(buffer_state, traj_batch)
+
+        def _update_epoch(update_state: Tuple, epoch_sample: Any) -> Tuple:
+            """Update the network for a single epoch."""
+
+            def _q_loss_fn(
+                q_params: FrozenDict,
+                target_q_params: FrozenDict,
+                sequences: RNNSequenceStep,
+                importance_weights: chex.Array,
+            ) -> jnp.ndarray:
+
+                # Unroll the networks time major from the stored hidden states.
+                obs = jax.tree_util.tree_map(lambda x: jnp.swapaxes(x, 0, 1), sequences.obs)
+                reset_hidden_state = jnp.swapaxes(sequences.reset_hidden_state, 0, 1)
+                online_hstates = jax.tree_util.tree_map(lambda x: x[:, 0], sequences.hstate)
+                target_hstates = online_hstates
+
+                # BURN-IN
+                # The stored hidden states were computed with older params, so they are
+                # refreshed by unrolling the networks on the first steps of the sequences,
+                # which are not learned from.
+                burn_in_length = config.system.burn_in_length
+                if burn_in_length > 0:
+                    burn_in = jax.tree_util.tree_map(
+                        lambda x: x[:burn_in_length], (obs, reset_hidden_state)
+                    )
+                    online_hstates, _ = q_apply_fn(q_params, online_hstates, burn_in)
+                    target_hstates, _ = q_apply_fn(target_q_params, target_hstates, burn_in)
+                    online_hstates, target_hstates = jax.lax.stop_gradient(
+                        (online_hstates, target_hstates)
+                    )
+                    obs, reset_hidden_state = jax.tree_util.tree_map(
+                        lambda x: x[burn_in_length:], (obs, reset_hidden_state)
+                    )
+                    sequences = jax.tree_util.tree_map(lambda x: x[:, burn_in_length:], sequences)
+
+                _, q_online = q_apply_fn(q_params, online_hstates, (obs, reset_hidden_state))
+                _, q_target = q_apply_fn(target_q_params, target_hstates, (obs, reset_hidden_state))
+                # [T, B, A] -> [B, T, A]
+                q_online = jnp.swapaxes(q_online.preferences, 0, 1)
+                q_target = jnp.swapaxes(q_target.preferences, 0, 1)
+
+                # Cast and clip rewards.
+                r_t = jnp.clip(
+                    sequences.reward, -config.system.max_abs_reward, config.system.max_abs_reward
+                ).astype(jnp.float32)
+                # The returns do not bootstrap across episodes. The observation following a
+                # truncation is not stored, so truncations are treated as terminations.
+                episode_end = jnp.logical_or(sequences.done, sequences.truncated)
+                d_t = (1.0 - episode_end.astype(jnp.float32)) * config.system.gamma
+                a_t = sequences.action
+
+                # Double Q-learning n-step targets.
+                selector_t = jnp.argmax(q_online[:, 1:], axis=-1)
+                v_t = jnp.take_along_axis(q_target[:, 1:], selector_t[..., None], axis=-1)
+                n_step_targets = batch_n_step_bootstrapped_returns(
+                    r_t[:, :-1],
+                    d_t[:, :-1],
+                    v_t.squeeze(-1),
+                    config.system.n_step,
+                )
+                q_tm1 = jnp.take_along_axis(q_online[:, :-1], a_t[:, :-1, None], axis=-1)
+                td_error = n_step_targets - q_tm1.squeeze(-1)
+                if config.system.huber_loss_parameter > 0.0:
+                    step_loss = rlax.huber_loss(td_error, config.system.huber_loss_parameter)
+                else:
+                    step_loss = rlax.l2_loss(td_error)
+
+                # Truncated steps have no valid target so they are masked out.
+                mask = 1.0 - sequences.truncated[:, :-1].astype(jnp.float32)
+                num_steps = jnp.maximum(jnp.sum(mask, axis=-1), 1.0)
+                batch_loss = jnp.sum(step_loss * mask, axis=-1) / num_steps
+                q_loss = jnp.mean(importance_weights * batch_loss)
+
+                # Sequence priorities mix the max and mean absolute TD errors as in R2D2.
+                abs_td_error = jnp.abs(td_error) * mask
+                priorities = config.system.priority_eta * jnp.max(abs_td_error, axis=-1) + (
+                    1.0 - config.system.priority_eta
+                ) * (jnp.sum(abs_td_error, axis=-1) / num_steps)
+
+                loss_info = {
+                    "q_loss": q_loss,
+                    "priorities": jax.lax.stop_gradient(priorities),
+                }
+
+                return q_loss, loss_info
+
+            params, opt_states, buffer_state, key = update_state
+
+            key, sample_key = jax.random.split(key)
+
+            # SAMPLE SEQUENCES
+            sequence_sample = buffer_sample_fn(buffer_state, sample_key, epoch_sample)
+            sequences: RNNSequenceStep = sequence_sample.experience
+            importance_weights = importance_weights_fn(buffer_state, sequence_sample)
+
+            # CALCULATE Q LOSS
+            q_grad_fn = jax.grad(_q_loss_fn, has_aux=True)
+            q_grads, q_loss_info = q_grad_fn(
+                params.online,
+                params.target,
+                sequences,
+                importance_weights,
+            )
+
+            # Update priorities in the buffer.
+            priorities = q_loss_info.pop("priorities")
+            buffer_state = set_priorities_fn(buffer_state, sequence_sample, priorities)
+
+            # Compute the parallel mean (pmean) over the batch.
+            # This calculation is inspired by the Anakin architecture demo notebook.
+            # available at https://tinyurl.com/26tdzs5x
+            # This pmean could be a regular mean as the batch axis is on the same device.
+            q_grads, q_loss_info = jax.lax.pmean((q_grads, q_loss_info), axis_name="batch")
+            q_grads, q_loss_info = jax.lax.pmean((q_grads, q_loss_info), axis_name="device")
+
+            # UPDATE Q PARAMS AND OPTIMISER STATE
+            q_updates, q_new_opt_state = q_update_fn(q_grads, opt_states)
+            q_new_online_params = optax.apply_updates(params.online, q_updates)
+            # Target network polyak update.
+            new_target_q_params = optax.incremental_update(
+                q_new_online_params, params.target, config.system.tau
+            )
+            q_new_params = OnlineAndTarget(q_new_online_params, new_target_q_params)
+
+            # PACK NEW PARAMS AND OPTIMISER STATE
+            new_params = q_new_params
+            new_opt_state = q_new_opt_state
+
+            # PACK LOSS INFO
+            loss_info = {
+                **q_loss_info,
+            }
+            return (new_params, new_opt_state, buffer_state, key), loss_info
+
+        # With fused sampling, the batches of all the epochs are sampled at once.
+        key, epoch_samples = presample_fn(buffer_state, key)
+        update_state = (params, opt_states, buffer_state, key)
+
+        # UPDATE EPOCHS
+        update_state, loss_info = scan_update_epochs(
+            _update_epoch, update_state, rollout_index, config, epoch_samples
+        )
+
+        params, opt_states, buffer_state, key = update_state
+        learner_state = RNNOffPolicyLearnerState(
+            params,
+            opt_states,
+            buffer_state,
+            key,
+            env_state,
+            last_timestep,
+            last_done,
+            last_truncated,
+            hstates,
+        )
+        metric = traj_batch.info
+        return learner_state, (metric, loss_info)
+
+    def learner_fn(
+        learner_state: RNNOffPolicyLearnerState,
+    ) -> AnakinExperimentOutput[RNNOffPolicyLearnerState]:
+        """Learner function.
+
+        This function represents the learner, it updates the network parameters
+        by iteratively applying the `_update_step` function for a fixed number of
+        updates. The `_update_step` function is vectorized over a batch of inputs.
+
+        """
+
+        batched_update_step = jax.vmap(_update_step, in_axes=(0, None), axis_name="batch")
+
+        learner_state, (episode_info, loss_info) = jax.lax.scan(
+            batched_update_step, learner_state, jnp.arange(config.arch.num_updates_per_eval)
+        )
+        return AnakinExperimentOutput(
+            learner_state=learner_state,
+            episode_metrics=episode_info,
+            train_metrics=loss_info,
+        )
+
+    return learner_fn
+
+
+def learner_setup(
+    env: Environment, keys: chex.Array, config: DictConfig
+) -> Tuple[
+    LearnerFn[RNNOffPolicyLearnerState], RecurrentActor, ScannedRNN, RNNOffPolicyLearnerState
+]:
+    """Initialise learner_fn, network, optimiser, environment and states."""
+    # Get available TPU cores.
+    learner_devices = get_anakin_learner_devices(config)
+    n_devices = get_num_learner_replicas(config)
+
+    # Get number of actions.
+    action_dim = int(env.action_spec().num_values)
+    config.system.action_dim = action_dim
+
+    # PRNG keys.
+    key, q_net_key = keys
+
+    # Define networks and optimiser.
+    q_network_pre_torso = hydra.utils.instantiate(config.network.actor_network.pre_torso)
+    q_network_post_torso = hydra.utils.instantiate(config.network.actor_network.post_torso)
+    q_network_action_head = hydra.utils.instantiate(
+        config.network.actor_network.action_head,
+        action_dim=action_dim,
+        epsilon=config.system.training_epsilon,
+    )
+
+    q_network = RecurrentActor(
+        pre_torso=q_network_pre_torso,
+        hidden_state_dim=config.network.actor_network.rnn_layer.hidden_state_dim,
+        cell_type=config.network.actor_network.rnn_layer.cell_type,
+        post_torso=q_network_post_torso,
+        action_head=q_network_action_head,
+    )
+
+    eval_q_network_action_head = hydra.utils.instantiate(
+        config.network.actor_network.action_head,
+        action_dim=action_dim,
+        epsilon=config.system.evaluation_epsilon,
+    )
+    eval_q_network = RecurrentActor(
+        pre_torso=q_network_pre_torso,
+        hidden_state_dim=config.network.actor_network.rnn_layer.hidden_state_dim,
+        cell_type=config.network.actor_network.rnn_layer.cell_type,
+        post_torso=q_network_post_torso,
+        action_head=eval_q_network_action_head,
+    )
+    q_rnn = ScannedRNN(
+        hidden_state_dim=config.network.actor_network.rnn_layer.hidden_state_dim,
+        cell_type=config.network.actor_network.rnn_layer.cell_type,
+    )
+
+    q_lr = make_learning_rate(config.system.q_lr, config, config.system.updates_per_rollout)
+    q_optim = optax.chain(
+        optax.clip_by_global_norm(config.system.max_grad_norm),
+        optax.adam(q_lr, eps=1e-5),
+    )
+
+    # Initialise observation
+    init_obs = env.observation_spec().generate_value()
+    init_obs = jax.tree_util.tree_map(
+        lambda x: jnp.repeat(x[jnp.newaxis, ...], config.arch.num_envs, axis=0),
+        init_obs,
+    )
+    init_obs = jax.tree_util.tree_map(lambda x: x[None, ...], init_obs)
+    init_done = jnp.zeros((1, config.arch.num_envs), dtype=bool)
+    init_x = (init_obs, init_done)
+
+    # Initialise hidden states.
+    init_hstates = q_rnn.initialize_carry(config.arch.num_envs)
+
+    # Initialise q params and optimiser state.
+    q_online_params = q_network.init(q_net_key, init_hstates, init_x)
+    q_target_params = q_online_params
+    q_opt_state = q_optim.init(q_online_params)
+
+    params = OnlineAndTarget(q_online_params, q_target_params)
+    opt_states = q_opt_state
+
+    q_network_apply_fn = q_network.apply
+
+    # Pack apply and update functions.
+    apply_fns = q_network_apply_fn
+    update_fns = q_optim.update
+
+    # Create replay buffer
+    dummy_sequence_step = RNNSequenceStep(
+        obs=jax.tree_util.tree_map(lambda x: x[0, 0], init_obs),
+        action=jnp.zeros((), dtype=int),
+        reward=jnp.zeros((), dtype=float),
+        done=jnp.zeros((), dtype=bool),
+        truncated=jnp.zeros((), dtype=bool),
+        reset_hidden_state=jnp.zeros((), dtype=bool),
+        hstate=jax.tree_util.tree_map(lambda x: x[0], init_hstates),
+        info={"episode_return": 0.0, "episode_length": 0, "is_terminal_step": False},
+    )
+    assert config.system.total_buffer_size % n_devices == 0, (
+        f"{Fore.RED}{Style.BRIGHT}The total buffer size should be divisible "
+        + "by the number of devices!{Style.RESET_ALL}"
+    )
+    assert config.system.total_batch_size % n_devices == 0, (
+        f"{Fore.RED}{Style.BRIGHT}The total batch size should be divisible "
+        + "by the number of devices!{Style.RESET_ALL}"
+    )
+    assert config.system.burn_in_length + 1 < config.system.sample_sequence_length, (
+        f"{Fore.RED}{Style.BRIGHT}The sample sequence length should leave at least "
+        + f"two steps after the burn-in!{Style.RESET_ALL}"
+    )
+    # Stored sequences start every `period` steps from the first warmup step, so the warmup
+    # completes (warmup_steps - sample_sequence_length) // period + 1 of them per environment.
+    # Without any, a prioritised buffer has no priorities to sample from.
+    assert config.system.warmup_steps >= config.system.sample_sequence_length, (
+        f"{Fore.RED}{Style.BRIGHT}The warmup steps should be at least the sample sequence "
+        + "length, so that the buffer holds a complete sequence before training!"
+        + f"{Style.RESET_ALL}"
+    )
+    config.system.buffer_size = config.system.total_buffer_size // (
+        n_devices * config.arch.update_batch_size
+    )
+    config.system.batch_size = config.system.total_batch_size // (
+        n_devices * config.arch.update_batch_size
+    )
+    buffer_fn = make_trajectory_buffer(
+        config, env.observation_spec(), config.system.sample_sequence_length, config.system.period
+    )
+    buffer_fns = (
+        buffer_fn.add,
+        *make_epoch_sample_fns(buffer_fn, config),
+        *make_priority_fns(buffer_fn, config),
+    )
+    buffer_states = buffer_fn.init(dummy_sequence_step)
+
+    # Get batched iterated update and replicate it to pmap it over cores.
+    learn = get_learner_fn(env, apply_fns, update_fns, buffer_fns, config)
+    # The learner state is donated, so that its buffers are reused by the updated state.
+    learn = device_map(learn, config, learner_devices, donate_argnums=0)
+
+    warmup = get_warmup_fn(env, params, q_network_apply_fn, buffer_fn.add, config)
+    warmup = device_map(warmup, config, learner_devices, donate_argnums=(0, 1, 2, 3, 4, 5))
+
+    # Initialise environment states and timesteps: across devices and batches.
+    key, *env_keys = jax.random.split(
+        key, n_devices * config.arch.update_batch_size * config.arch.num_envs + 1
+    )
+    env_states, timesteps = jax.vmap(env.reset, in_axes=(0))(
+        jnp.stack(env_keys),
+    )
+
+    def reshape_states(x: chex.Array) -> chex.Array:
+        return x.reshape(
+            (n_devices, config.arch.update_batch_size, config.arch.num_envs) + x.shape[1:]
+        )
+
+    # (devices, update batch size, num_envs, ...)
+    env_states = jax.tree_util.tree_map(reshape_states, env_states)
+    timesteps = jax.tree_util.tree_map(reshape_states, timesteps)
+
+    # Load model from checkpoint if specified.
+    if config.logger.checkpointing.load_model:
+        loaded_checkpoint = Checkpointer(
+            model_name=config.system.system_name,
+            **config.logger.checkpointing.load_args,  # Other checkpoint args
+        )
+        # Restore the learner state from the checkpoint
+        restored_params, _ = loaded_checkpoint.restore_params(TParams=OnlineAndTarget)
+        # Update the params
+        params = restored_params
+
+    # Define params to be replicated across devices and batches.
+    dones = jnp.zeros((config.arch.num_envs,), dtype=bool)
+    truncated = jnp.zeros((config.arch.num_envs,), dtype=bool)
+    key, step_key, warmup_key = jax.random.split(key, num=3)
+    step_keys = jax.random.split(step_key, n_devices * config.arch.update_batch_size)
+    warmup_keys = jax.random.split(warmup_key, n_devices * config.arch.update_batch_size)
+
+    def reshape_keys(x: chex.Array) -> chex.Array:
+        return x.reshape((n_devices, config.arch.update_batch_size) + x.shape[1:])
+
+    step_keys = reshape_keys(jnp.stack(step_keys))
+    warmup_keys = reshape_keys(jnp.stack(warmup_keys))
+
+    replicate_learner = (params, opt_states, buffer_states, init_hstates, dones, truncated)
+
+    # Duplicate learner for update_batch_size.
+    def broadcast(x: chex.Array) -> chex.Array:
+        return jnp.broadcast_to(x, (config.arch.update_batch_size,) + x.shape)
+
+    replicate_learner = jax.tree_util.tree_map(broadcast, replicate_learner)
+
+    # Duplicate learner across devices.
+    replicate_learner = replicate_on_devices(replicate_learner, config, learner_devices)
+
+    # Initialise learner state.
+    params, opt_states, buffer_states, hstates, dones, truncated = replicate_learner
+    # Warmup the buffer.
+    env_states, timesteps, dones, truncated, hstates, buffer_states, _ = warmup(
+        env_states, timesteps, dones, truncated, hstates, buffer_states, warmup_keys
+    )
+    init_learner_state = RNNOffPolicyLearnerState(
+        params=params,
+        opt_states=opt_states,
+        buffer_state=buffer_states,
+        key=step_keys,
+        env_state=env_states,
+        timestep=timesteps,
+        done=dones,
+        truncated=truncated,
+        hstates=hstates,
+    )
+
+    return learn, eval_q_network, q_rnn, init_learner_state
+
+
+def run_experiment(_config: DictConfig) -> float:
+    """Runs experiment."""
+    config = copy.deepcopy(_config)
+    # The compilation cache must be configured before anything is compiled.
+    configure_compilation_cache(config)
+
+    # Calculate total timesteps.
+    n_devices = get_num_learner_replicas(config)
+    config.num_devices = n_devices
+    config = check_total_timesteps(config)
+    assert (
+        config.arch.num_updates >= config.arch.num_evaluation
+    ), "Number of updates per evaluation must be less than total number of updates."
+
+    # Create the environments for train and eval.
+    env, eval_env = environments.make(config=config)
+
+    # PRNG keys.
+    key, key_e, q_net_key = jax.random.split(jax.random.PRNGKey(config.arch.seed), num=3)
+
+    # Setup learner.
+    learn, eval_q_network, q_rnn, learner_state = learner_setup(env, (key, q_net_key), config)
+
+    # Setup evaluator.
+    evaluator, absolute_metric_evaluator, (trained_params, eval_keys) = evaluator_setup(
+        eval_env=eval_env,
+        key_e=key_e,
+        eval_act_fn=get_rec_distribution_act_fn(config, eval_q_network.apply),
+        params=learner_state.params.online,
+        config=config,
+        use_recurrent_net=True,
+        scanned_rnn=q_rnn,
+    )
+
+    # Calculate number of updates per evaluation.
+    config.arch.num_updates_per_eval = config.arch.num_updates // config.arch.num_evaluation
+    steps_per_rollout = (
+        n_devices
+        * config.arch.num_updates_per_eval
+        * config.system.rollout_length
+        * config.arch.update_batch_size
+        * config.arch.num_envs
+    )
+
+    # Compile the learner and evaluators, ahead of time with `arch.aot_compile`.
+    learn, evaluator, absolute_metric_evaluator, compile_metrics = compile_anakin_fns(
+        config,
+        learn,
+        learner_state,
+        evaluator,
+        absolute_metric_evaluator,
+        (trained_params, eval_keys),
+    )
+
+    # Logger setup
+    logger = StoixLogger(config)
+    cfg: Dict = OmegaConf.to_container(config, resolve=True)
+    cfg["arch"]["devices"] = jax.devices()
+    pprint(cfg)
+    # Log the compilation time separately from the training time.
+    if compile_metrics:
+        logger.log(compile_metrics, 0, 0, LogEvent.MISC)
+
+    # Set up the logging, checkpointing and best params tracking of the training and evaluation.
+    experiment_logger = AnakinExperimentLogger(
+        config, logger, steps_per_rollout, unreplicate_batch_dim(learner_state.params.online)
+    )
+
+    # Run experiment for a total number of evaluations.
+    for eval_step in range(config.arch.num_evaluation):
+        # Train.
+        start_time = time.time()
+
+        learner_output = learn(learner_state)
+        jax.block_until_ready(learner_output)
+
+        # Log the results of the training.
+        elapsed_time = time.time() - start_time
+        experiment_logger.log_training(learner_output, eval_step, elapsed_time)
+
+        # Prepare for evaluation.
+        start_time = time.time()
+        trained_params = unreplicate_batch_dim(
+            learner_output.learner_state.params.online
+        )  # Select only actor params
+        key_e, *eval_keys = jax.random.split(key_e, n_devices + 1)
+        eval_keys = jnp.stack(eval_keys)
+        eval_keys = eval_keys.reshape(n_devices, -1)
+
+        # Evaluate. The evaluation is dispatched asynchronously, so when it runs on devices
+        # that are not used for training it overlaps with the next training chunk.
+        evaluator_output = evaluator(trained_params, eval_keys)
+        # Log the evaluation once it is done, against the step the snapshot was taken at.
+        experiment_logger.add_evaluation(
+            eval_step, start_time, trained_params, learner_output.learner_state, evaluator_output
+        )
+
+        # Update runner state to continue training.
+        learner_state = learner_output.learner_state
+
+    # Measure absolute metric.
+    if config.arch.absolute_metric:
+        start_time = time.time()
+
+        key_e, *eval_keys = jax.random.split(key_e, n_devices + 1)
+        eval_keys = jnp.stack(eval_keys)
+        eval_keys = eval_keys.reshape(n_devices, -1)
+
+        evaluator_output = absolute_metric_evaluator(experiment_logger.best_params, eval_keys)
+        jax.block_until_ready(evaluator_output)
+
+        elapsed_time = time.time() - start_time
+        t = int(steps_per_rollout * (eval_step + 1))
+        steps_per_eval = int(jnp.sum(evaluator_output.episode_metrics["episode_length"]))
+        evaluator_output.episode_metrics["steps_per_second"] = steps_per_eval / elapsed_time
+        logger.log(evaluator_output.episode_metrics, t, eval_step, LogEvent.ABSOLUTE)
+
+    # Stop the logger.
+    logger.stop()
+    # Record the performance for the final evaluation run. If the absolute metric is not
+    # calculated, this will be the final evaluation run.
+    eval_performance = float(jnp.mean(evaluator_output.episode_metrics[config.env.eval_metric]))
+    return eval_performance
+
+
+@hydra.main(
+    config_path="../../configs/default/anakin",
+    config_name="default_rec_r2d2.yaml",
+    version_base="1.2",
+)
+def hydra_entry_point(cfg: DictConfig) -> float:
+    """Experiment entry point."""
+    # Allow dynamic attributes.
+    OmegaConf.set_struct(cfg, False)
+
+    # Run experiment.
+    eval_performance = run_experiment(cfg)
+
+    print(f"{Fore.CYAN}{Style.BRIGHT}R2D2 experiment completed{Style.RESET_ALL}")
+    return eval_performance
+
+
+if __name__ == "__main__":
+    hydra_entry_point()
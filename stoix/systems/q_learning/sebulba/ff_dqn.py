@@ -0,0 +1,344 @@
+import copy
+import time
+from typing import Callable, Dict, Sequence, Tuple
+
+import chex
+import flax
+import hydra
+import jax
+import jax.numpy as jnp
+import numpy as np
+import optax
+from colorama import Fore, Style
+from flax.core.frozen_dict import FrozenDict
+from omegaconf import DictConfig, OmegaConf
+from rich.pretty import pprint
+
+from stoix.base_types import (
+    ActorApply,
+    CoreLearnerState,
+    Observation,
+    OnlineAndTarget,
+    SebulbaExperimentOutput,
+    SebulbaLearnerFn,
+)
+from stoix.evaluator import (
+    get_distribution_act_fn,
+    get_sebulba_async_evaluator,
+    get_sebulba_eval_fn,
+)
+from stoix.networks.base import FeedForwardActor as Actor
+from stoix.systems.q_learning.dqn_types import Transition
+from stoix.utils import make_env as environments
+from stoix.utils.checkpointing import Checkpointer
+from stoix.utils.env_factory import EnvFactory
+from stoix.utils.logger import LogEvent, StoixLogger
+from stoix.utils.loss import q_learning
+from stoix.utils.sebulba_utils import (
+    ThreadLifetime,
+    get_off_policy_devices,
+    run_off_policy_training,
+)
+from stoix.utils.total_timestep_checker import check_total_timesteps
+from stoix.utils.training import make_learning_rate
+
+
+def get_act_fn(
+    q_apply_fn: ActorApply,
+) -> Callable[[FrozenDict, Observation, chex.PRNGKey], chex.Array]:
+    """Get the act function that is used by the actor threads."""
+
+    def actor_fn(params: FrozenDict, observation: Observation, rng_key: chex.PRNGKey) -> chex.Array:
+        """Get the epsilon-greedy action from the q network."""
+        pi = q_apply_fn(params, observation)
+        action = pi.sample(seed=rng_key)
+        return action
+
+    return actor_fn
+
+
+def get_learner_step_fn(
+    q_apply_fn: ActorApply,
+    q_update_fn: optax.TransformUpdateFn,
+    config: DictConfig,
+) -> SebulbaLearnerFn[CoreLearnerState, Transition]:
+    """Get the learner update function which is used to update the q network.
+    This function is used by the learner thread to update the networks."""
+
+    def _update_epoch(update_state: Tuple, transitions: Transition) -> Tuple:
+        """Update the network for a single epoch on a single sampled batch."""
+
+        def _q_loss_fn(
+            q_params: FrozenDict,
+            target_q_params: FrozenDict,
+            transitions: Transition,
+        ) -> jnp.ndarray:
+
+            q_tm1 = q_apply_fn(q_params, transitions.obs).preferences
+            q_t = q_apply_fn(target_q_params, transitions.next_obs).preferences
+
+            # Cast and clip rewards.
+            discount = 1.0 - transitions.done.astype(jnp.float32)
+            d_t = (discount * config.system.gamma).astype(jnp.float32)
+            r_t = jnp.clip(
+                transitions.reward, -config.system.max_abs_reward, config.system.max_abs_reward
+            ).astype(jnp.float32)
+            a_tm1 = transitions.action
+
+            # Compute Q-learning loss.
+            batch_loss = q_learning(
+                q_tm1,
+                a_tm1,
+                r_t,
+                d_t,
+                q_t,
+                config.system.huber_loss_parameter,
+            )
+
+            loss_info = {
+                "q_loss": batch_loss,
+            }
+
+            return batch_loss, loss_info
+
+        params, opt_states = update_state
+
+        # CALCULATE Q LOSS
+        q_grad_fn = jax.grad(_q_loss_fn, has_aux=True)
+        q_grads, q_loss_info = q_grad_fn(
+            params.online,
+            params.target,
+            transitions,
+        )
+
+        # pmean over devices.
+        q_grads, q_loss_info = jax.lax.pmean((q_grads, q_loss_info), axis_name="device")
+
+        # UPDATE Q PARAMS AND OPTIMISER STATE
+        q_updates, q_new_opt_state = q_update_fn(q_grads, opt_states)
+        q_new_online_params = optax.apply_updates(params.online, q_updates)
+        # Target network polyak update.
+        new_target_q_params = optax.incremental_update(
+            q_new_online_params, params.target, config.system.tau
+        )
+        q_new_params = OnlineAndTarget(q_new_online_params, new_target_q_params)
+
+        return (q_new_params, q_new_opt_state), q_loss_info
+
+    def learner_step_fn(
+        learner_state: CoreLearnerState, traj_batch: Transition
+    ) -> SebulbaExperimentOutput[CoreLearnerState]:
+        """Learner function.
+
+        This function represents the learner, it updates the network parameters
+        by applying the `_update_epoch` function to each of the `epochs` batches
+        sampled from the replay buffer.
+
+        Args:
+            learner_state (NamedTuple):
+                - params (OnlineAndTarget): The initial model parameters.
+                - opt_states (OptStates): The initial optimizer state.
+                - key (chex.PRNGKey): The random number generator state.
+                - timestep (TimeStep): Unused by off-policy learners.
+            traj_batch (Transition): The sampled transitions of shape [epochs, batch_size, ...].
+        """
+        params, opt_states, key, timestep = learner_state
+
+        # UPDATE EPOCHS
+        (params, opt_states), loss_info = jax.lax.scan(
+            _update_epoch, (params, opt_states), traj_batch
+        )
+
+        learner_state = CoreLearnerState(params, opt_states, key, timestep)
+
+        return SebulbaExperimentOutput(
+            learner_state=learner_state,
+            train_metrics=loss_info,
+        )
+
+    return learner_step_fn
+
+
+def learner_setup(
+    env_factory: EnvFactory,
+    keys: chex.Array,
+    learner_devices: Sequence[jax.Device],
+    config: DictConfig,
+) -> Tuple[SebulbaLearnerFn[CoreLearnerState, Transition], Tuple[Actor, Actor], CoreLearnerState]:
+    """Setup for the learner state and networks."""
+
+    # Create a single environment just to get the observation and action specs.
+    env = env_factory(num_envs=1)
+    # Get number/dimension of actions.
+    action_dim = int(env.action_spec().num_values)
+    config.system.action_dim = action_dim
+    example_obs = env.observation_spec().generate_value()
+    env.close()
+
+    # PRNG keys.
+    key, q_net_key = keys
+
+    # Define networks and optimiser.
+    q_network_torso = hydra.utils.instantiate(config.network.actor_network.pre_torso)
+    q_network_action_head = hydra.utils.instantiate(
+        config.network.actor_network.action_head,
+        action_dim=action_dim,
+        epsilon=config.system.training_epsilon,
+    )
+
+    q_network = Actor(torso=q_network_torso, action_head=q_network_action_head)
+
+    eval_q_network_action_head = hydra.utils.instantiate(
+        config.network.actor_network.action_head,
+        action_dim=action_dim,
+        epsilon=config.system.evaluation_epsilon,
+    )
+    eval_q_network = Actor(torso=q_network_torso, action_head=eval_q_network_action_head)
+
+    q_lr = make_learning_rate(config.system.q_lr, config, config.system.epochs)
+    q_optim = optax.chain(
+        optax.clip_by_global_norm(config.system.max_grad_norm),
+        optax.adam(q_lr, eps=1e-5),
+    )
+
+    # Initialise observation
+    init_x = example_obs
+    init_x = jax.tree_util.tree_map(lambda x: x[None, ...], init_x)
+
+    # Initialise q params and optimiser state.
+    q_online_params = q_network.init(q_net_key, init_x)
+    q_target_params = q_online_params
+    q_opt_state = q_optim.init(q_online_params)
+
+    params = OnlineAndTarget(q_online_params, q_target_params)
+    opt_states = q_opt_state
+
+    # Get batched iterated update and replicate it to pmap it over cores.
+    learn_step = get_learner_step_fn(q_network.apply, q_optim.update, config)
+    learn_step = jax.pmap(learn_step, axis_name="device", devices=learner_devices)
+
+    # Load model from checkpoint if specified.
+    if config.logger.checkpointing.load_model:
+        loaded_checkpoint = Checkpointer(
+            model_name=config.system.system_name,
+            **config.logger.checkpointing.load_args,  # Other checkpoint args
+        )
+        # Restore the learner state from the checkpoint
+        restored_params, _ = loaded_checkpoint.restore_params(TParams=OnlineAndTarget)
+        # Update the params
+        params = restored_params
+
+    # Define params to be replicated across learner devices.
+    replicate_learner = (params, opt_states)
+
+    # Duplicate across learner devices.
+    replicate_learner = flax.jax_utils.replicate(replicate_learner, devices=learner_devices)
+
+    # Initialise learner state.
+    params, opt_states = replicate_learner
+    key, step_key = jax.random.split(key)
+    step_keys = jax.random.split(step_key, len(learner_devices))
+    init_learner_state = CoreLearnerState(params, opt_states, step_keys, None)
+
+    return learn_step, (q_network, eval_q_network), init_learner_state
+
+
+def run_experiment(_config: DictConfig) -> float:
+    """Runs experiment."""
+    config = copy.deepcopy(_config)
+
+    # Get the actor, learner and evaluator devices
+    actor_devices, learner_devices, evaluator_devices = get_off_policy_devices(config)
+
+    # Perform some checks on the config
+    # This additionally calculates certains
+    # values based on the config
+    config = check_total_timesteps(config)
+
+    # Create the environment factory.
+    env_factory = environments.make_factory(config)
+    assert isinstance(
+        env_factory, EnvFactory
+    ), "Environment factory must be an instance of EnvFactory"
+
+    # PRNG keys.
+    key, key_e, q_net_key = jax.random.split(jax.random.PRNGKey(config.arch.seed), num=3)
+    np_rng = np.random.default_rng(config.arch.seed)
+
+    # Setup learner.
+    learn_step, (q_network, eval_q_network), learner_state = learner_setup(
+        env_factory, (key, q_net_key), learner_devices, config
+    )
+    eval_act_fn = get_distribution_act_fn(config, eval_q_network.apply)
+    # Setup evaluator.
+    evaluator_lifetime = ThreadLifetime()
+    evaluator, evaluator_envs = get_sebulba_async_evaluator(
+        env_factory, eval_act_fn, config, np_rng, evaluator_devices, evaluator_lifetime
+    )
+    evaluator.start()
+
+    # Logger setup
+    logger = StoixLogger(config)
+    cfg: Dict = OmegaConf.to_container(config, resolve=True)
+    cfg["arch"]["devices"] = jax.devices()
+    pprint(cfg)
+
+    # Run the actors, the learner and the evaluator until training is done.
+    eval_metrics, best_params, t, eval_step = run_off_policy_training(
+        config,
+        env_factory,
+        learn_step,
+        learner_state,
+        get_act_fn(q_network.apply),
+        Transition,
+        lambda params: params.online,
+        evaluator,
+        logger,
+        key,
+        np_rng,
+        actor_devices,
+        learner_devices,
+    )
+    for envs in evaluator_envs:
+        envs.close()
+    eval_performance = float(jnp.mean(eval_metrics[config.env.eval_metric]))
+
+    # Measure absolute metric.
+    if config.arch.absolute_metric:
+        print(f"{Fore.MAGENTA}{Style.BRIGHT}Measuring absolute metric...{Style.RESET_ALL}")
+        abs_metric_evaluator, abs_metric_evaluator_envs = get_sebulba_eval_fn(
+            env_factory, eval_act_fn, config, np_rng, evaluator_devices[0], eval_multiplier=10
+        )
+        eval_metrics = abs_metric_evaluator(best_params, key_e)
+
+        logger.log(eval_metrics, t, eval_step, LogEvent.ABSOLUTE)
+        abs_metric_evaluator_envs.close()
+
+    # Stop the logger.
+    logger.stop()
+
+    return eval_performance
+
+
+@hydra.main(
+    config_path="../../../configs/default/sebulba",
+    config_name="default_ff_dqn.yaml",
+    version_base="1.2",
+)
+def hydra_entry_point(cfg: DictConfig) -> float:
+    """Experiment entry point."""
+    # Allow dynamic attributes.
+    OmegaConf.set_struct(cfg, False)
+
+    # Run experiment.
+    start = time.monotonic()
+    eval_performance = run_experiment(cfg)
+    end = time.monotonic()
+    print(
+        f"{Fore.CYAN}{Style.BRIGHT}DQN experiment completed in {end - start:.2f}s.{Style.RESET_ALL}"
+    )
+    return eval_performance
+
+
+if __name__ == "__main__":
+    hydra_entry_point()
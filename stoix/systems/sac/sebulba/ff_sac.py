@@ -0,0 +1,475 @@
+import copy
+import time
+from typing import Callable, Dict, Sequence, Tuple
+
+import chex
+import flax
+import hydra
+import jax
+import jax.numpy as jnp
+import numpy as np
+import optax
+from colorama import Fore, Style
+from flax.core.frozen_dict import FrozenDict
+from omegaconf import DictConfig, OmegaConf
+from rich.pretty import pprint
+
+from stoix.base_types import (
+    ActorApply,
+    ContinuousQApply,
+    CoreLearnerState,
+    Observation,
+    OnlineAndTarget,
+    SebulbaExperimentOutput,
+    SebulbaLearnerFn,
+)
+from stoix.evaluator import (
+    get_distribution_act_fn,
+    get_sebulba_async_evaluator,
+    get_sebulba_eval_fn,
+)
+from stoix.networks.base import CompositeNetwork
+from stoix.networks.base import FeedForwardActor as Actor
+from stoix.networks.base import MultiNetwork
+from stoix.systems.q_learning.dqn_types import Transition
+from stoix.systems.sac.sac_types import SACOptStates, SACParams
+from stoix.utils import make_env as environments
+from stoix.utils.checkpointing import Checkpointer
+from stoix.utils.env_factory import EnvFactory
+from stoix.utils.logger import LogEvent, StoixLogger
+from stoix.utils.sebulba_utils import (
+    ThreadLifetime,
+    get_off_policy_devices,
+    run_off_policy_training,
+)
+from stoix.utils.total_timestep_checker import check_total_timesteps
+from stoix.utils.training import make_learning_rate
+
+
+def get_act_fn(
+    actor_apply_fn: ActorApply,
+) -> Callable[[FrozenDict, Observation, chex.PRNGKey], chex.Array]:
+    """Get the act function that is used by the actor threads."""
+
+    def actor_fn(params: FrozenDict, observation: Observation, rng_key: chex.PRNGKey) -> chex.Array:
+        """Sample an action from the policy."""
+        pi = actor_apply_fn(params, observation)
+        action = pi.sample(seed=rng_key)
+        return action
+
+    return actor_fn
+
+
+def get_learner_step_fn(
+    apply_fns: Tuple[ActorApply, ContinuousQApply],
+    update_fns: Tuple[optax.TransformUpdateFn, optax.TransformUpdateFn, optax.TransformUpdateFn],
+    config: DictConfig,
+) -> SebulbaLearnerFn[CoreLearnerState, Transition]:
+    """Get the learner update function which is used to update the actor, critic and alpha.
+    This function is used by the learner thread to update the networks."""
+
+    # Get apply and update functions for actor and critic networks.
+    actor_apply_fn, q_apply_fn = apply_fns
+    actor_update_fn, q_update_fn, alpha_update_fn = update_fns
+
+    def _update_epoch(update_state: Tuple, transitions: Transition) -> Tuple:
+        """Update the network for a single epoch on a single sampled batch."""
+
+        def _alpha_loss_fn(
+            log_alpha: chex.Array,
+            actor_params: FrozenDict,
+            transitions: Transition,
+            key: chex.PRNGKey,
+        ) -> jnp.ndarray:
+            """Eq 18 from https://arxiv.org/pdf/1812.05905.pdf."""
+            actor_policy = actor_apply_fn(actor_params, transitions.obs)
+            action = actor_policy.sample(seed=key)
+            log_prob = actor_policy.log_prob(action)
+            alpha = jnp.exp(log_alpha)
+            alpha_loss = alpha * jax.lax.stop_gradient(-log_prob - config.system.target_entropy)
+
+            loss_info = {
+                "alpha_loss": jnp.mean(alpha_loss),
+                "alpha": jnp.mean(alpha),
+            }
+            return jnp.mean(alpha_loss), loss_info
+
+        def _q_loss_fn(
+            q_params: FrozenDict,
+            actor_params: FrozenDict,
+            target_q_params: FrozenDict,
+            alpha: jnp.ndarray,
+            transitions: Transition,
+            key: chex.PRNGKey,
+        ) -> jnp.ndarray:
+            q_old_action = q_apply_fn(q_params, transitions.obs, transitions.action)
+            next_actor_policy = actor_apply_fn(actor_params, transitions.next_obs)
+            next_action = next_actor_policy.sample(seed=key)
+            next_log_prob = next_actor_policy.log_prob(next_action)
+            next_q = q_apply_fn(target_q_params, transitions.next_obs, next_action)
+            next_v = jnp.min(next_q, axis=-1) - alpha * next_log_prob
+            target_q = jax.lax.stop_gradient(
+                transitions.reward + (1.0 - transitions.done) * config.system.gamma * next_v
+            )
+            q_error = q_old_action - jnp.expand_dims(target_q, -1)
+            q_loss = 0.5 * jnp.mean(jnp.square(q_error))
+
+            loss_info = {
+                "q_loss": jnp.mean(q_loss),
+                "q_error": jnp.mean(jnp.abs(q_error)),
+                "q1_pred": jnp.mean(next_q[..., 0]),
+                "q2_pred": jnp.mean(next_q[..., 1]),
+            }
+            return q_loss, loss_info
+
+        def _actor_loss_fn(
+            actor_params: FrozenDict,
+            q_params: FrozenDict,
+            alpha: chex.Array,
+            transitions: Transition,
+            key: chex.PRNGKey,
+        ) -> chex.Array:
+            actor_policy = actor_apply_fn(actor_params, transitions.obs)
+            action = actor_policy.sample(seed=key)
+            log_prob = actor_policy.log_prob(action)
+            q_action = q_apply_fn(q_params, transitions.obs, action)
+            min_q = jnp.min(q_action, axis=-1)
+            actor_loss = alpha * log_prob - min_q
+
+            loss_info = {
+                "actor_loss": jnp.mean(actor_loss),
+                "entropy": jnp.mean(-log_prob),
+            }
+            return jnp.mean(actor_loss), loss_info
+
+        params, opt_states, key = update_state
+
+        key, actor_key, q_key, alpha_key = jax.random.split(key, num=4)
+
+        # Transitions are sampled on the host so they need to be cast to float.
+        transitions = transitions._replace(
+            reward=transitions.reward.astype(jnp.float32),
+            done=transitions.done.astype(jnp.float32),
+        )
+        alpha = jnp.exp(params.log_alpha)
+
+        # CALCULATE ACTOR LOSS
+        actor_grad_fn = jax.grad(_actor_loss_fn, has_aux=True)
+        actor_grads, actor_loss_info = actor_grad_fn(
+            params.actor_params, params.q_params.online, alpha, transitions, actor_key
+        )
+
+        # CALCULATE Q LOSS
+        q_grad_fn = jax.grad(_q_loss_fn, has_aux=True)
+        q_grads, q_loss_info = q_grad_fn(
+            params.q_params.online,
+            params.actor_params,
+            params.q_params.target,
+            alpha,
+            transitions,
+            q_key,
+        )
+
+        # pmean over devices.
+        actor_grads, actor_loss_info = jax.lax.pmean(
+            (actor_grads, actor_loss_info), axis_name="device"
+        )
+        q_grads, q_loss_info = jax.lax.pmean((q_grads, q_loss_info), axis_name="device")
+
+        if config.system.autotune:
+            alpha_grad_fn = jax.grad(_alpha_loss_fn, has_aux=True)
+            alpha_grads, alpha_loss_info = alpha_grad_fn(
+                params.log_alpha, params.actor_params, transitions, alpha_key
+            )
+            alpha_grads, alpha_loss_info = jax.lax.pmean(
+                (alpha_grads, alpha_loss_info), axis_name="device"
+            )
+            log_alpha_updates, alpha_new_opt_state = alpha_update_fn(
+                alpha_grads, opt_states.alpha_opt_state
+            )
+            log_alpha_new_params = optax.apply_updates(params.log_alpha, log_alpha_updates)
+        else:
+            log_alpha_new_params = params.log_alpha
+            alpha_new_opt_state = opt_states.alpha_opt_state
+            alpha_loss_info = {"alpha_loss": 0.0, "alpha": alpha}
+
+        # UPDATE ACTOR PARAMS AND OPTIMISER STATE
+        actor_updates, actor_new_opt_state = actor_update_fn(
+            actor_grads, opt_states.actor_opt_state
+        )
+        actor_new_params = optax.apply_updates(params.actor_params, actor_updates)
+
+        # UPDATE Q PARAMS AND OPTIMISER STATE
+        q_updates, q_new_opt_state = q_update_fn(q_grads, opt_states.q_opt_state)
+        q_new_online_params = optax.apply_updates(params.q_params.online, q_updates)
+        # Target network polyak update.
+        new_target_q_params = optax.incremental_update(
+            q_new_online_params, params.q_params.target, config.system.tau
+        )
+        q_new_params = OnlineAndTarget(q_new_online_params, new_target_q_params)
+
+        # PACK NEW PARAMS AND OPTIMISER STATE
+        new_params = SACParams(actor_new_params, q_new_params, log_alpha_new_params)
+        new_opt_state = SACOptStates(actor_new_opt_state, q_new_opt_state, alpha_new_opt_state)
+
+        # PACK LOSS INFO
+        loss_info = {
+            **actor_loss_info,
+            **q_loss_info,
+            **alpha_loss_info,
+        }
+        return (new_params, new_opt_state, key), loss_info
+
+    def learner_step_fn(
+        learner_state: CoreLearnerState, traj_batch: Transition
+    ) -> SebulbaExperimentOutput[CoreLearnerState]:
+        """Learner function.
+
+        This function represents the learner, it updates the network parameters
+        by applying the `_update_epoch` function to each of the `epochs` batches
+        sampled from the replay buffer.
+
+        Args:
+            learner_state (NamedTuple):
+                - params (SACParams): The initial model parameters.
+                - opt_states (SACOptStates): The initial optimizer state.
+                - key (chex.PRNGKey): The random number generator state.
+                - timestep (TimeStep): Unused by off-policy learners.
+            traj_batch (Transition): The sampled transitions of shape [epochs, batch_size, ...].
+        """
+        params, opt_states, key, timestep = learner_state
+
+        # UPDATE EPOCHS
+        (params, opt_states, key), loss_info = jax.lax.scan(
+            _update_epoch, (params, opt_states, key), traj_batch
+        )
+
+        learner_state = CoreLearnerState(params, opt_states, key, timestep)
+
+        return SebulbaExperimentOutput(
+            learner_state=learner_state,
+            train_metrics=loss_info,
+        )
+
+    return learner_step_fn
+
+
+def learner_setup(
+    env_factory: EnvFactory,
+    keys: chex.Array,
+    learner_devices: Sequence[jax.Device],
+    config: DictConfig,
+) -> Tuple[SebulbaLearnerFn[CoreLearnerState, Transition], Actor, CoreLearnerState]:
+    """Setup for the learner state and networks."""
+
+    # Create a single environment just to get the observation and action specs.
+    env = env_factory(num_envs=1)
+    # Get number of actions or action dimension from the environment.
+    action_dim = int(env.action_spec().shape[-1])
+    config.system.action_dim = action_dim
+    config.system.action_minimum = float(np.min(env.action_spec().minimum))
+    config.system.action_maximum = float(np.max(env.action_spec().maximum))
+    example_obs = env.observation_spec().generate_value()
+    env.close()
+
+    # PRNG keys.
+    key, actor_net_key, q_net_key = keys
+
+    # Define actor_network, q_network and optimiser.
+    actor_torso = hydra.utils.instantiate(config.network.actor_network.pre_torso)
+    actor_action_head = hydra.utils.instantiate(
+        config.network.actor_network.action_head,
+        action_dim=action_dim,
+        minimum=config.system.action_minimum,
+        maximum=config.system.action_maximum,
+    )
+    actor_network = Actor(torso=actor_torso, action_head=actor_action_head)
+
+    def create_q_network(cfg: DictConfig) -> CompositeNetwork:
+        q_network_input = hydra.utils.instantiate(cfg.network.q_network.input_layer)
+        q_network_torso = hydra.utils.instantiate(cfg.network.q_network.pre_torso)
+        q_network_head = hydra.utils.instantiate(cfg.network.q_network.critic_head)
+        return CompositeNetwork([q_network_input, q_network_torso, q_network_head])
+
+    double_q_network = MultiNetwork([create_q_network(config), create_q_network(config)])
+
+    actor_lr = make_learning_rate(config.system.actor_lr, config, config.system.epochs)
+    q_lr = make_learning_rate(config.system.q_lr, config, config.system.epochs)
+
+    actor_optim = optax.chain(
+        optax.clip_by_global_norm(config.system.max_grad_norm),
+        optax.adam(actor_lr, eps=1e-5),
+    )
+    q_optim = optax.chain(
+        optax.clip_by_global_norm(config.system.max_grad_norm),
+        optax.adam(q_lr, eps=1e-5),
+    )
+
+    # Initialise observation
+    init_x = example_obs
+    init_x = jax.tree_util.tree_map(lambda x: x[None, ...], init_x)
+    init_a = jnp.zeros((1, action_dim))
+
+    # Initialise actor params and optimiser state.
+    actor_params = actor_network.init(actor_net_key, init_x)
+    actor_opt_state = actor_optim.init(actor_params)
+
+    # Initialise q params and optimiser state.
+    online_q_params = double_q_network.init(q_net_key, init_x, init_a)
+    target_q_params = online_q_params
+    q_opt_state = q_optim.init(online_q_params)
+
+    # Automatic entropy tuning
+    target_entropy = -config.system.target_entropy_scale * action_dim
+    if config.system.autotune:
+        log_alpha = jnp.zeros_like(target_entropy)
+    else:
+        log_alpha = jnp.log(config.system.init_alpha)
+
+    config.system.target_entropy = target_entropy
+
+    alpha_lr = make_learning_rate(config.system.alpha_lr, config, config.system.epochs)
+    alpha_optim = optax.chain(
+        optax.clip_by_global_norm(config.system.max_grad_norm),
+        optax.adam(alpha_lr, eps=1e-5),
+    )
+    alpha_opt_state = alpha_optim.init(log_alpha)
+
+    params = SACParams(actor_params, OnlineAndTarget(online_q_params, target_q_params), log_alpha)
+    opt_states = SACOptStates(actor_opt_state, q_opt_state, alpha_opt_state)
+
+    # Pack apply and update functions.
+    apply_fns = (actor_network.apply, double_q_network.apply)
+    update_fns = (actor_optim.update, q_optim.update, alpha_optim.update)
+
+    # Get batched iterated update and replicate it to pmap it over cores.
+    learn_step = get_learner_step_fn(apply_fns, update_fns, config)
+    learn_step = jax.pmap(learn_step, axis_name="device", devices=learner_devices)
+
+    # Load model from checkpoint if specified.
+    if config.logger.checkpointing.load_model:
+        loaded_checkpoint = Checkpointer(
+            model_name=config.system.system_name,
+            **config.logger.checkpointing.load_args,  # Other checkpoint args
+        )
+        # Restore the learner state from the checkpoint
+        restored_params, _ = loaded_checkpoint.restore_params(TParams=SACParams)
+        # Update the params
+        params = restored_params
+
+    # Define params to be replicated across learner devices.
+    replicate_learner = (params, opt_states)
+
+    # Duplicate across learner devices.
+    replicate_learner = flax.jax_utils.replicate(replicate_learner, devices=learner_devices)
+
+    # Initialise learner state.
+    params, opt_states = replicate_learner
+    key, step_key = jax.random.split(key)
+    step_keys = jax.random.split(step_key, len(learner_devices))
+    init_learner_state = CoreLearnerState(params, opt_states, step_keys, None)
+
+    return learn_step, actor_network, init_learner_state
+
+
+def run_experiment(_config: DictConfig) -> float:
+    """Runs experiment."""
+    config = copy.deepcopy(_config)
+
+    # Get the actor, learner and evaluator devices
+    actor_devices, learner_devices, evaluator_devices = get_off_policy_devices(config)
+
+    # Perform some checks on the config
+    # This additionally calculates certains
+    # values based on the config
+    config = check_total_timesteps(config)
+
+    # Create the environment factory.
+    env_factory = environments.make_factory(config)
+    assert isinstance(
+        env_factory, EnvFactory
+    ), "Environment factory must be an instance of EnvFactory"
+
+    # PRNG keys.
+    key, key_e, actor_net_key, q_net_key = jax.random.split(
+        jax.random.PRNGKey(config.arch.seed), num=4
+    )
+    np_rng = np.random.default_rng(config.arch.seed)
+
+    # Setup learner.
+    learn_step, actor_network, learner_state = learner_setup(
+        env_factory, (key, actor_net_key, q_net_key), learner_devices, config
+    )
+    eval_act_fn = get_distribution_act_fn(config, actor_network.apply)
+    # Setup evaluator.
+    evaluator_lifetime = ThreadLifetime()
+    evaluator, evaluator_envs = get_sebulba_async_evaluator(
+        env_factory, eval_act_fn, config, np_rng, evaluator_devices, evaluator_lifetime
+    )
+    evaluator.start()
+
+    # Logger setup
+    logger = StoixLogger(config)
+    cfg: Dict = OmegaConf.to_container(config, resolve=True)
+    cfg["arch"]["devices"] = jax.devices()
+    pprint(cfg)
+
+    # Run the actors, the learner and the evaluator until training is done.
+    eval_metrics, best_params, t, eval_step = run_off_policy_training(
+        config,
+        env_factory,
+        learn_step,
+        learner_state,
+        get_act_fn(actor_network.apply),
+        Transition,
+        lambda params: params.actor_params,
+        evaluator,
+        logger,
+        key,
+        np_rng,
+        actor_devices,
+        learner_devices,
+    )
+    for envs in evaluator_envs:
+        envs.close()
+    eval_performance = float(jnp.mean(eval_metrics[config.env.eval_metric]))
+
+    # Measure absolute metric.
+    if config.arch.absolute_metric:
+        print(f"{Fore.MAGENTA}{Style.BRIGHT}Measuring absolute metric...{Style.RESET_ALL}")
+        abs_metric_evaluator, abs_metric_evaluator_envs = get_sebulba_eval_fn(
+            env_factory, eval_act_fn, config, np_rng, evaluator_devices[0], eval_multiplier=10
+        )
+        eval_metrics = abs_metric_evaluator(best_params, key_e)
+
+        logger.log(eval_metrics, t, eval_step, LogEvent.ABSOLUTE)
+        abs_metric_evaluator_envs.close()
+
+    # Stop the logger.
+    logger.stop()
+
+    return eval_performance
+
+
+@hydra.main(
+    config_path="../../../configs/default/sebulba",
+    config_name="default_ff_sac.yaml",
+    version_base="1.2",
+)
+def hydra_entry_point(cfg: DictConfig) -> float:
+    """Experiment entry point."""
+    # Allow dynamic attributes.
+    OmegaConf.set_struct(cfg, False)
+
+    # Run experiment.
+    start = time.monotonic()
+    eval_performance = run_experiment(cfg)
+    end = time.monotonic()
+    print(
+        f"{Fore.CYAN}{Style.BRIGHT}SAC experiment completed in {end - start:.2f}s.{Style.RESET_ALL}"
+    )
+    return eval_performance
+
+
+if __name__ == "__main__":
+    hydra_entry_point()
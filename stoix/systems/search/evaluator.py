@@ -1,4 +1,4 @@
-from typing import Callable, Dict, Tuple
+from typing import Any, Callable, Dict, Tuple
 
 import chex
 import jax
@@ -8,8 +8,16 @@ from jumanji.env import Environment
 from omegaconf import DictConfig
 
 from stoix.base_types import EvalFn, EvalState, EvaluationOutput
+from stoix.evaluator import evaluate_on_devices, get_refill_evaluator_fn
 from stoix.systems.search.search_types import RootFnApply, SearchApply
-from stoix.utils.jax_utils import unreplicate_batch_dim
+from stoix.utils.jax_utils import (
+    device_map,
+    evaluation_overlaps_training,
+    get_anakin_evaluator_devices,
+    get_num_evaluator_replicas,
+    get_num_learner_replicas,
+    unreplicate_batch_dim,
+)
 
 
 def get_search_evaluator_fn(
@@ -21,6 +29,27 @@ def get_search_evaluator_fn(
     eval_multiplier: int = 1,
 ) -> EvalFn:
     """Get the evaluator function for search-based agents."""
+    if config.arch.evaluation_mode == "refill":
+
+        def select_action(
+            params: FrozenDict,
+            policy_state: None,
+            env_state: Any,
+            observation: chex.Array,
+            key: chex.PRNGKey,
+        ) -> Tuple[None, chex.Array]:
+            """Select the action of a single lane."""
+            root_key, policy_key = jax.random.split(key)
+            obs, model_env_state = jax.tree_util.tree_map(
+                lambda x: x[jnp.newaxis, ...], (observation, env_state)
+            )
+            root = root_fn(params, obs, model_env_state, root_key)
+            search_output = search_apply_fn(params, policy_key, root)
+            return policy_state, search_output.action.squeeze()
+
+        return get_refill_evaluator_fn(
+            env, select_action, lambda: None, config, log_solve_rate, eval_multiplier
+        )
 
     def eval_one_episode(params: FrozenDict, init_eval_state: EvalState) -> Dict:
         """Evaluate one episode. It is vectorized over the number of evaluation episodes."""
@@ -72,7 +101,7 @@ def get_search_evaluator_fn(
         """Evaluator function."""
 
         # Initialise environment states and timesteps.
-        n_devices = len(jax.devices())
+        n_devices = get_num_evaluator_replicas(config)
 
         eval_batch = (config.arch.num_eval_episodes // n_devices) * eval_multiplier
 
@@ -117,7 +146,7 @@ def search_evaluator_setup(
 ) -> Tuple[EvalFn, EvalFn, Tuple[FrozenDict, chex.Array]]:
     """Initialise evaluator_fn."""
     # Get available TPU cores.
-    n_devices = len(jax.devices())
+    n_devices = get_num_learner_replicas(config)
     # Check if solve rate is required for evaluation.
     if hasattr(config.env, "solved_return_threshold"):
         log_solve_rate = True
@@ -135,8 +164,19 @@ def search_evaluator_setup(
         10,
     )
 
-    evaluator = jax.pmap(evaluator, axis_name="device")
-    absolute_metric_evaluator = jax.pmap(absolute_metric_evaluator, axis_name="device")
+    evaluator_devices = get_anakin_evaluator_devices(config)
+    if evaluation_overlaps_training(config):
+        # Dedicated evaluation devices each evaluate a full copy of the params.
+        evaluator = evaluate_on_devices(
+            jax.pmap(evaluator, axis_name="device", devices=evaluator_devices), evaluator_devices
+        )
+        absolute_metric_evaluator = evaluate_on_devices(
+            jax.pmap(absolute_metric_evaluator, axis_name="device", devices=evaluator_devices),
+            evaluator_devices,
+        )
+    else:
+        evaluator = device_map(evaluator, config, evaluator_devices)
+        absolute_metric_evaluator = device_map(absolute_metric_evaluator, config, evaluator_devices)
 
     # Broadcast trained params to cores and split keys for each core.
     trained_params = unreplicate_batch_dim(params)
@@ -0,0 +1,94 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Tuple
+
+import jax
+from colorama import Fore, Style
+from omegaconf import DictConfig
+
+from stoix.base_types import EvalFn
+
+
+def configure_compilation_cache(config: DictConfig) -> None:
+    """Enable the persistent XLA compilation cache in `config.arch.compilation_cache_dir`.
+
+    Compiled executables are stored on disk, keyed by a hash of the lowered program, which
+    includes the shapes of the inputs and every constant derived from the config, as well as
+    the devices and the jax version. Runs and sweep trials that compile the same functions,
+    e.g. that only differ in their seed or learning rates, then load them instead of compiling
+    them again. This has to be called before the first compilation of the process.
+    """
+    cache_dir = config.arch.compilation_cache_dir
+    if cache_dir is None:
+        return
+    cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    jax.config.update("jax_compilation_cache_dir", cache_dir)
+    jax.config.update(
+        "jax_persistent_cache_min_compile_time_secs",
+        config.arch.compilation_cache_min_compile_time,
+    )
+
+
+def compile_ahead_of_time(fns: Dict[str, Tuple[Callable, Tuple]]) -> Dict[str, Callable]:
+    """Lower and compile functions for the given example arguments in parallel threads.
+
+    Args:
+        fns: the functions to compile by name, each with the arguments it will be called with.
+            The compiled functions only accept arguments of the same shapes and types.
+
+    Returns:
+        The compiled functions by name.
+    """
+
+    def compile_fn(fn_and_args: Tuple[Callable, Tuple]) -> Callable:
+        fn, args = fn_and_args
+        return fn.lower(*args).compile()  # type: ignore
+
+    # XLA releases the GIL while compiling, so the functions are compiled concurrently.
+    with ThreadPoolExecutor(max_workers=len(fns), thread_name_prefix="compile") as executor:
+        compiled = executor.map(compile_fn, fns.values())
+        return dict(zip(fns.keys(), compiled))
+
+
+def compile_anakin_fns(
+    config: DictConfig,
+    learn: Callable,
+    learner_state: Any,
+    evaluator: EvalFn,
+    absolute_metric_evaluator: EvalFn,
+    eval_args: Tuple,
+) -> Tuple[Callable, EvalFn, EvalFn, Dict[str, float]]:
+    """Compile the learner and the evaluators of an Anakin system before training.
+
+    With `config.arch.aot_compile`, the pmapped `learn` and evaluators are compiled ahead of
+    time and concurrently, so that the time spent compiling them is reported separately from
+    the training time of the first evaluation interval. Evaluators that run on dedicated
+    devices are wrapped in python and are still compiled on their first call.
+
+    Returns:
+        The learner and evaluators, compiled or unchanged, and the metrics of the compilation
+        to log as a MISC event, empty without ahead of time compilation.
+    """
+    if not config.arch.aot_compile:
+        return learn, evaluator, absolute_metric_evaluator, {}
+
+    fns: Dict[str, Tuple[Callable, Tuple]] = {"learn": (learn, (learner_state,))}
+    if hasattr(evaluator, "lower"):
+        fns["evaluator"] = (evaluator, eval_args)
+    if config.arch.absolute_metric and hasattr(absolute_metric_evaluator, "lower"):
+        fns["absolute_metric_evaluator"] = (absolute_metric_evaluator, eval_args)
+
+    start_time = time.time()
+    compiled = compile_ahead_of_time(fns)
+    compile_time = time.time() - start_time
+    print(
+        f"{Fore.YELLOW}{Style.BRIGHT}Compiled {', '.join(compiled)} ahead of time in "
+        f"{compile_time:.1f}s.{Style.RESET_ALL}"
+    )
+    return (
+        compiled["learn"],
+        compiled.get("evaluator", evaluator),
+        compiled.get("absolute_metric_evaluator", absolute_metric_evaluator),
+        {"compile_time": compile_time},
+    )
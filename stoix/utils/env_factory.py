@@ -2,22 +2,7 @@ import abc
 import threading
 from typing import Any
 
-from colorama import Fore, Style
-
-# Envpool is not usable on certain platforms, so we need to handle the ImportError
-try:
-    import envpool
-except ImportError:
-    envpool = None
-    print(
-        f"{Fore.MAGENTA}{Style.BRIGHT}Envpool not installed. "
-        f"Please install it to use the Envpool factory{Style.RESET_ALL}"
-    )
-
-import gymnasium
-
 from stoix.wrappers.envpool import EnvPoolToJumanji
-from stoix.wrappers.gymnasium import VecGymToJumanji
 
 
 class EnvFactory(abc.ABC):
@@ -44,6 +29,9 @@ class EnvPoolFactory(EnvFactory):
     """
 
     def __call__(self, num_envs: int) -> Any:
+        # Envpool is not usable on certain platforms, so it is only imported when used.
+        import envpool
+
         with self.lock:
             seed = self.seed
             self.seed += num_envs
@@ -65,6 +53,10 @@ class GymnasiumFactory(EnvFactory):
     """
 
     def __call__(self, num_envs: int) -> Any:
+        import gymnasium
+
+        from stoix.wrappers.gymnasium import VecGymToJumanji
+
         with self.lock:
             vec_env = gymnasium.make_vec(id=self.task_id, num_envs=num_envs, **self.kwargs)
             return VecGymToJumanji(vec_env)
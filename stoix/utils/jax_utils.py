@@ -1,7 +1,13 @@
+import functools
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, Tuple, Union
+
 import chex
+import flax
 import jax
 import jax.numpy as jnp
 import numpy as np
+from jax.sharding import Mesh, NamedSharding, PartitionSpec
+from omegaconf import DictConfig
 
 
 def scale_gradient(g: chex.Array, scale: float = 1) -> chex.Array:
@@ -56,3 +62,221 @@ def unreplicate_batch_dim(x: chex.ArrayTree) -> chex.ArrayTree:
     We simply take element 0 as the params are identical across this dimension.
     """
     return jax.tree_util.tree_map(lambda x: x[:, 0, ...], x)  # type: ignore
+
+
+def unreplicate_local(x: chex.ArrayTree) -> chex.ArrayTree:
+    """Unreplicates a pytree replicated across devices by taking its first local replica.
+
+    Unlike indexing the device axis, this also works for arrays that are replicated across
+    the devices of several processes, which are not fully addressable by any single process.
+    """
+    return jax.tree_util.tree_map(lambda x: x.addressable_data(0), x)  # type: ignore
+
+
+def get_anakin_learner_devices(config: DictConfig) -> List[jax.Device]:
+    """Get the devices used for training by Anakin systems. These are all the devices except
+    the ones reserved for evaluation with `config.arch.evaluator_device_ids`."""
+    if config.arch.evaluator_device_ids is None:
+        return jax.devices()
+    return [
+        device
+        for device_id, device in enumerate(jax.devices())
+        if device_id not in config.arch.evaluator_device_ids
+    ]
+
+
+def get_anakin_evaluator_devices(config: DictConfig) -> List[jax.Device]:
+    """Get the devices used for evaluation by Anakin systems. By default evaluation runs on
+    the learner devices."""
+    if config.arch.evaluate_on_cpu:
+        return jax.devices("cpu")
+    if config.arch.evaluator_device_ids is not None:
+        return [jax.devices()[device_id] for device_id in config.arch.evaluator_device_ids]
+    return jax.devices()
+
+
+def evaluation_overlaps_training(config: DictConfig) -> bool:
+    """Whether Anakin evaluation runs on devices that are not used for training, in which case
+    the evaluation of a snapshot can overlap with the next training chunk."""
+    return bool(config.arch.evaluate_on_cpu or config.arch.evaluator_device_ids is not None)
+
+
+def get_num_learner_replicas(config: DictConfig) -> int:
+    """Get the number of replicas of the learner of Anakin systems, i.e. the size of the leading
+    device axis of the learner state. With the `jit` parallel backend, each replica spans
+    `config.arch.model_axis_size` devices."""
+    num_devices = len(get_anakin_learner_devices(config))
+    model_axis_size = config.arch.model_axis_size
+    assert (
+        config.arch.parallel_backend == "jit" or model_axis_size == 1
+    ), "A model axis is only supported by the jit parallel backend."
+    assert num_devices % model_axis_size == 0, (
+        f"The number of learner devices ({num_devices}) should be divisible by "
+        f"the model axis size ({model_axis_size})."
+    )
+    return num_devices // model_axis_size
+
+
+def get_num_evaluator_replicas(config: DictConfig) -> int:
+    """Get the number of replicas of the evaluators of Anakin systems. Evaluators on dedicated
+    devices are pmapped over them, otherwise they are mapped like the learner."""
+    if evaluation_overlaps_training(config):
+        return len(get_anakin_evaluator_devices(config))
+    return get_num_learner_replicas(config)
+
+
+@functools.lru_cache(maxsize=None)
+def get_device_mesh(devices: Tuple[jax.Device, ...], model_axis_size: int = 1) -> Mesh:
+    """Get a mesh of the devices with a `data` axis, along which the replicas of the learner are
+    laid out, and a `model` axis, along which the parameters of each replica are split."""
+    return Mesh(np.asarray(devices).reshape(-1, model_axis_size), ("data", "model"))
+
+
+def _is_model_sharded(path: Tuple[Any, ...], x: Any, model_axis_size: int) -> bool:
+    """Whether a leaf holds parameters, or their optimiser state, whose features can be split
+    evenly along the model axis."""
+    names = {getattr(key, "name", getattr(key, "key", None)) for key in path}
+    return (
+        model_axis_size > 1
+        and bool(names & {"params", "opt_states"})
+        and jnp.issubdtype(x.dtype, jnp.floating)
+        and x.ndim >= 2
+        and x.shape[-1] % model_axis_size == 0
+    )
+
+
+def get_replica_shardings(tree: chex.ArrayTree, mesh: Mesh) -> chex.ArrayTree:
+    """Get the shardings of a pytree whose leaves have a leading axis over the learner replicas.
+
+    Every leaf is split along the `data` axis of the mesh, so that each replica, including its
+    replay buffer, only lives on its own devices. The last axis of the parameters and of their
+    optimiser state is also split along the `model` axis, and XLA partitions the computation
+    of each replica across the devices of that axis accordingly.
+    """
+    model_axis_size = mesh.shape["model"]
+
+    def sharding(path: Tuple[Any, ...], x: Any) -> NamedSharding:
+        if _is_model_sharded(path, x, model_axis_size):
+            return NamedSharding(mesh, PartitionSpec("data", *[None] * (x.ndim - 2), "model"))
+        return NamedSharding(mesh, PartitionSpec("data"))
+
+    return jax.tree_util.tree_map_with_path(sharding, tree)
+
+
+class _ReplicaJit:
+    """`fn` vmapped over the learner replicas and jitted with the shardings of its arguments and
+    outputs given by `get_replica_shardings`. These depend on the shapes of the arguments, so
+    the function is jitted again for arguments of new shapes. Like a jitted function, it can be
+    lowered for ahead of time compilation."""
+
+    def __init__(
+        self, fn: Callable, mesh: Mesh, donate_argnums: Union[int, Tuple[int, ...]]
+    ) -> None:
+        self._fn = jax.vmap(fn, axis_name="device")
+        self._mesh = mesh
+        self._donate_argnums = donate_argnums
+        self._jitted_fns: Dict[Any, Tuple[Any, Callable]] = {}
+
+    def _get_jitted_fn(self, args: Tuple) -> Tuple[Any, Callable]:
+        leaves, treedef = jax.tree_util.tree_flatten(args)
+        signature = (treedef, tuple((np.shape(x), getattr(x, "dtype", None)) for x in leaves))
+        if signature not in self._jitted_fns:
+            in_shardings = get_replica_shardings(args, self._mesh)
+            out_shardings = get_replica_shardings(jax.eval_shape(self._fn, *args), self._mesh)
+            jitted_fn = jax.jit(
+                self._fn,
+                in_shardings=in_shardings,
+                out_shardings=out_shardings,
+                donate_argnums=self._donate_argnums,
+            )
+            self._jitted_fns[signature] = (in_shardings, jitted_fn)
+        return self._jitted_fns[signature]
+
+    def __call__(self, *args: Any) -> Any:
+        in_shardings, jitted_fn = self._get_jitted_fn(args)
+        # Arrays that are already laid out as expected, e.g. the learner state returned by the
+        # previous call, are not copied.
+        return jitted_fn(*jax.device_put(args, in_shardings))
+
+    def lower(self, *args: Any) -> "_LoweredReplicaJit":
+        in_shardings, jitted_fn = self._get_jitted_fn(args)
+        return _LoweredReplicaJit(
+            jitted_fn.lower(*jax.device_put(args, in_shardings)), in_shardings
+        )
+
+
+class _LoweredReplicaJit(NamedTuple):
+    """A lowered `_ReplicaJit`, whose compiled function also lays out its arguments first."""
+
+    lowered: Any
+    in_shardings: Any
+
+    def compile(self) -> Callable:
+        compiled = self.lowered.compile()
+        return lambda *args: compiled(*jax.device_put(args, self.in_shardings))
+
+
+def device_map(
+    fn: Callable,
+    config: DictConfig,
+    devices: Sequence[jax.Device],
+    donate_argnums: Union[int, Tuple[int, ...]] = (),
+) -> Callable:
+    """Map a function over the leading replica axis of its arguments and outputs.
+
+    With `config.arch.parallel_backend` set to `"pmap"`, this is `jax.pmap` with one replica
+    per device. With `"jit"`, the devices form a mesh with `data` and `model` axes, see
+    `get_device_mesh`, and `fn` is vmapped over the replicas and jitted with the shardings of
+    `get_replica_shardings`. In both cases `fn` sees the arguments of a single replica and can
+    use collectives over the `device` axis, so the same functions run with both backends.
+    """
+    if config.arch.parallel_backend == "pmap":
+        return jax.pmap(fn, axis_name="device", devices=devices, donate_argnums=donate_argnums)
+    if config.arch.parallel_backend != "jit":
+        raise ValueError(f"Unknown parallel backend: {config.arch.parallel_backend}")
+    mesh = get_device_mesh(tuple(devices), config.arch.model_axis_size)
+    return _ReplicaJit(fn, mesh, donate_argnums)
+
+
+def replicate_on_devices(
+    tree: chex.ArrayTree, config: DictConfig, devices: Sequence[jax.Device]
+) -> chex.ArrayTree:
+    """Replicate a pytree across the learner replicas, along a new leading axis, for
+    `device_map`.
+
+    With the `jit` backend, the replicas are laid out with the shardings of
+    `get_replica_shardings`, so each device only receives its part of its own replica.
+    """
+    if config.arch.parallel_backend == "pmap":
+        return flax.jax_utils.replicate(tree, devices=devices)
+
+    mesh = get_device_mesh(tuple(devices), config.arch.model_axis_size)
+    tree = jax.tree_util.tree_map(jnp.asarray, tree)
+    replicated_shapes = jax.tree_util.tree_map(
+        lambda x: jax.ShapeDtypeStruct((mesh.shape["data"],) + x.shape, x.dtype), tree
+    )
+
+    def replicate(x: chex.Array, sharding: NamedSharding) -> jax.Array:
+        # Each shard is placed on its device directly, without materialising all the replicas.
+        return jax.make_array_from_callback(
+            (mesh.shape["data"],) + x.shape,
+            sharding,
+            lambda index: x[None][(slice(None),) + index[1:]],
+        )
+
+    return jax.tree_util.tree_map(replicate, tree, get_replica_shardings(replicated_shapes, mesh))
+
+
+def get_peak_memory_metrics(devices: Sequence[jax.Device]) -> Dict[str, float]:
+    """Get the largest peak memory, in GiB, used by any of the devices since the process started.
+
+    This is empty on backends that do not report memory statistics, such as CPU.
+    """
+    peak_bytes = [
+        stats["peak_bytes_in_use"]
+        for stats in (device.memory_stats() for device in devices)
+        if stats is not None and "peak_bytes_in_use" in stats
+    ]
+    if not peak_bytes:
+        return {}
+    return {"peak_memory_gb": max(peak_bytes) / 2**30}
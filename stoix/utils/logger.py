@@ -7,16 +7,11 @@ from enum import Enum
 from typing import Dict, List, Union
 
 import jax
-import neptune
 import numpy as np
-import wandb
 from colorama import Fore, Style
 from jax.typing import ArrayLike
-from marl_eval.json_tools import JsonLogger as MarlEvalJsonLogger
-from neptune.utils import stringify_unsupported
-from omegaconf import DictConfig
+from omegaconf import DictConfig, OmegaConf
 from pandas.io.json._normalize import _simple_json_normalize as flatten_dict
-from tensorboard_logger import configure, log_value
 
 
 class LogEvent(Enum):
@@ -55,7 +50,8 @@ class StoixLogger:
 
         if event == LogEvent.TRAIN:
             # We only want to log mean losses, max/min/std don't matter.
-            metrics = jax.tree_util.tree_map(np.mean, metrics)
+            # Skipped updates have NaN losses, see `scan_update_epochs`.
+            metrics = jax.tree_util.tree_map(np.nanmean, metrics)
         else:
             # {metric1_name: [metrics], metric2_name: ...} ->
             # {metric1_name: {mean: metric, max: metric, ...}, metric2_name: ...}
@@ -135,6 +131,10 @@ class NeptuneLogger(BaseLogger):
     """Logger for neptune.ai."""
 
     def __init__(self, cfg: DictConfig, unique_token: str) -> None:
+        # The logging backends are only imported when they are used.
+        import neptune
+        from neptune.utils import stringify_unsupported
+
         tags = list(cfg.logger.kwargs.tags)
         project = cfg.logger.kwargs.project
 
@@ -181,10 +181,13 @@ class WandBLogger(BaseLogger):
     """Logger for wandb.ai."""
 
     def __init__(self, cfg: DictConfig, unique_token: str) -> None:
+        import wandb
+
+        self.wandb = wandb
         tags = list(cfg.logger.kwargs.tags)
         project = cfg.logger.kwargs.project
 
-        wandb.init(project=project, tags=tags, config=stringify_unsupported(cfg))
+        wandb.init(project=project, tags=tags, config=OmegaConf.to_container(cfg, resolve=True))
 
         self.detailed_logging = cfg.logger.kwargs.detailed_logging
 
@@ -205,12 +208,12 @@ class WandBLogger(BaseLogger):
             return
 
         data_to_log = {f"{event.value}/{key}": value}
-        wandb.log(data_to_log, step=step)
+        self.wandb.log(data_to_log, step=step)
 
     def stop(self) -> None:
         if self.upload_json_data:
             self._zip_and_upload_json()
-        wandb.finish()  # type: ignore
+        self.wandb.finish()  # type: ignore
 
     def _zip_and_upload_json(self) -> None:
         # Create the zip file path by replacing '.json' with '.zip'
@@ -220,13 +223,15 @@ class WandBLogger(BaseLogger):
         with zipfile.ZipFile(zip_file_path, "w", zipfile.ZIP_DEFLATED) as zipf:
             zipf.write(self.json_file_path)
 
-        wandb.save(zip_file_path)
+        self.wandb.save(zip_file_path)
 
 
 class TensorboardLogger(BaseLogger):
     """Logger for tensorboard"""
 
     def __init__(self, cfg: DictConfig, unique_token: str) -> None:
+        from tensorboard_logger import configure, log_value
+
         tb_exp_path = get_logger_path(cfg, "tensorboard")
         tb_logs_path = os.path.join(cfg.logger.base_exp_path, f"{tb_exp_path}/{unique_token}")
 
@@ -245,6 +250,8 @@ class JsonLogger(BaseLogger):
     _METRICS_TO_LOG = ["episode_return/mean", "solve_rate", "steps_per_second"]
 
     def __init__(self, cfg: DictConfig, unique_token: str) -> None:
+        from marl_eval.json_tools import JsonLogger as MarlEvalJsonLogger
+
         json_exp_path = get_logger_path(cfg, "json")
         json_logs_path = os.path.join(cfg.logger.base_exp_path, f"{json_exp_path}/{unique_token}")
 
@@ -336,6 +343,10 @@ def _make_multi_logger(cfg: DictConfig) -> BaseLogger:
     loggers: List[BaseLogger] = []
     unique_token = datetime.now().strftime("%Y%m%d%H%M%S")
 
+    # In multi-process runs only the first process logs.
+    if jax.process_index() != 0:
+        return MultiLogger(loggers)
+
     if (
         (cfg.logger.use_neptune or cfg.logger.use_wandb)
         and cfg.logger.use_json
@@ -1,4 +1,4 @@
-from typing import Tuple
+from typing import Tuple, Union
 
 import chex
 import jax
@@ -110,8 +110,13 @@ def q_learning(
     d_t: chex.Array,
     q_t: chex.Array,
     huber_loss_parameter: chex.Array,
-) -> jnp.ndarray:
-    """Computes the double Q-learning loss. Each input is a batch."""
+    reduce: bool = True,
+) -> Union[chex.Array, Tuple[chex.Array, chex.Array]]:
+    """Computes the Q-learning loss. Each input is a batch.
+
+    Returns the mean loss, or the loss and the TD error of each element of the batch if
+    `reduce` is False.
+    """
     batch_indices = jnp.arange(a_tm1.shape[0])
     # Compute Q-learning n-step TD-error.
     target_tm1 = r_t + d_t * jnp.max(q_t, axis=-1)
@@ -121,7 +126,7 @@ def q_learning(
     else:
         batch_loss = rlax.l2_loss(td_error)
 
-    return jnp.mean(batch_loss)
+    return jnp.mean(batch_loss) if reduce else (batch_loss, td_error)
 
 
 def double_q_learning(
@@ -132,8 +137,13 @@ def double_q_learning(
     d_t: chex.Array,
     q_t_selector: chex.Array,
     huber_loss_parameter: chex.Array,
-) -> jnp.ndarray:
-    """Computes the double Q-learning loss. Each input is a batch."""
+    reduce: bool = True,
+) -> Union[chex.Array, Tuple[chex.Array, chex.Array]]:
+    """Computes the double Q-learning loss. Each input is a batch.
+
+    Returns the mean loss, or the loss and the TD error of each element of the batch if
+    `reduce` is False.
+    """
     batch_indices = jnp.arange(a_tm1.shape[0])
     # Compute double Q-learning n-step TD-error.
     target_tm1 = r_t + d_t * q_t_value[batch_indices, q_t_selector.argmax(-1)]
@@ -143,7 +153,7 @@ def double_q_learning(
     else:
         batch_loss = rlax.l2_loss(td_error)
 
-    return jnp.mean(batch_loss)
+    return jnp.mean(batch_loss) if reduce else (batch_loss, td_error)
 
 
 def td_learning(
@@ -152,15 +162,20 @@ def td_learning(
     discount_t: chex.Array,
     v_t: chex.Array,
     huber_loss_parameter: chex.Array,
-) -> chex.Array:
-    """Calculates the temporal difference error. Each input is a batch."""
+    reduce: bool = True,
+) -> Union[chex.Array, Tuple[chex.Array, chex.Array]]:
+    """Calculates the temporal difference error. Each input is a batch.
+
+    Returns the mean loss, or the loss and the TD error of each element of the batch if
+    `reduce` is False.
+    """
     target_tm1 = r_t + discount_t * v_t
     td_errors = target_tm1 - v_tm1
     if huber_loss_parameter > 0.0:
         batch_loss = rlax.huber_loss(td_errors, huber_loss_parameter)
     else:
         batch_loss = rlax.l2_loss(td_errors)
-    return jnp.mean(batch_loss)
+    return jnp.mean(batch_loss) if reduce else (batch_loss, td_errors)
 
 
 def categorical_td_learning(
@@ -170,8 +185,13 @@ def categorical_td_learning(
     d_t: chex.Array,
     v_logits_t: chex.Array,
     v_atoms_t: chex.Array,
-) -> chex.Array:
-    """Implements TD-learning for categorical value distributions. Each input is a batch."""
+    reduce: bool = True,
+) -> Union[chex.Array, Tuple[chex.Array, chex.Array]]:
+    """Implements TD-learning for categorical value distributions. Each input is a batch.
+
+    Returns the mean loss, or the loss and the TD error of each element of the batch if
+    `reduce` is False. The TD error is taken between the means of the distributions.
+    """
 
     # Scale and shift time-t distribution atoms by discount and reward.
     target_z = r_t[:, jnp.newaxis] + d_t[:, jnp.newaxis] * v_atoms_t
@@ -184,7 +204,10 @@ def categorical_td_learning(
 
     td_error = tfd.Categorical(probs=target).cross_entropy(tfd.Categorical(logits=v_logits_tm1))
 
-    return jnp.mean(td_error)
+    if reduce:
+        return jnp.mean(td_error)
+    mean_td_error = jnp.sum((target - jax.nn.softmax(v_logits_tm1)) * v_atoms_tm1, axis=-1)
+    return td_error, mean_td_error
 
 
 def munchausen_q_learning(
@@ -198,7 +221,13 @@ def munchausen_q_learning(
     munchausen_coefficient: chex.Array,
     clip_value_min: chex.Array,
     huber_loss_parameter: chex.Array,
-) -> chex.Array:
+    reduce: bool = True,
+) -> Union[chex.Array, Tuple[chex.Array, chex.Array]]:
+    """Computes the Munchausen Q-learning loss. Each input is a batch.
+
+    Returns the mean loss, or the loss and the TD error of each element of the batch if
+    `reduce` is False.
+    """
     action_one_hot = jax.nn.one_hot(a_tm1, q_tm1.shape[-1])
     q_tm1_a = jnp.sum(q_tm1 * action_one_hot, axis=-1)
     # Compute double Q-learning loss.
@@ -219,8 +248,7 @@ def munchausen_q_learning(
         batch_loss = rlax.huber_loss(td_error, huber_loss_parameter)
     else:
         batch_loss = rlax.l2_loss(td_error)
-    batch_loss = jnp.mean(batch_loss)
-    return batch_loss
+    return jnp.mean(batch_loss) if reduce else (batch_loss, td_error)
 
 
 def quantile_regression_loss(
@@ -274,7 +302,8 @@ def quantile_q_learning(
     dist_q_t_selector: chex.Array,
     dist_q_t: chex.Array,
     huber_param: float = 0.0,
-) -> chex.Array:
+    reduce: bool = True,
+) -> Union[chex.Array, Tuple[chex.Array, chex.Array]]:
     """Implements Q-learning for quantile-valued Q distributions.
 
     See "Distributional Reinforcement Learning with Quantile Regression" by
@@ -293,9 +322,11 @@ def quantile_q_learning(
         huber_param: Huber loss parameter, defaults to 0 (no Huber loss).
         stop_target_gradients: bool indicating whether or not to apply stop gradient
         to targets.
+        reduce: whether to average the loss over the batch.
 
     Returns:
-        Quantile regression Q learning loss.
+        Quantile regression Q learning loss, or its value and the TD error between the means
+        of the distributions for each element of the batch if `reduce` is False.
     """
     batch_indices = jnp.arange(a_tm1.shape[0])
 
@@ -311,4 +342,8 @@ def quantile_q_learning(
     dist_target = r_t[:, jnp.newaxis] + d_t[:, jnp.newaxis] * dist_qa_t
     dist_target = jax.lax.stop_gradient(dist_target)
 
-    return quantile_regression_loss(dist_qa_tm1, tau_q_tm1, dist_target, huber_param).mean()
+    batch_loss = quantile_regression_loss(dist_qa_tm1, tau_q_tm1, dist_target, huber_param)
+    if reduce:
+        return jnp.mean(batch_loss)
+    td_error = jnp.mean(dist_target, axis=-1) - jnp.mean(dist_qa_tm1, axis=-1)
+    return batch_loss, td_error
@@ -1,43 +1,28 @@
 import copy
-from typing import Tuple
+import importlib
+from typing import Callable, Container, Dict, List, Optional, Tuple
 
-import gymnax
 import hydra
 import jax.numpy as jnp
-import jaxmarl
-import jumanji
-import navix
-import pgx
-import popjym
-import xminigrid
-from brax.envs import _envs as brax_environments
-from brax.envs import create as brax_make
-from gymnax import registered_envs as gymnax_environments
-from jaxmarl.environments.smax import map_name_to_scenario
-from jaxmarl.registration import registered_envs as jaxmarl_environments
 from jumanji.env import Environment
-from jumanji.registration import _REGISTRY as JUMANJI_REGISTRY
 from jumanji.specs import BoundedArray, MultiDiscreteArray
 from jumanji.wrappers import AutoResetWrapper, MultiToSingleWrapper
-from navix import registry as navix_registry
 from omegaconf import DictConfig
-from popjym.registration import REGISTERED_ENVS as POPJYM_REGISTRY
-from xminigrid.registration import _REGISTRY as XMINIGRID_REGISTRY
 
 from stoix.utils.debug_env import IdentityGame, SequenceGame
 from stoix.utils.env_factory import EnvFactory, EnvPoolFactory, GymnasiumFactory
-from stoix.wrappers import GymnaxWrapper, JumanjiWrapper, RecordEpisodeMetrics
-from stoix.wrappers.brax import BraxJumanjiWrapper
+from stoix.wrappers import JumanjiWrapper, RecordEpisodeMetrics
 from stoix.wrappers.jax_to_factory import JaxEnvFactory
-from stoix.wrappers.jaxmarl import JaxMarlWrapper, MabraxWrapper, SmaxWrapper
-from stoix.wrappers.navix import NavixWrapper
-from stoix.wrappers.pgx import PGXWrapper
 from stoix.wrappers.transforms import (
     AddStartFlagAndPrevAction,
     MultiBoundedToBounded,
     MultiDiscreteToDiscrete,
 )
-from stoix.wrappers.xminigrid import XMiniGridWrapper
+
+# The environment suites are imported by the functions creating their environments, so that
+# only the suite of the environment being used is imported, see `make`.
+
+EnvMaker = Callable[[str, DictConfig], Tuple[Environment, Environment]]
 
 
 def make_jumanji_env(
@@ -54,8 +39,9 @@ def make_jumanji_env(
     Returns:
         A tuple of the environments.
     """
-    # Config generator and select the wrapper.
+    import jumanji
 
+    # Config generator and select the wrapper.
     # Create envs.
     env_kwargs = dict(copy.deepcopy(config.env.kwargs))
     if "generator" in env_kwargs:
@@ -89,6 +75,10 @@ def make_gymnax_env(env_name: str, config: DictConfig) -> Tuple[Environment, Env
     Returns:
         A tuple of the environments.
     """
+    import gymnax
+
+    from stoix.wrappers.gymnax import GymnaxWrapper
+
     # Config generator and select the wrapper.
     # Create envs.
     env, env_params = gymnax.make(env_name, **config.env.kwargs)
@@ -114,6 +104,10 @@ def make_xland_minigrid_env(env_name: str, config: DictConfig) -> Tuple[Environm
     Returns:
         A tuple of the environments.
     """
+    import xminigrid
+
+    from stoix.wrappers.xminigrid import XMiniGridWrapper
+
     # Config generator and select the wrapper.
     # Create envs.
 
@@ -141,6 +135,10 @@ def make_brax_env(env_name: str, config: DictConfig) -> Tuple[Environment, Envir
     Returns:
         A tuple of the environments.
     """
+    from brax.envs import create as brax_make
+
+    from stoix.wrappers.brax import BraxJumanjiWrapper
+
     # Config generator and select the wrapper.
     # Create envs.
 
@@ -171,6 +169,11 @@ def make_jaxmarl_env(
     Returns:
         A JAXMARL environment.
     """
+    import jaxmarl
+    from jaxmarl.environments.smax import map_name_to_scenario
+
+    from stoix.wrappers.jaxmarl import JaxMarlWrapper, MabraxWrapper, SmaxWrapper
+
     _jaxmarl_wrappers = {"Smax": SmaxWrapper, "MaBrax": MabraxWrapper}
 
     kwargs = dict(config.env.kwargs)
@@ -226,6 +229,8 @@ def make_craftax_env(env_name: str, config: DictConfig) -> Tuple[Environment, En
         CraftaxClassicSymbolicEnv,
     )
 
+    from stoix.wrappers.gymnax import GymnaxWrapper
+
     # Config generator and select the wrapper.
     craftax_environments = {
         "Craftax-Classic-Symbolic-v1": CraftaxClassicSymbolicEnv,
@@ -305,6 +310,9 @@ def make_pgx_env(env_name: str, config: DictConfig) -> Tuple[Environment, Enviro
     Returns:
         A tuple of the environments.
     """
+    import pgx
+
+    from stoix.wrappers.pgx import PGXWrapper
 
     # Config generator and select the wrapper.
     # Create envs.
@@ -331,6 +339,9 @@ def make_popjym_env(env_name: str, config: DictConfig) -> Tuple[Environment, Env
     Returns:
         A tuple of the environments.
     """
+    import popjym
+
+    from stoix.wrappers.gymnax import GymnaxWrapper
 
     # Create envs.
     env, env_params = popjym.make(env_name, **config.env.kwargs)
@@ -359,6 +370,9 @@ def make_navix_env(env_name: str, config: DictConfig) -> Tuple[Environment, Envi
     Returns:
         A tuple of the environments.
     """
+    import navix
+
+    from stoix.wrappers.navix import NavixWrapper
 
     # Create envs.
     env = navix.make(env_name, **config.env.kwargs)
@@ -387,10 +401,70 @@ def make_envpool_factory(env_name: str, config: DictConfig) -> EnvPoolFactory:
     return env_factory
 
 
+# The functions creating the environments of each suite, by `config.env.env_name`.
+_ENV_MAKERS: Dict[str, EnvMaker] = {
+    "gymnax": make_gymnax_env,
+    "jumanji": make_jumanji_env,
+    "xland_minigrid": make_xland_minigrid_env,
+    "brax": make_brax_env,
+    "jaxmarl": make_jaxmarl_env,
+    "MaBrax": make_jaxmarl_env,
+    "mpe": make_jaxmarl_env,
+    "smax": make_jaxmarl_env,
+    "craftax": make_craftax_env,
+    "debug": make_debug_env,
+    "pgx": make_pgx_env,
+    "popjym": make_popjym_env,
+    "navix": make_navix_env,
+}
+
+
+# The registries of the environments of each suite, imported on first use, and the functions
+# creating their environments. Used to find the suite of environments by name.
+_ENV_REGISTRIES: List[Tuple[Callable[[], Container[str]], EnvMaker]] = [
+    (lambda: importlib.import_module("gymnax").registered_envs, make_gymnax_env),
+    (lambda: importlib.import_module("jumanji.registration")._REGISTRY, make_jumanji_env),
+    (
+        lambda: importlib.import_module("xminigrid.registration")._REGISTRY,
+        make_xland_minigrid_env,
+    ),
+    (lambda: importlib.import_module("brax.envs")._envs, make_brax_env),
+    (lambda: importlib.import_module("jaxmarl.registration").registered_envs, make_jaxmarl_env),
+    (lambda: importlib.import_module("pgx").available_envs(), make_pgx_env),
+    (lambda: importlib.import_module("popjym.registration").REGISTERED_ENVS, make_popjym_env),
+    (lambda: importlib.import_module("navix").registry(), make_navix_env),
+]
+
+
+def _find_env_maker(env_name: str) -> Optional[EnvMaker]:
+    """Find the suite of an environment by looking it up in the registry of each suite.
+
+    This is only used when `config.env.env_name` is not a known suite, since it imports the
+    suites one after the other until the environment is found. Suites that are not installed
+    are skipped.
+    """
+    if "craftax" in env_name.lower():
+        return make_craftax_env
+    if "debug" in env_name.lower():
+        return make_debug_env
+
+    for get_registry, make_env in _ENV_REGISTRIES:
+        try:
+            registry = get_registry()
+        except ImportError:
+            continue
+        if env_name in registry:
+            return make_env
+    return None
+
+
 def make(config: DictConfig) -> Tuple[Environment, Environment]:
     """
     Create environments for training and evaluation..
 
+    Only the suite named by `config.env.env_name` is imported. Environments of other suites
+    are looked up in the registries of all the suites.
+
     Args:
         config (Dict): The configuration of the environment.
 
@@ -399,28 +473,10 @@ def make(config: DictConfig) -> Tuple[Environment, Environment]:
     """
     env_name = config.env.scenario.name
 
-    if env_name in gymnax_environments:
-        envs = make_gymnax_env(env_name, config)
-    elif env_name in JUMANJI_REGISTRY:
-        envs = make_jumanji_env(env_name, config)
-    elif env_name in XMINIGRID_REGISTRY:
-        envs = make_xland_minigrid_env(env_name, config)
-    elif env_name in brax_environments:
-        envs = make_brax_env(env_name, config)
-    elif env_name in jaxmarl_environments:
-        envs = make_jaxmarl_env(env_name, config)
-    elif "craftax" in env_name.lower():
-        envs = make_craftax_env(env_name, config)
-    elif "debug" in env_name.lower():
-        envs = make_debug_env(env_name, config)
-    elif env_name in pgx.available_envs():
-        envs = make_pgx_env(env_name, config)
-    elif env_name in POPJYM_REGISTRY:
-        envs = make_popjym_env(env_name, config)
-    elif env_name in navix_registry():
-        envs = make_navix_env(env_name, config)
-    else:
+    make_env = _ENV_MAKERS.get(config.env.env_name) or _find_env_maker(env_name)
+    if make_env is None:
         raise ValueError(f"{env_name} is not a supported environment.")
+    envs = make_env(env_name, config)
 
     envs = apply_optional_wrappers(envs, config)
 
@@ -0,0 +1,1259 @@
+import abc
+import atexit
+import json
+import math
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import chex
+import flashbax as fbx
+import jax
+import jax.numpy as jnp
+import numpy as np
+import optax
+from colorama import Fore, Style
+from flashbax.buffers.trajectory_buffer import TrajectoryBuffer
+from jax.experimental import io_callback
+from jumanji import specs
+from omegaconf import DictConfig
+
+from stoix.utils.replay_codec import ReplayCodec, get_nbytes, make_replay_codec
+
+
+class CompactBufferState(NamedTuple):
+    """State of a compact item buffer.
+
+    All stored arrays have a leading `[add_batch_size, max_length_time_axis]` shape, i.e. each
+    environment owns one row of the buffer and writes to it in the order it experienced the
+    transitions.
+    """
+
+    # Transitions without their next observation.
+    experience: chex.ArrayTree
+    # Global index of the terminal observation of each transition, or -1 if the transition
+    # did not end an episode. Shape [add_batch_size, max_length_time_axis].
+    terminal_index: chex.Array
+    # Ring of terminal observations. Shape [add_batch_size, terminal_length, ...].
+    terminal_obs: chex.ArrayTree
+    # Number of terminal observations written by each environment. Shape [add_batch_size].
+    terminal_count: chex.Array
+    # Next observation of the most recently added transition of each environment.
+    last_next_obs: chex.ArrayTree
+    # Number of steps since the start of the episode of each transition, clipped to the number
+    # of stacked frames. Shape [add_batch_size, max_length_time_axis].
+    episode_step: chex.Array
+    # Episode step of the next transition added by each environment. Shape [add_batch_size].
+    next_episode_step: chex.Array
+    current_index: chex.Array
+    is_full: chex.Array
+
+
+class BufferSample(NamedTuple):
+    experience: chex.ArrayTree
+
+
+class CompactItemBuffer(NamedTuple):
+    init: Callable[[Any], CompactBufferState]
+    add: Callable[[CompactBufferState, Any], CompactBufferState]
+    sample: Callable[[CompactBufferState, chex.PRNGKey], BufferSample]
+    can_sample: Callable[[CompactBufferState], chex.Array]
+
+
+def _select(pred: chex.Array, on_true: chex.Array, on_false: chex.Array) -> chex.Array:
+    """Select along the leading axis of `on_true` and `on_false` using a batch of predicates."""
+    pred = pred.reshape(pred.shape + (1,) * (on_true.ndim - pred.ndim))
+    return jnp.where(pred, on_true, on_false)
+
+
+def make_compact_item_buffer(
+    max_length: int,
+    min_length: int,
+    sample_batch_size: int,
+    add_batch_size: int,
+    terminal_length: int,
+    num_stacked_frames: int = 1,
+    flatten_stacked_frames: bool = True,
+    sort_indices: bool = False,
+) -> CompactItemBuffer:
+    """Create an item buffer that stores every observation only once.
+
+    This is a drop-in replacement for `fbx.make_item_buffer(..., add_batches=True,
+    add_sequences=True)` for transitions with `obs`, `next_obs` and `done` fields. Rather than
+    storing `next_obs` for every transition, it is rebuilt at sample time from the observation
+    stored in the following slot of the same environment. When `done` is set, the environment
+    has auto-reset and the following observation is the first of a new episode, so the true
+    next observation is kept in a small ring of terminal observations instead.
+
+    Unlike the flashbax item buffer, the order in which transitions are added matters: data must
+    be added time-major, with shape `[sequence_length, add_batch_size, ...]`, which is what
+    `jax.lax.scan` over a batch of environments produces.
+
+    When observations are frame stacks built by the `FrameStackingWrapper`, setting
+    `num_stacked_frames` stores only the newest frame of each observation's `agent_view`, along
+    with how far back its episode started. The stacks are rebuilt at sample time, padding frames
+    from before the start of the episode with zeros like the wrapper does.
+
+    Args:
+        max_length: Total number of transitions stored across all environments. Each
+            environment stores `max_length // add_batch_size` of them.
+        min_length: Minimum number of transitions that must be stored before sampling.
+        sample_batch_size: Number of transitions returned by `sample`.
+        add_batch_size: Number of environments adding data to the buffer.
+        terminal_length: Number of terminal observations stored per environment. When more
+            episodes end within one pass over the buffer, the oldest terminal observations are
+            replaced by the first observation of the next episode. This only affects
+            transitions whose bootstrap value is masked by `done` anyway.
+        num_stacked_frames: Number of frames stacked in the `agent_view` of the observations.
+            Frames are deduplicated when this is larger than one.
+        flatten_stacked_frames: Whether the frames are stacked into the channel axis, see the
+            `flatten` argument of the `FrameStackingWrapper`.
+        sort_indices: Whether the sampled transitions are gathered in storage order, which
+            improves memory locality for large samples. The samples are then ordered.
+    """
+    # Each environment gets an equal share of the buffer.
+    max_length_time_axis = max_length // add_batch_size
+    stack_frames = num_stacked_frames > 1
+    assert max_length_time_axis >= num_stacked_frames, (
+        f"Cannot stack {num_stacked_frames} frames in a buffer that stores "
+        f"{max_length_time_axis} transitions per environment."
+    )
+
+    def _to_frame(obs: Any) -> Any:
+        """Keep only the newest frame of a stacked observation."""
+        if not stack_frames:
+            return obs
+        agent_view = obs.agent_view
+        if flatten_stacked_frames:
+            agent_view = agent_view.reshape(agent_view.shape[:-1] + (-1, num_stacked_frames))
+        return obs._replace(agent_view=agent_view[..., -1])
+
+    def _to_stack(frames: chex.Array) -> chex.Array:
+        """Stack a batch of frames of shape [batch, num_stacked_frames, ...] like the wrapper."""
+        stacked_frames = jnp.moveaxis(frames, 1, -1)
+        if flatten_stacked_frames:
+            stacked_frames = stacked_frames.reshape(stacked_frames.shape[:-2] + (-1,))
+        return stacked_frames
+
+    def _num_valid(state: CompactBufferState) -> chex.Array:
+        # Once the buffer is full, the oldest transitions of each environment cannot be stacked
+        # since the frames before them have been overwritten.
+        num_stored = max_length_time_axis - (num_stacked_frames - 1)
+        return jnp.where(state.is_full, num_stored, state.current_index)
+
+    def init(transition: Any) -> CompactBufferState:
+        def _expand(x: chex.Array, *lengths: int) -> chex.Array:
+            x = jnp.asarray(x)
+            return jnp.zeros((add_batch_size, *lengths) + x.shape, dtype=x.dtype)
+
+        experience = transition._replace(obs=_to_frame(transition.obs), next_obs=None)
+        next_obs = _to_frame(transition.next_obs)
+        return CompactBufferState(
+            experience=jax.tree_util.tree_map(
+                lambda x: _expand(x, max_length_time_axis), experience
+            ),
+            terminal_index=jnp.full((add_batch_size, max_length_time_axis), -1, dtype=jnp.int32),
+            terminal_obs=jax.tree_util.tree_map(lambda x: _expand(x, terminal_length), next_obs),
+            terminal_count=jnp.zeros((add_batch_size,), dtype=jnp.int32),
+            last_next_obs=jax.tree_util.tree_map(_expand, next_obs),
+            episode_step=jnp.zeros((add_batch_size, max_length_time_axis), dtype=jnp.int32),
+            next_episode_step=jnp.zeros((add_batch_size,), dtype=jnp.int32),
+            current_index=jnp.zeros((), dtype=jnp.int32),
+            is_full=jnp.zeros((), dtype=bool),
+        )
+
+    def add(state: CompactBufferState, batch: Any) -> CompactBufferState:
+        # Move to [add_batch_size, sequence_length, ...].
+        batch = jax.tree_util.tree_map(lambda x: jnp.swapaxes(x, 0, 1), batch)
+        batch = batch._replace(obs=_to_frame(batch.obs), next_obs=_to_frame(batch.next_obs))
+        sequence_length = batch.done.shape[1]
+        assert sequence_length <= max_length_time_axis, (
+            f"Cannot add sequences of length {sequence_length} to a buffer that stores "
+            f"{max_length_time_axis} transitions per environment."
+        )
+        assert sequence_length <= terminal_length, (
+            f"Cannot add sequences of length {sequence_length} with only {terminal_length} "
+            "terminal observations per environment."
+        )
+        env_ids = jnp.arange(add_batch_size)[:, None]
+
+        # Write the terminal observations of the episodes that ended.
+        done = batch.done.reshape(add_batch_size, sequence_length).astype(bool)
+        new_terminal_index = state.terminal_count[:, None] + jnp.cumsum(done, axis=1) - 1
+        terminal_index = jnp.where(done, new_terminal_index, -1)
+        # Out of range slots are dropped, so only terminal observations are written.
+        terminal_slots = jnp.where(done, new_terminal_index % terminal_length, terminal_length)
+        terminal_obs = jax.tree_util.tree_map(
+            lambda store, x: store.at[env_ids, terminal_slots].set(x, mode="drop"),
+            state.terminal_obs,
+            batch.next_obs,
+        )
+
+        # Count the steps since the start of the episode of each transition.
+        steps = jnp.arange(sequence_length)
+        starts = jnp.concatenate([jnp.zeros_like(done[:, :1]), done[:, :-1]], axis=1)
+        start_steps = jax.lax.cummax(jnp.where(starts, steps, -1), axis=1)
+        episode_step = jnp.where(
+            start_steps >= 0, steps - start_steps, state.next_episode_step[:, None] + steps
+        )
+        # Clipping keeps the counts bounded, only the most recent frames are ever stacked.
+        episode_step = jnp.minimum(episode_step, num_stacked_frames - 1)
+        next_episode_step = jnp.where(done[:, -1], 0, episode_step[:, -1] + 1)
+
+        # Write the transitions without their next observation.
+        time_ids = (state.current_index + jnp.arange(sequence_length)) % max_length_time_axis
+        experience = jax.tree_util.tree_map(
+            lambda store, x: store.at[:, time_ids].set(x),
+            state.experience,
+            batch._replace(next_obs=None),
+        )
+
+        new_index = state.current_index + sequence_length
+        return CompactBufferState(
+            experience=experience,
+            terminal_index=state.terminal_index.at[:, time_ids].set(terminal_index),
+            terminal_obs=terminal_obs,
+            terminal_count=state.terminal_count + done.sum(axis=1, dtype=jnp.int32),
+            last_next_obs=jax.tree_util.tree_map(lambda x: x[:, -1], batch.next_obs),
+            episode_step=state.episode_step.at[:, time_ids].set(episode_step),
+            next_episode_step=next_episode_step,
+            current_index=new_index % max_length_time_axis,
+            is_full=state.is_full | (new_index >= max_length_time_axis),
+        )
+
+    def sample(state: CompactBufferState, key: chex.PRNGKey) -> BufferSample:
+        env_key, time_key = jax.random.split(key)
+        env_ids = jax.random.randint(env_key, (sample_batch_size,), 0, add_batch_size)
+        oldest_index = jnp.where(state.is_full, state.current_index + num_stacked_frames - 1, 0)
+        offsets = jax.random.randint(time_key, (sample_batch_size,), 0, _num_valid(state))
+        time_ids = (oldest_index + offsets) % max_length_time_axis
+        if sort_indices:
+            order = jnp.argsort(env_ids * max_length_time_axis + time_ids)
+            env_ids, time_ids = env_ids[order], time_ids[order]
+
+        experience = jax.tree_util.tree_map(lambda x: x[env_ids, time_ids], state.experience)
+
+        # Rebuild the next observations.
+        following_obs = jax.tree_util.tree_map(
+            lambda x: x[env_ids, (time_ids + 1) % max_length_time_axis], state.experience.obs
+        )
+        terminal_index = state.terminal_index[env_ids, time_ids]
+        terminal_obs = jax.tree_util.tree_map(
+            lambda x: x[env_ids, terminal_index % terminal_length], state.terminal_obs
+        )
+        last_next_obs = jax.tree_util.tree_map(lambda x: x[env_ids], state.last_next_obs)
+        has_terminal_obs = (terminal_index >= 0) & (
+            state.terminal_count[env_ids] - terminal_index <= terminal_length
+        )
+        is_newest = time_ids == (state.current_index - 1) % max_length_time_axis
+        next_obs = jax.tree_util.tree_map(
+            lambda last, terminal, following: _select(
+                is_newest, last, _select(has_terminal_obs, terminal, following)
+            ),
+            last_next_obs,
+            terminal_obs,
+            following_obs,
+        )
+
+        if stack_frames:
+            # Gather the frames of each observation, oldest first, and zero the ones from
+            # before the start of its episode.
+            frames_back = jnp.arange(num_stacked_frames - 1, -1, -1)
+            frame_ids = (time_ids[:, None] - frames_back) % max_length_time_axis
+            frames = state.experience.obs.agent_view[env_ids[:, None], frame_ids]
+            episode_step = state.episode_step[env_ids, time_ids]
+            in_episode = frames_back <= episode_step[:, None]
+            frames = _select(in_episode, frames, jnp.zeros_like(frames))
+            # The next observation shifts in the frame that follows.
+            next_frames = jnp.concatenate([frames[:, 1:], next_obs.agent_view[:, None]], axis=1)
+            experience = experience._replace(
+                obs=experience.obs._replace(agent_view=_to_stack(frames))
+            )
+            next_obs = next_obs._replace(agent_view=_to_stack(next_frames))
+
+        return BufferSample(experience=experience._replace(next_obs=next_obs))
+
+    def can_sample(state: CompactBufferState) -> chex.Array:
+        return _num_valid(state) * add_batch_size >= min_length
+
+    return CompactItemBuffer(init=init, add=add, sample=sample, can_sample=can_sample)
+
+
+class HostBufferState(NamedTuple):
+    """Device side state of a buffer stored on the host.
+
+    The transitions themselves live in host memory or on disk. The number of added transitions,
+    which includes those of a buffer reopened from disk, is returned by the host when adding, and
+    passed back when sampling, so that a sample is always ordered after the adds that precede it.
+    """
+
+    num_added: chex.Array
+
+
+class HostBuffer(NamedTuple):
+    init: Callable[[Any], HostBufferState]
+    add: Callable[[HostBufferState, Any], HostBufferState]
+    sample: Callable[[HostBufferState, chex.PRNGKey], BufferSample]
+    can_sample: Callable[[HostBufferState], chex.Array]
+
+
+class _PrefetchingStorage(abc.ABC):
+    """Host storage with a background thread that gathers the next sample ahead of time."""
+
+    def __init__(self, seed: int):
+        self._rng = np.random.default_rng(seed)
+        # Guards the storage against samples being gathered while transitions are written.
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._prefetched: Optional[Future] = None
+
+    @property
+    @abc.abstractmethod
+    def num_stored(self) -> int:
+        """The number of transitions held by the storage."""
+
+    @abc.abstractmethod
+    def add(self, leaves: List[np.ndarray]) -> None:
+        pass
+
+    @abc.abstractmethod
+    def _gather(self) -> List[np.ndarray]:
+        pass
+
+    def sample(self) -> List[np.ndarray]:
+        # Serve the batch gathered in the background and start gathering the next one, so the
+        # learner only waits for the first sample. Prefetched batches may therefore miss the
+        # transitions added since they were gathered.
+        if self._prefetched is None:
+            batch = self._gather()
+        else:
+            batch = self._prefetched.result()
+        self._prefetched = self._executor.submit(self._gather)
+        return batch
+
+
+class _HostStorage(_PrefetchingStorage):
+    """Ring of transitions in host memory."""
+
+    def __init__(
+        self,
+        leaves: List[np.ndarray],
+        max_length: int,
+        sample_batch_size: int,
+        seed: int,
+        path: Optional[str] = None,
+        sort_indices: bool = False,
+    ):
+        super().__init__(seed)
+        self._max_length = max_length
+        self._sample_batch_size = sample_batch_size
+        self._sort_indices = sort_indices
+        if path is None:
+            self._storage = [np.zeros((max_length,) + x.shape, dtype=x.dtype) for x in leaves]
+        else:
+            os.makedirs(path, exist_ok=True)
+            self._storage = [
+                np.lib.format.open_memmap(
+                    os.path.join(path, f"leaf_{i}.npy"),
+                    mode="w+",
+                    dtype=x.dtype,
+                    shape=(max_length,) + x.shape,
+                )
+                for i, x in enumerate(leaves)
+            ]
+        self._current_index = 0
+        self._num_stored = 0
+
+    @property
+    def num_stored(self) -> int:
+        return self._num_stored
+
+    def add(self, leaves: List[np.ndarray]) -> None:
+        # Flatten the [num_rows, sequence_length] axes into items.
+        leaves = [x.reshape((-1,) + storage.shape[1:]) for x, storage in zip(leaves, self._storage)]
+        num_items = len(leaves[0])
+        assert num_items <= self._max_length, "Cannot add more items than the buffer holds."
+        indices = (self._current_index + np.arange(num_items)) % self._max_length
+        with self._lock:
+            for storage, x in zip(self._storage, leaves):
+                storage[indices] = x
+            self._current_index = (self._current_index + num_items) % self._max_length
+            self._num_stored = min(self._num_stored + num_items, self._max_length)
+
+    def _gather(self) -> List[np.ndarray]:
+        with self._lock:
+            indices = self._rng.integers(0, max(self._num_stored, 1), self._sample_batch_size)
+            if self._sort_indices:
+                indices.sort()
+            # Items are returned as sequences of length one.
+            return [storage[indices, None] for storage in self._storage]
+
+
+class _DiskStorage(_PrefetchingStorage):
+    """Rows of transitions stored on disk, memory-mapped in chunks of time steps.
+
+    The directory holds an `index.json` describing the leaves, the layout and where the next
+    write goes, and one `chunk_{k}/leaf_{i}.npy` file per leaf holding the time steps
+    `[k * chunk_size, (k + 1) * chunk_size)` of all rows. The memory maps are flushed and the
+    index is rewritten every `flush_interval` adds and when the process exits, so an existing
+    directory can be reopened to warm start a buffer. The index is only written after the data
+    it describes, so a crash loses at most the adds since the last flush.
+    """
+
+    def __init__(
+        self,
+        leaves: List[np.ndarray],
+        path: str,
+        num_rows: int,
+        max_length_time_axis: int,
+        chunk_size: int,
+        sample_batch_size: int,
+        sample_sequence_length: int,
+        period: int,
+        seed: int,
+        warm_start: bool,
+        flush_interval: int,
+    ):
+        super().__init__(seed)
+        self._path = path
+        self._num_rows = num_rows
+        self._max_length_time_axis = max_length_time_axis
+        self._chunk_size = min(chunk_size, max_length_time_axis)
+        self._sample_batch_size = sample_batch_size
+        self._sample_sequence_length = sample_sequence_length
+        self._period = period
+        self._flush_interval = flush_interval
+        self._num_unflushed_adds = 0
+        self._leaf_specs = [{"shape": list(x.shape), "dtype": x.dtype.str} for x in leaves]
+
+        index = None
+        if warm_start and os.path.exists(self._index_path):
+            with open(self._index_path) as f:
+                index = json.load(f)
+            layout = (index["leaves"], index["num_rows"], index["max_length_time_axis"])
+            if layout != (self._leaf_specs, num_rows, max_length_time_axis):
+                raise ValueError(
+                    f"The replay buffer stored in {path} does not match the transitions and "
+                    "buffer size of this experiment."
+                )
+            self._chunk_size = index["chunk_size"]
+        self._current_index = 0 if index is None else index["current_index"]
+        self._num_stored = 0 if index is None else index["num_stored"]
+
+        num_chunks = math.ceil(max_length_time_axis / self._chunk_size)
+        self._chunks = []
+        for k in range(num_chunks):
+            chunk_path = os.path.join(path, f"chunk_{k}")
+            os.makedirs(chunk_path, exist_ok=True)
+            chunk_length = min(self._chunk_size, max_length_time_axis - k * self._chunk_size)
+            self._chunks.append(
+                [
+                    # Reopened files are viewed with the leaf dtype, as numpy stores the
+                    # extension dtypes of JAX, e.g. bfloat16, as raw bytes.
+                    np.lib.format.open_memmap(
+                        os.path.join(chunk_path, f"leaf_{i}.npy"),
+                        mode="w+" if index is None else "r+",
+                        dtype=x.dtype,
+                        shape=(num_rows, chunk_length) + x.shape,
+                    ).view(x.dtype)
+                    for i, x in enumerate(leaves)
+                ]
+            )
+        if index is None:
+            self._write_index()
+        atexit.register(self.flush)
+
+    @property
+    def num_stored(self) -> int:
+        return self._num_stored * self._num_rows
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(self._path, "index.json")
+
+    def _write_index(self) -> None:
+        index = {
+            "leaves": self._leaf_specs,
+            "num_rows": self._num_rows,
+            "max_length_time_axis": self._max_length_time_axis,
+            "chunk_size": self._chunk_size,
+            "current_index": self._current_index,
+            "num_stored": self._num_stored,
+        }
+        # Replace the index atomically so an interrupted run leaves a readable buffer behind.
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path)
+
+    def flush(self) -> None:
+        """Write the stored transitions and then the index describing them to disk."""
+        with self._lock:
+            if self._num_unflushed_adds == 0:
+                return
+            for chunk in self._chunks:
+                for storage in chunk:
+                    storage.flush()
+            self._write_index()
+            self._num_unflushed_adds = 0
+
+    def add(self, leaves: List[np.ndarray]) -> None:
+        sequence_length = leaves[0].shape[1]
+        assert (
+            sequence_length <= self._max_length_time_axis
+        ), "Cannot add sequences longer than the buffer."
+        time_ids = (self._current_index + np.arange(sequence_length)) % self._max_length_time_axis
+        chunk_ids, offsets = np.divmod(time_ids, self._chunk_size)
+        with self._lock:
+            for k in np.unique(chunk_ids):
+                in_chunk = chunk_ids == k
+                for storage, x in zip(self._chunks[k], leaves):
+                    storage[:, offsets[in_chunk]] = x[:, in_chunk]
+            self._current_index = (
+                self._current_index + sequence_length
+            ) % self._max_length_time_axis
+            self._num_stored = min(self._num_stored + sequence_length, self._max_length_time_axis)
+            self._num_unflushed_adds += 1
+        if self._num_unflushed_adds >= self._flush_interval:
+            self.flush()
+
+    def _gather(self) -> List[np.ndarray]:
+        batch_size, sequence_length = self._sample_batch_size, self._sample_sequence_length
+        with self._lock:
+            # Sequences start at multiples of the period from the oldest time step and never
+            # cross the time step that is written next.
+            is_full = self._num_stored == self._max_length_time_axis
+            oldest_index = self._current_index if is_full else 0
+            num_starts = max((self._num_stored - sequence_length) // self._period + 1, 1)
+            rows = self._rng.integers(0, self._num_rows, batch_size)
+            starts = oldest_index + self._rng.integers(0, num_starts, batch_size) * self._period
+            time_ids = (starts[:, None] + np.arange(sequence_length)) % self._max_length_time_axis
+            chunk_ids, offsets = np.divmod(time_ids, self._chunk_size)
+
+            batch = [
+                np.empty((batch_size, sequence_length) + storage.shape[2:], dtype=storage.dtype)
+                for storage in self._chunks[0]
+            ]
+            # Bulk gather chunk by chunk, reading each chunk in storage order.
+            for k in np.unique(chunk_ids):
+                batch_ids, step_ids = np.nonzero(chunk_ids == k)
+                chunk_rows, chunk_offsets = rows[batch_ids], offsets[batch_ids, step_ids]
+                order = np.lexsort((chunk_offsets, chunk_rows))
+                batch_ids, step_ids = batch_ids[order], step_ids[order]
+                chunk_rows, chunk_offsets = chunk_rows[order], chunk_offsets[order]
+                for x, storage in zip(batch, self._chunks[k]):
+                    x[batch_ids, step_ids] = storage[chunk_rows, chunk_offsets]
+            return batch
+
+
+def _make_host_buffer(
+    make_storage: Callable[[int, List[np.ndarray]], _PrefetchingStorage],
+    max_length: int,
+    min_length: int,
+    sample_batch_size: int,
+    update_batch_size: int,
+    sample_sequence_length: Optional[int],
+) -> HostBuffer:
+    """Create the device side functions of a buffer whose storage lives on the host.
+
+    Each replica of the buffer, across the `device` (pmap) and `batch` (vmap over the update
+    batch) axes of the learner, has its own storage, created by `make_storage` from the
+    replica index and the leaves of the dummy transition. The storage receives data as
+    `[num_rows, sequence_length, ...]` and returns samples as
+    `[sample_batch_size, sample_sequence_length, ...]`. Without a `sample_sequence_length` the
+    buffer behaves like an item buffer: data is added time-major and all the added transitions
+    form a single row, and samples are single transitions.
+    """
+    storages: Dict[int, _PrefetchingStorage] = {}
+    # Set from the dummy transition when the buffer is initialised.
+    dummy_leaves: List[np.ndarray] = []
+    treedef: Any = None
+
+    def _get_storage(buffer_id: int) -> _PrefetchingStorage:
+        if buffer_id not in storages:
+            storages[buffer_id] = make_storage(buffer_id, dummy_leaves)
+        return storages[buffer_id]
+
+    def _buffer_id() -> chex.Array:
+        return jax.lax.axis_index("device") * update_batch_size + jax.lax.axis_index("batch")
+
+    def _host_add(buffer_id: np.ndarray, num_added: np.ndarray, *leaves: np.ndarray) -> np.ndarray:
+        leaves = [np.asarray(x) for x in leaves]
+        storage = _get_storage(int(buffer_id))
+        storage.add(leaves)
+        num_new = leaves[0].size // max(dummy_leaves[0].size, 1)
+        # A storage reopened from disk already holds the transitions of previous runs, which
+        # count as added so that they can be sampled right away.
+        return np.asarray(max(num_added + num_new, storage.num_stored), dtype=np.int32)
+
+    def _host_sample(buffer_id: np.ndarray, num_added: np.ndarray) -> List[np.ndarray]:
+        return _get_storage(int(buffer_id)).sample()
+
+    def init(transition: Any) -> HostBufferState:
+        nonlocal dummy_leaves, treedef
+        leaves, treedef = jax.tree_util.tree_flatten(transition)
+        dummy_leaves = [np.asarray(jnp.asarray(x)) for x in leaves]
+        return HostBufferState(num_added=jnp.zeros((), dtype=jnp.int32))
+
+    def add(state: HostBufferState, batch: Any) -> HostBufferState:
+        leaves = jax.tree_util.tree_leaves(batch)
+        if sample_sequence_length is None:
+            leaves = [x.reshape((1, -1) + x.shape[2:]) for x in leaves]
+        num_added = io_callback(
+            _host_add,
+            jax.ShapeDtypeStruct((), jnp.int32),
+            _buffer_id(),
+            state.num_added,
+            *leaves,
+        )
+        return HostBufferState(num_added=num_added)
+
+    def sample(state: HostBufferState, key: chex.PRNGKey) -> BufferSample:
+        sequence_length = sample_sequence_length or 1
+        leaves = io_callback(
+            _host_sample,
+            [
+                jax.ShapeDtypeStruct((sample_batch_size, sequence_length) + x.shape, x.dtype)
+                for x in dummy_leaves
+            ],
+            _buffer_id(),
+            state.num_added,
+        )
+        if sample_sequence_length is None:
+            leaves = [x[:, 0] for x in leaves]
+        return BufferSample(experience=jax.tree_util.tree_unflatten(treedef, leaves))
+
+    def can_sample(state: HostBufferState) -> chex.Array:
+        return jnp.minimum(state.num_added, max_length) >= min_length
+
+    return HostBuffer(init=init, add=add, sample=sample, can_sample=can_sample)
+
+
+def make_host_item_buffer(
+    max_length: int,
+    min_length: int,
+    sample_batch_size: int,
+    seed: int,
+    update_batch_size: int = 1,
+    path: Optional[str] = None,
+    sort_indices: bool = False,
+) -> HostBuffer:
+    """Create an item buffer whose transitions are stored in host memory.
+
+    This is a drop-in replacement for `fbx.make_item_buffer(..., add_batches=True,
+    add_sequences=True)` inside Anakin learners, whose replay buffer size is otherwise limited
+    by accelerator memory. Only the number of added transitions is kept on device, adding and
+    sampling go through `io_callback`s to the host. Samples are gathered by a background thread
+    while the learner trains on the previous batch.
+
+    Each replica of the buffer, across the `device` (pmap) and `batch` (vmap over the update
+    batch) axes of the learner, has its own storage. The functions must therefore be called
+    under these named axes.
+
+    Args:
+        max_length: Number of transitions stored by each replica of the buffer.
+        min_length: Minimum number of transitions that must be stored before sampling.
+        sample_batch_size: Number of transitions returned by `sample`.
+        seed: Seed of the host random number generators used for sampling. The keys passed to
+            `sample` are not used since samples are drawn ahead of time.
+        update_batch_size: Size of the `batch` axis the buffer is replicated over.
+        path: Optional directory in which the storage is memory-mapped instead of being kept
+            in RAM.
+        sort_indices: Whether the sampled transitions are gathered in storage order, which
+            improves memory locality for large samples. The samples are then ordered.
+    """
+
+    def make_storage(buffer_id: int, leaves: List[np.ndarray]) -> _PrefetchingStorage:
+        return _HostStorage(
+            leaves,
+            max_length,
+            sample_batch_size,
+            seed=seed + buffer_id,
+            path=None if path is None else os.path.join(path, f"buffer_{buffer_id}"),
+            sort_indices=sort_indices,
+        )
+
+    return _make_host_buffer(
+        make_storage, max_length, min_length, sample_batch_size, update_batch_size, None
+    )
+
+
+def make_disk_buffer(
+    path: str,
+    max_length: int,
+    min_length: int,
+    sample_batch_size: int,
+    seed: int,
+    update_batch_size: int = 1,
+    chunk_size: int = 65_536,
+    warm_start: bool = True,
+    flush_interval: int = 100,
+    add_batch_size: Optional[int] = None,
+    sample_sequence_length: Optional[int] = None,
+    period: int = 1,
+) -> HostBuffer:
+    """Create a replay buffer stored on disk, which can outgrow RAM and outlive a run.
+
+    Each replica of the buffer is kept in `path/buffer_{replica}` in the chunked, memory-mapped
+    format described by `_DiskStorage`. When `warm_start` is set and a replica's directory
+    already holds a buffer, it is reopened and training continues from its contents, e.g. to
+    reuse the replay of a previous run or to train offline from a collected dataset. Samples
+    are bulk gathered chunk by chunk and read ahead by a background thread.
+
+    Without `sample_sequence_length` the buffer is a drop-in replacement for
+    `fbx.make_item_buffer(..., add_batches=True, add_sequences=True)`. With it, it replaces
+    `fbx.make_trajectory_buffer` and samples sequences of that length, starting every `period`
+    time steps, from the `add_batch_size` rows that the data is added to.
+
+    Args:
+        path: Directory holding the buffer replicas.
+        max_length: Number of transitions stored by each replica of the buffer.
+        min_length: Minimum number of transitions that must be stored before sampling.
+        sample_batch_size: Number of transitions or sequences returned by `sample`.
+        seed: Seed of the host random number generators used for sampling.
+        update_batch_size: Size of the `batch` axis the buffer is replicated over.
+        chunk_size: Number of time steps per file.
+        warm_start: Whether to reopen the buffers already stored in `path`.
+        flush_interval: Number of adds between writes of each replica to disk.
+        add_batch_size: Number of rows that sequences are added to.
+        sample_sequence_length: Length of the sampled sequences.
+        period: Number of time steps between the starts of sampled sequences.
+    """
+    if sample_sequence_length is None:
+        num_rows, sequence_length = 1, 1
+    else:
+        assert add_batch_size is not None, "Sequences are added to add_batch_size rows."
+        num_rows, sequence_length = add_batch_size, sample_sequence_length
+
+    def make_storage(buffer_id: int, leaves: List[np.ndarray]) -> _PrefetchingStorage:
+        return _DiskStorage(
+            leaves,
+            os.path.join(path, f"buffer_{buffer_id}"),
+            num_rows=num_rows,
+            max_length_time_axis=max_length // num_rows,
+            chunk_size=chunk_size,
+            sample_batch_size=sample_batch_size,
+            sample_sequence_length=sequence_length,
+            period=period,
+            seed=seed + buffer_id,
+            warm_start=warm_start,
+            flush_interval=flush_interval,
+        )
+
+    return _make_host_buffer(
+        make_storage,
+        max_length,
+        min_length,
+        sample_batch_size,
+        update_batch_size,
+        sample_sequence_length,
+    )
+
+
+# Priorities are kept above this value so that every stored sequence can still be sampled.
+_MIN_PRIORITY = 1e-6
+
+
+class PrioritisedBufferState(NamedTuple):
+    # Stored transitions, with shape [num_rows, max_length_time_axis, ...].
+    experience: chex.ArrayTree
+    # Array-backed sum-tree over the priorities of the sequences starting at each slot. The root
+    # is at index 1 and node i has children 2i and 2i + 1, so the leaves start at index
+    # `len(sum_tree) // 2` and are followed by zero padding up to a power of two.
+    sum_tree: chex.Array
+    max_priority: chex.Array
+    # Number of priority updates, which drives the annealing of the importance weights.
+    num_updates: chex.Array
+    current_index: chex.Array
+    is_full: chex.Array
+
+
+class PrioritisedBufferSample(NamedTuple):
+    experience: chex.ArrayTree
+    indices: chex.Array
+    probabilities: chex.Array
+
+
+class PrioritisedBuffer(NamedTuple):
+    init: Callable[[Any], PrioritisedBufferState]
+    add: Callable[[PrioritisedBufferState, Any], PrioritisedBufferState]
+    sample: Callable[[PrioritisedBufferState, chex.PRNGKey], PrioritisedBufferSample]
+    can_sample: Callable[[PrioritisedBufferState], chex.Array]
+    set_priorities: Callable[
+        [PrioritisedBufferState, chex.Array, chex.Array], PrioritisedBufferState
+    ]
+
+
+def _sum_tree_set(sum_tree: chex.Array, leaf_ids: chex.Array, values: chex.Array) -> chex.Array:
+    """Set a batch of leaves and recompute their ancestors, one level of the tree at a time."""
+    capacity = sum_tree.shape[0] // 2
+    nodes = leaf_ids + capacity
+    sum_tree = sum_tree.at[nodes].set(values)
+    for _ in range(capacity.bit_length() - 1):
+        nodes = nodes // 2
+        sum_tree = sum_tree.at[nodes].set(sum_tree[2 * nodes] + sum_tree[2 * nodes + 1])
+    return sum_tree
+
+
+def _sum_tree_sample(sum_tree: chex.Array, key: chex.PRNGKey, batch_size: int) -> chex.Array:
+    """Sample a batch of leaves proportionally to their values by descending the tree."""
+    capacity = sum_tree.shape[0] // 2
+    # Stratified sampling, with one target in each of batch_size equal slices of the total.
+    targets = (jnp.arange(batch_size) + jax.random.uniform(key, (batch_size,))) / batch_size
+    targets = targets * sum_tree[1]
+    nodes = jnp.ones((batch_size,), dtype=jnp.int32)
+    for _ in range(capacity.bit_length() - 1):
+        left = sum_tree[2 * nodes]
+        # Rounding errors must not lead to an empty right subtree.
+        go_left = (targets < left) | (sum_tree[2 * nodes + 1] <= 0)
+        nodes = jnp.where(go_left, 2 * nodes, 2 * nodes + 1)
+        targets = jnp.where(go_left, targets, targets - left)
+    return nodes - capacity
+
+
+def make_prioritised_buffer(
+    max_length: int,
+    min_length: int,
+    sample_batch_size: int,
+    priority_exponent: float,
+    add_batch_size: Optional[int] = None,
+    sample_sequence_length: Optional[int] = None,
+    period: int = 1,
+) -> PrioritisedBuffer:
+    """Create a prioritised replay buffer backed by an array sum-tree.
+
+    Sampling and `set_priorities` are batched and take O(log N) steps each. Sequences are
+    sampled proportionally to `priority ** priority_exponent`, and newly added sequences get the
+    largest priority seen so far.
+
+    Without `sample_sequence_length` the buffer is a drop-in replacement for
+    `fbx.make_item_buffer(..., add_batches=True, add_sequences=True)`, with data added
+    time-major. With it, it replaces `fbx.make_prioritised_trajectory_buffer` and samples
+    sequences of that length, starting every `period` time steps, from the `add_batch_size`
+    rows that the data is added to.
+
+    Args:
+        max_length: Total number of transitions stored.
+        min_length: Minimum number of transitions that must be stored before sampling.
+        sample_batch_size: Number of transitions or sequences returned by `sample`.
+        priority_exponent: Exponent applied to the priorities, 0 gives uniform sampling.
+        add_batch_size: Number of rows that sequences are added to.
+        sample_sequence_length: Length of the sampled sequences.
+        period: Number of time steps between the starts of sampled sequences.
+    """
+    item_mode = sample_sequence_length is None
+    if item_mode:
+        num_rows, sequence_length = 1, 1
+    else:
+        assert add_batch_size is not None, "Sequences are added to add_batch_size rows."
+        num_rows, sequence_length = add_batch_size, sample_sequence_length
+    max_length_time_axis = max_length // num_rows
+    num_slots = num_rows * max_length_time_axis
+    tree_capacity = 1 << max(num_slots - 1, 1).bit_length()
+
+    def init(transition: Any) -> PrioritisedBufferState:
+        return PrioritisedBufferState(
+            experience=jax.tree_util.tree_map(
+                lambda x: jnp.zeros(
+                    (num_rows, max_length_time_axis) + jnp.shape(x), dtype=jnp.asarray(x).dtype
+                ),
+                transition,
+            ),
+            sum_tree=jnp.zeros((2 * tree_capacity,), dtype=jnp.float32),
+            max_priority=jnp.ones((), dtype=jnp.float32),
+            num_updates=jnp.zeros((), dtype=jnp.int32),
+            current_index=jnp.zeros((), dtype=jnp.int32),
+            is_full=jnp.zeros((), dtype=bool),
+        )
+
+    def add(state: PrioritisedBufferState, batch: Any) -> PrioritisedBufferState:
+        if item_mode:
+            batch = jax.tree_util.tree_map(lambda x: x.reshape((1, -1) + x.shape[2:]), batch)
+        num_steps = jax.tree_util.tree_leaves(batch)[0].shape[1]
+        assert num_steps + sequence_length - 1 <= max_length_time_axis, (
+            f"Cannot add sequences of length {num_steps} to a buffer that stores "
+            f"{max_length_time_axis} time steps per row."
+        )
+        time_ids = (state.current_index + jnp.arange(num_steps)) % max_length_time_axis
+        experience = jax.tree_util.tree_map(
+            lambda store, x: store.at[:, time_ids].set(x), state.experience, batch
+        )
+        new_index = state.current_index + num_steps
+
+        # The sequences starting in [current_index - sequence_length + 1, new_index) contain
+        # added steps. Those that end before new_index can now be sampled, the others would
+        # cross from the newest to the oldest data and cannot.
+        starts = (
+            state.current_index - sequence_length + 1 + jnp.arange(num_steps + sequence_length - 1)
+        )
+        start_ids = starts % max_length_time_axis
+        is_valid = (
+            (starts + sequence_length <= new_index)
+            & (start_ids % period == 0)
+            & ((starts >= 0) | state.is_full)
+        )
+        priority = state.max_priority**priority_exponent
+        leaf_ids = jnp.arange(num_rows)[:, None] * max_length_time_axis + start_ids
+        values = jnp.broadcast_to(jnp.where(is_valid, priority, 0.0), leaf_ids.shape)
+
+        return state._replace(
+            experience=experience,
+            sum_tree=_sum_tree_set(state.sum_tree, leaf_ids.reshape(-1), values.reshape(-1)),
+            current_index=new_index % max_length_time_axis,
+            is_full=state.is_full | (new_index >= max_length_time_axis),
+        )
+
+    def sample(state: PrioritisedBufferState, key: chex.PRNGKey) -> PrioritisedBufferSample:
+        leaf_ids = _sum_tree_sample(state.sum_tree, key, sample_batch_size)
+        leaf_ids = jnp.minimum(leaf_ids, num_slots - 1)
+        rows, starts = jnp.divmod(leaf_ids, max_length_time_axis)
+        time_ids = (starts[:, None] + jnp.arange(sequence_length)) % max_length_time_axis
+        experience = jax.tree_util.tree_map(lambda x: x[rows[:, None], time_ids], state.experience)
+        if item_mode:
+            experience = jax.tree_util.tree_map(lambda x: x[:, 0], experience)
+        probabilities = state.sum_tree[tree_capacity + leaf_ids] / state.sum_tree[1]
+        return PrioritisedBufferSample(
+            experience=experience, indices=leaf_ids, probabilities=probabilities
+        )
+
+    def can_sample(state: PrioritisedBufferState) -> chex.Array:
+        num_stored = jnp.where(state.is_full, max_length_time_axis, state.current_index)
+        return (num_stored * num_rows >= min_length) & (state.sum_tree[1] > 0)
+
+    def set_priorities(
+        state: PrioritisedBufferState, indices: chex.Array, priorities: chex.Array
+    ) -> PrioritisedBufferState:
+        priorities = jnp.maximum(priorities.astype(jnp.float32), _MIN_PRIORITY)
+        return state._replace(
+            sum_tree=_sum_tree_set(state.sum_tree, indices, priorities**priority_exponent),
+            max_priority=jnp.maximum(state.max_priority, jnp.max(priorities)),
+            num_updates=state.num_updates + 1,
+        )
+
+    return PrioritisedBuffer(
+        init=init, add=add, sample=sample, can_sample=can_sample, set_priorities=set_priorities
+    )
+
+
+def make_priority_fns(
+    buffer: Any, config: DictConfig
+) -> Tuple[Callable[[Any, Any], chex.Array], Callable[[Any, Any, chex.Array], Any]]:
+    """Get the functions that weight the losses of a sample and update its priorities.
+
+    With a prioritised buffer, the importance sampling exponent is annealed linearly from
+    `config.system.importance_sampling_exponent` to 1 over training. With any other buffer the
+    weights are all ones and priorities are ignored, so the same update step works with both.
+
+    Returns:
+        A function of the buffer state and a sample returning the importance weights of the
+        sample, and a function of the buffer state, a sample and its new priorities returning
+        the updated buffer state.
+    """
+    if not isinstance(buffer, PrioritisedBuffer):
+
+        def uniform_weights_fn(state: Any, sample: Any) -> chex.Array:
+            return jnp.ones((config.system.batch_size,), dtype=jnp.float32)
+
+        def ignore_priorities_fn(state: Any, sample: Any, priorities: chex.Array) -> Any:
+            return state
+
+        return uniform_weights_fn, ignore_priorities_fn
+
+    importance_sampling_exponent_fn = optax.linear_schedule(
+        init_value=config.system.importance_sampling_exponent,
+        end_value=1.0,
+        transition_steps=int(config.arch.num_updates * config.system.updates_per_rollout),
+    )
+
+    def importance_weights_fn(
+        state: PrioritisedBufferState, sample: PrioritisedBufferSample
+    ) -> chex.Array:
+        exponent = importance_sampling_exponent_fn(state.num_updates)
+        weights = (1.0 / sample.probabilities) ** exponent
+        return (weights / jnp.max(weights)).astype(jnp.float32)
+
+    def set_priorities_fn(
+        state: PrioritisedBufferState, sample: PrioritisedBufferSample, priorities: chex.Array
+    ) -> PrioritisedBufferState:
+        return buffer.set_priorities(state, sample.indices, priorities)
+
+    return importance_weights_fn, set_priorities_fn
+
+
+def _get_sample_batch_size(config: DictConfig) -> int:
+    """Number of transitions or sequences sampled at once, see `make_epoch_sample_fns`."""
+    if config.system.get("fused_sampling", False):
+        return config.system.batch_size * config.system.epochs
+    return config.system.batch_size
+
+
+def make_epoch_sample_fns(
+    buffer: Any, config: DictConfig
+) -> Tuple[
+    Callable[[Any, chex.PRNGKey], Tuple[chex.PRNGKey, Any]],
+    Callable[[Any, chex.PRNGKey, Any], Any],
+]:
+    """Get the functions that sample the batches of the epochs following a rollout.
+
+    Without `config.system.fused_sampling`, each epoch samples its batch from the buffer. With
+    it, the buffer samples the batches of all the epochs in a single gather before the epochs,
+    which are then interleaved into one batch per epoch. Priorities updated by an epoch
+    therefore only affect the samples of the following rollouts.
+
+    Returns:
+        A function of the buffer state and a key returning the new key and the batches of all
+        the epochs stacked, or None without fused sampling, to be scanned over by the epochs. And
+        a function of the buffer state, a key and the batch of an epoch returning its sample.
+    """
+    if not config.system.get("fused_sampling", False):
+
+        def no_presample_fn(state: Any, key: chex.PRNGKey) -> Tuple[chex.PRNGKey, None]:
+            return key, None
+
+        def sample_fn(state: Any, key: chex.PRNGKey, epoch_sample: None) -> Any:
+            return buffer.sample(state, key)
+
+        return no_presample_fn, sample_fn
+
+    epochs, batch_size = config.system.epochs, config.system.batch_size
+    # Samples can be ordered, e.g. when sorted for locality or by the stratified sampling of
+    # prioritised buffers, so each epoch takes every `epochs`-th sample rather than a slice.
+    # Gathering in this order is cheaper than transposing the samples.
+    interleaved = np.arange(epochs * batch_size).reshape(batch_size, epochs).T.ravel()
+
+    def presample_fn(state: Any, key: chex.PRNGKey) -> Tuple[chex.PRNGKey, Any]:
+        key, sample_key = jax.random.split(key)
+        sample = buffer.sample(state, sample_key)
+        return key, jax.tree_util.tree_map(
+            lambda x: x[interleaved].reshape((epochs, batch_size) + x.shape[1:]), sample
+        )
+
+    def presampled_fn(state: Any, key: chex.PRNGKey, epoch_sample: Any) -> Any:
+        return epoch_sample
+
+    return presample_fn, presampled_fn
+
+
+def _replace(x: Any, **changes: Any) -> Any:
+    """Replace fields of a NamedTuple or of a chex dataclass, as used by flashbax."""
+    return x._replace(**changes) if hasattr(x, "_replace") else x.replace(**changes)
+
+
+def _with_sharding(buffer: Any, config: DictConfig) -> Any:
+    """Wrap the replicas of a replay buffer so that they form one buffer sharded across them.
+
+    Each replica, across the `device` (pmap) and `batch` (vmap over the update batch) axes of
+    the learner, still stores the transitions of its own environments. Its samples are however
+    split into one block per replica and the blocks are exchanged with all-to-all collectives,
+    so that every replica trains on a sample drawn uniformly from the experience of all of
+    them. Since the replicas are filled at the same rate, the importance weights of prioritised
+    samples are unchanged, and new priorities are sent back to the replicas that store them.
+    The functions must therefore be called under these named axes.
+    """
+    num_devices, update_batch_size = config.num_devices, config.arch.update_batch_size
+    assert config.system.batch_size % (num_devices * update_batch_size) == 0, (
+        f"{Fore.RED}{Style.BRIGHT}The batch size of each replica ({config.system.batch_size}) "
+        "should be divisible by n_devices*update_batch_size for sharded replay."
+        f"{Style.RESET_ALL}"
+    )
+
+    def exchange(tree: Any) -> Any:
+        """Swap the blocks of a batch between the replicas, this is its own inverse."""
+
+        # Samples can be ordered, e.g. when sorted for locality or by the stratified sampling of
+        # prioritised buffers, so each replica receives every n-th sample rather than a slice.
+        def exchange_leaf(x: chex.Array) -> chex.Array:
+            blocks = x.reshape((-1, num_devices, update_batch_size) + x.shape[1:])
+            blocks = jax.lax.all_to_all(blocks, "device", split_axis=1, concat_axis=1)
+            blocks = jax.lax.all_to_all(blocks, "batch", split_axis=2, concat_axis=2)
+            return blocks.reshape(x.shape)
+
+        return jax.tree_util.tree_map(exchange_leaf, tree)
+
+    def sample(state: Any, key: chex.PRNGKey) -> Any:
+        return exchange(buffer.sample(state, key))
+
+    if not isinstance(buffer, PrioritisedBuffer):
+        return _replace(buffer, sample=sample)
+
+    def set_priorities(
+        state: PrioritisedBufferState, indices: chex.Array, priorities: chex.Array
+    ) -> PrioritisedBufferState:
+        return buffer.set_priorities(state, *exchange((indices, priorities)))
+
+    return _replace(buffer, sample=sample, set_priorities=set_priorities)
+
+
+def _with_codec(buffer: Any, codec: ReplayCodec, observation_spec: specs.Spec) -> Any:
+    """Wrap a replay buffer so that it stores encoded transitions and decodes its samples.
+
+    Samples are decoded in the jitted learner right before the loss, so only the sampled batch
+    ever exists at full precision.
+    """
+    # Reported when the buffer is made rather than in init, which is traced for every replica.
+    observation = observation_spec.generate_value()
+    print(
+        f"{Fore.YELLOW}{Style.BRIGHT}Replay buffer stores {get_nbytes(codec.encode(observation))} "
+        f"bytes per observation ({get_nbytes(observation)} bytes unencoded).{Style.RESET_ALL}"
+    )
+
+    def init(transition: Any) -> Any:
+        return buffer.init(codec.encode(transition))
+
+    def add(state: Any, batch: Any) -> Any:
+        return buffer.add(state, codec.encode(batch))
+
+    def sample(state: Any, key: chex.PRNGKey) -> Any:
+        sample = buffer.sample(state, key)
+        return _replace(sample, experience=codec.decode(sample.experience))
+
+    return _replace(buffer, init=init, add=add, sample=sample)
+
+
+def make_item_buffer(
+    config: DictConfig, observation_spec: specs.Spec
+) -> Union[TrajectoryBuffer, CompactItemBuffer, HostBuffer, PrioritisedBuffer]:
+    """Create the item replay buffer selected by `config.system.replay_storage`.
+
+    `"item"` uses the flashbax item buffer, which stores `obs` and `next_obs` for every
+    transition. `"compact"` stores each observation once and `"stacked_frames"` additionally
+    stores a single frame per observation when the environment is wrapped by the
+    `FrameStackingWrapper`, see `make_compact_item_buffer`. `"host"` keeps the transitions in
+    host memory, see `make_host_item_buffer`, and `"disk"` on disk, see `make_disk_buffer`.
+    `"prioritised"` samples transitions proportionally to their priorities, see
+    `make_prioritised_buffer` and `make_priority_fns`.
+
+    Observations are encoded with the codec selected by `config.system.replay_codec`, see
+    `make_replay_codec`. With `config.system.fused_sampling`, the transitions of all the epochs
+    following a rollout are sampled at once, see `make_epoch_sample_fns`. With
+    `config.system.sharded_replay`, they are sampled from the buffers of all the learner
+    replicas, see `_with_sharding`.
+    """
+    sample_batch_size = _get_sample_batch_size(config)
+    if config.system.replay_storage in ("compact", "stacked_frames"):
+        num_stacked_frames, flatten_stacked_frames = 1, True
+        if config.system.replay_storage == "stacked_frames":
+            wrapper = config.env.get("wrapper")
+            assert wrapper is not None and wrapper._target_.endswith("FrameStackingWrapper"), (
+                "Stacked frames replay storage requires the environment to be wrapped by "
+                "the FrameStackingWrapper."
+            )
+            num_stacked_frames = wrapper.get("num_frames", 4)
+            flatten_stacked_frames = wrapper.get("flatten", True)
+        max_length_time_axis = config.system.buffer_size // config.arch.num_envs
+        terminal_length = max(
+            math.ceil(max_length_time_axis * config.system.terminal_obs_fraction),
+            config.system.rollout_length,
+            config.system.warmup_steps,
+        )
+        buffer = make_compact_item_buffer(
+            max_length=config.system.buffer_size,
+            min_length=config.system.batch_size,
+            sample_batch_size=sample_batch_size,
+            add_batch_size=config.arch.num_envs,
+            terminal_length=terminal_length,
+            num_stacked_frames=num_stacked_frames,
+            flatten_stacked_frames=flatten_stacked_frames,
+            sort_indices=config.system.sort_sampled_indices,
+        )
+    elif config.system.replay_storage == "host":
+        buffer = make_host_item_buffer(
+            max_length=config.system.buffer_size,
+            min_length=config.system.batch_size,
+            sample_batch_size=sample_batch_size,
+            seed=config.arch.seed,
+            update_batch_size=config.arch.update_batch_size,
+            path=config.system.host_buffer_dir,
+            sort_indices=config.system.sort_sampled_indices,
+        )
+    elif config.system.replay_storage == "disk":
+        buffer = make_disk_buffer(
+            path=config.system.disk_buffer.dir,
+            max_length=config.system.buffer_size,
+            min_length=config.system.batch_size,
+            sample_batch_size=sample_batch_size,
+            seed=config.arch.seed,
+            update_batch_size=config.arch.update_batch_size,
+            chunk_size=config.system.disk_buffer.chunk_size,
+            warm_start=config.system.disk_buffer.warm_start,
+            flush_interval=config.system.disk_buffer.flush_interval,
+        )
+    elif config.system.replay_storage == "prioritised":
+        buffer = make_prioritised_buffer(
+            max_length=config.system.buffer_size,
+            min_length=config.system.batch_size,
+            sample_batch_size=sample_batch_size,
+            priority_exponent=config.system.priority_exponent,
+        )
+    elif config.system.replay_storage == "item":
+        buffer = fbx.make_item_buffer(
+            max_length=config.system.buffer_size,
+            min_length=config.system.batch_size,
+            sample_batch_size=sample_batch_size,
+            add_batches=True,
+            add_sequences=True,
+        )
+    else:
+        raise ValueError(f"Unknown replay storage: {config.system.replay_storage}")
+    if config.system.sharded_replay:
+        buffer = _with_sharding(buffer, config)
+    codec = make_replay_codec(config.system.replay_codec, observation_spec)
+    return _with_codec(buffer, codec, observation_spec)
+
+
+def make_trajectory_buffer(
+    config: DictConfig, observation_spec: specs.Spec, sample_sequence_length: int, period: int
+) -> Union[TrajectoryBuffer, HostBuffer, PrioritisedBuffer]:
+    """Create the trajectory replay buffer selected by `config.system.replay_storage`.
+
+    `"trajectory"` uses the flashbax trajectory buffer, `"disk"` stores the trajectories on
+    disk, see `make_disk_buffer`, and `"prioritised"` samples sequences proportionally to their
+    priorities, see `make_prioritised_buffer`. Sequences of `sample_sequence_length` steps are
+    sampled, starting every `period` steps. Observations are encoded with the codec selected by
+    `config.system.replay_codec`, see `make_replay_codec`. With `config.system.fused_sampling`,
+    the sequences of all the epochs following a rollout are sampled at once, see
+    `make_epoch_sample_fns`. With `config.system.sharded_replay`, they are sampled from the
+    buffers of all the learner replicas, see `_with_sharding`.
+    """
+    sample_batch_size = _get_sample_batch_size(config)
+    if config.system.replay_storage == "disk":
+        buffer = make_disk_buffer(
+            path=config.system.disk_buffer.dir,
+            max_length=config.system.buffer_size,
+            min_length=sample_sequence_length * config.arch.num_envs,
+            sample_batch_size=sample_batch_size,
+            seed=config.arch.seed,
+            update_batch_size=config.arch.update_batch_size,
+            chunk_size=config.system.disk_buffer.chunk_size,
+            warm_start=config.system.disk_buffer.warm_start,
+            flush_interval=config.system.disk_buffer.flush_interval,
+            add_batch_size=config.arch.num_envs,
+            sample_sequence_length=sample_sequence_length,
+            period=period,
+        )
+    elif config.system.replay_storage == "prioritised":
+        buffer = make_prioritised_buffer(
+            max_length=config.system.buffer_size,
+            min_length=sample_sequence_length * config.arch.num_envs,
+            sample_batch_size=sample_batch_size,
+            priority_exponent=config.system.priority_exponent,
+            add_batch_size=config.arch.num_envs,
+            sample_sequence_length=sample_sequence_length,
+            period=period,
+        )
+    elif config.system.replay_storage == "trajectory":
+        buffer = fbx.make_trajectory_buffer(
+            max_size=config.system.buffer_size,
+            min_length_time_axis=sample_sequence_length,
+            sample_batch_size=sample_batch_size,
+            sample_sequence_length=sample_sequence_length,
+            period=period,
+            add_batch_size=config.arch.num_envs,
+        )
+    else:
+        raise ValueError(f"Unknown replay storage: {config.system.replay_storage}")
+    if config.system.sharded_replay:
+        buffer = _with_sharding(buffer, config)
+    codec = make_replay_codec(config.system.replay_codec, observation_spec)
+    return _with_codec(buffer, codec, observation_spec)
@@ -0,0 +1,100 @@
+from typing import Any, Callable, NamedTuple, Optional
+
+import chex
+import jax
+import jax.numpy as jnp
+import numpy as np
+from jumanji import specs
+
+from stoix.base_types import Observation, ObservationGlobalState
+
+
+class ReplayCodec(NamedTuple):
+    """Encodes the observations of transitions before they are stored in a replay buffer.
+
+    `encode` is applied to the transitions added to the buffer and `decode` to the sampled
+    ones, both act on the `agent_view` of every observation in the transition.
+    """
+
+    encode: Callable[[chex.ArrayTree], chex.ArrayTree]
+    decode: Callable[[chex.ArrayTree], chex.ArrayTree]
+
+
+def _is_observation(x: Any) -> bool:
+    return isinstance(x, (Observation, ObservationGlobalState))
+
+
+def _map_agent_views(fn: Callable[[chex.Array], chex.Array], tree: chex.ArrayTree) -> Any:
+    """Apply `fn` to the agent views of all observations in tree."""
+
+    def map_observation(x: Any) -> Any:
+        return x._replace(agent_view=fn(x.agent_view)) if _is_observation(x) else x
+
+    return jax.tree_util.tree_map(map_observation, tree, is_leaf=_is_observation)
+
+
+def make_replay_codec(name: Optional[str], observation_spec: specs.Spec) -> ReplayCodec:
+    """Create the codec used to store observations in a replay buffer.
+
+    Only floating point agent views are encoded and they are decoded to float32, the other
+    observation fields and agent views with other dtypes are stored as they are.
+
+    Args:
+        name: None stores observations as they are. `"uint8"` stores pixel values in [0, 255]
+            as bytes, `"bfloat16"` stores observations at half precision and `"affine"`
+            quantises each feature to a byte between the bounds of the observation spec.
+        observation_spec: Spec of the environment's observations.
+    """
+    agent_view_spec = observation_spec.agent_view
+    if name is None or not np.issubdtype(np.dtype(agent_view_spec.dtype), np.floating):
+        return ReplayCodec(encode=lambda x: x, decode=lambda x: x)
+
+    if name == "uint8":
+
+        def encode(x: chex.Array) -> chex.Array:
+            return jnp.clip(jnp.round(x), 0, 255).astype(jnp.uint8)
+
+        def decode(x: chex.Array) -> chex.Array:
+            return x.astype(jnp.float32)
+
+    elif name == "bfloat16":
+
+        def encode(x: chex.Array) -> chex.Array:
+            return x.astype(jnp.bfloat16)
+
+        def decode(x: chex.Array) -> chex.Array:
+            return x.astype(jnp.float32)
+
+    elif name == "affine":
+        if not isinstance(agent_view_spec, specs.BoundedArray) or not (
+            np.all(np.isfinite(agent_view_spec.minimum))
+            and np.all(np.isfinite(agent_view_spec.maximum))
+        ):
+            raise ValueError(
+                "Affine replay codec requires an agent view spec with finite bounds, "
+                f"got {agent_view_spec}."
+            )
+        shape = agent_view_spec.shape
+        minimum = np.broadcast_to(np.asarray(agent_view_spec.minimum, np.float32), shape)
+        maximum = np.broadcast_to(np.asarray(agent_view_spec.maximum, np.float32), shape)
+        # One quantisation step per feature, constant features are stored as their minimum.
+        scale = np.where(maximum > minimum, (maximum - minimum) / 255.0, 1.0)
+
+        def encode(x: chex.Array) -> chex.Array:
+            return jnp.clip(jnp.round((x - minimum) / scale), 0, 255).astype(jnp.uint8)
+
+        def decode(x: chex.Array) -> chex.Array:
+            return (x * scale + minimum).astype(jnp.float32)
+
+    else:
+        raise ValueError(f"Unknown replay codec: {name}")
+
+    return ReplayCodec(
+        encode=lambda tree: _map_agent_views(encode, tree),
+        decode=lambda tree: _map_agent_views(decode, tree),
+    )
+
+
+def get_nbytes(tree: chex.ArrayTree) -> int:
+    """Number of bytes taken by the arrays of a pytree."""
+    return sum(jnp.asarray(x).nbytes for x in jax.tree_util.tree_leaves(tree))
@@ -1,15 +1,33 @@
 import queue
 import threading
 import time
+import warnings
+from collections import defaultdict, deque
 from functools import partial
-from typing import Any, Dict, List, Sequence, Tuple, Union
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple, Union
 
+import chex
 import jax
 import jax.numpy as jnp
+import numpy as np
 from colorama import Fore, Style
+from flax.jax_utils import unreplicate
 from jumanji.types import TimeStep
+from omegaconf import DictConfig
 
-from stoix.base_types import Parameters, StoixTransition
+from stoix.base_types import (
+    ActFn,
+    CoreLearnerState,
+    Parameters,
+    SebulbaEvalFn,
+    SebulbaLearnerFn,
+    StoixTransition,
+)
+from stoix.utils.checkpointing import Checkpointer
+from stoix.utils.env_factory import EnvFactory
+from stoix.utils.jax_utils import unreplicate_local
+from stoix.utils.logger import LogEvent, StoixLogger
+from stoix.wrappers.episode_metrics import get_final_step_metrics
 
 
 # Copied from https://github.com/instadeepai/sebulba/blob/main/sebulba/core.py
@@ -31,26 +49,49 @@ class OnPolicyPipeline(threading.Thread):
     The `Pipeline` shards trajectories into `learner_devices`,
     ensuring trajectories are consumed in the right order to avoid being off-policy
     and limit the max number of samples in device memory at one time to avoid OOM issues.
+
+    By default, stacking and sharding are serialised across actors with a ticketed handshake.
+    With `parallel_put=True`, every actor stacks and shards its own trajectory concurrently.
+    Actors first acquire one of `max_size` slots, which bounds the number of trajectories in
+    device memory, and are then given a sequence number. Sharded trajectories are published
+    to the learner strictly in sequence order, so the consumption order is the same as with
+    the serial handshake.
     """
 
-    def __init__(self, max_size: int, learner_devices: List[jax.Device], lifetime: ThreadLifetime):
+    def __init__(
+        self,
+        max_size: int,
+        learner_devices: List[jax.Device],
+        lifetime: ThreadLifetime,
+        parallel_put: bool = False,
+    ):
         """
         Initializes the pipeline with a maximum size and the devices to shard trajectories across.
 
         Args:
             max_size: The maximum number of trajectories to keep in the pipeline.
             learner_devices: The devices to shard trajectories across.
+            lifetime: The lifetime used to signal the pipeline to stop.
+            parallel_put: Whether actors stack and shard their trajectories concurrently.
         """
         super().__init__(name="Pipeline")
         self.learner_devices = learner_devices
         self.tickets_queue: queue.Queue = queue.Queue()
         self._queue: queue.Queue = queue.Queue(maxsize=max_size)
         self.lifetime = lifetime
+        self.parallel_put = parallel_put
+        # Slots bound the number of trajectories being sharded or waiting in the queue.
+        self._slots = threading.Semaphore(max_size)
+        self._sequence_lock = threading.Lock()
+        self._next_sequence_number = 0
+        self._publish_condition = threading.Condition()
+        self._next_to_publish = 0
 
     def run(self) -> None:
         """This function ensures that trajectories on the queue are consumed in the right order. The
         start_condition and end_condition are used to ensure that only 1 thread is processing an
-        item from the queue at one time, ensuring predictable memory usage.
+        item from the queue at one time, ensuring predictable memory usage. In parallel mode no
+        tickets are issued and ordering is handled by the sequence numbers in `put`.
         """
         while not self.lifetime.should_stop():
             try:
@@ -64,28 +105,26 @@ class OnPolicyPipeline(threading.Thread):
 
     def put(
         self,
-        traj: Sequence[StoixTransition],
+        traj: Union[List[StoixTransition], StoixTransition],
         timestep: TimeStep,
         actor_timings_dict: Dict[str, List[float]],
         actor_episode_metrics: List[Dict[str, List[float]]],
     ) -> None:
-        """Put a trajectory on the queue to be consumed by the learner."""
-        start_condition, end_condition = (threading.Condition(), threading.Condition())
-        with start_condition:
-            self.tickets_queue.put((start_condition, end_condition))
-            start_condition.wait()  # wait to be allowed to start
+        """Put a trajectory on the queue to be consumed by the learner. The trajectory is either
+        a list of per-step transitions or a single transition of shape [rollout_len, num_envs]."""
+        if self.parallel_put:
+            self._parallel_put(traj, timestep, actor_timings_dict, actor_episode_metrics)
+            return
 
-        # [Transition(num_envs)] * rollout_len --> Transition[(rollout_len, num_envs,)
-        traj = self.stack_trajectory(traj)
-        # Split trajectory on the num envs axis so each learner device gets a valid full rollout
-        sharded_traj = jax.tree.map(lambda x: self.shard_split_playload(x, axis=1), traj)
-
-        # Timestep[(num_envs, ...), ...] -->
-        # [(num_envs / num_learner_devices, ...)] * num_learner_devices
-        sharded_timestep = jax.tree.map(self.shard_split_playload, timestep)
+        start_condition, end_condition = (threading.Condition(), threading.Condition())
+        with RecordTimeTo(actor_timings_dict["pipeline_wait_time"]):
+            with start_condition:
+                self.tickets_queue.put((start_condition, end_condition))
+                start_condition.wait()  # wait to be allowed to start
 
-        # Concatenate metrics - List[Dict[str, List[float]]] --> Dict[str, List[float]]
-        actor_episode_metrics = self.concatenate_metrics(actor_episode_metrics)
+        sharded_traj, sharded_timestep, actor_episode_metrics = self._shard(
+            traj, timestep, actor_timings_dict, actor_episode_metrics
+        )
 
         # We block on the put to ensure that actors wait for the learners to catch up. This does two
         # things:
@@ -112,6 +151,79 @@ class OnPolicyPipeline(threading.Thread):
             with end_condition:
                 end_condition.notify()  # tell we have finish
 
+    def _parallel_put(
+        self,
+        traj: Union[List[StoixTransition], StoixTransition],
+        timestep: TimeStep,
+        actor_timings_dict: Dict[str, List[float]],
+        actor_episode_metrics: List[Dict[str, List[float]]],
+    ) -> None:
+        """Stack and shard a trajectory without waiting on other actors, then publish it
+        once all trajectories with a lower sequence number have been published."""
+        # Acquiring a slot blocks when the learner falls behind, just like the blocking put
+        # in serial mode. Slots are acquired before sequence numbers are assigned so that an
+        # actor holding a slot never waits on an actor without one.
+        with RecordTimeTo(actor_timings_dict["pipeline_wait_time"]):
+            if not self._slots.acquire(timeout=180):
+                raise queue.Full
+            with self._sequence_lock:
+                sequence_number = self._next_sequence_number
+                self._next_sequence_number += 1
+
+        item = None
+        try:
+            sharded_traj, sharded_timestep, actor_episode_metrics = self._shard(
+                traj, timestep, actor_timings_dict, actor_episode_metrics
+            )
+            item = (sharded_traj, sharded_timestep, actor_timings_dict, actor_episode_metrics)
+        finally:
+            # Wait for our turn to publish. Even if sharding failed we have to take our turn
+            # so that the actors behind us are not blocked forever.
+            self._publish(sequence_number, item, actor_timings_dict["pipeline_publish_time"])
+
+    def _publish(self, sequence_number: int, item: Any, wait_times: List[float]) -> None:
+        """Publish an item once all items with a lower sequence number have been published."""
+        with self._publish_condition:
+            with RecordTimeTo(wait_times):
+                while self._next_to_publish != sequence_number:
+                    if self.lifetime.should_stop():
+                        self._slots.release()
+                        return
+                    self._publish_condition.wait(timeout=1)
+            if item is None:
+                self._slots.release()
+            else:
+                # The slot bounds the number of queued items so this never blocks.
+                self._queue.put(item)
+            self._next_to_publish += 1
+            self._publish_condition.notify_all()
+
+    def _shard(
+        self,
+        traj: Union[List[StoixTransition], StoixTransition],
+        timestep: TimeStep,
+        actor_timings_dict: Dict[str, List[float]],
+        actor_episode_metrics: List[Dict[str, List[float]]],
+    ) -> Tuple[List[StoixTransition], List[TimeStep], Dict[str, List[float]]]:
+        """Stack the trajectory and shard it with the timestep across the learner devices.
+        Trajectories that were already written to a rollout buffer are not stacked again."""
+        with RecordTimeTo(actor_timings_dict["pipeline_stack_time"]):
+            if isinstance(traj, list):
+                # [Transition(num_envs)] * rollout_len --> Transition[(rollout_len, num_envs,)
+                traj = self.stack_trajectory(traj)
+            # Concatenate metrics - List[Dict[str, List[float]]] --> Dict[str, List[float]]
+            actor_episode_metrics = self.concatenate_metrics(actor_episode_metrics)
+
+        with RecordTimeTo(actor_timings_dict["pipeline_shard_time"]):
+            # Split trajectory on the num envs axis so each learner device gets a valid full rollout
+            sharded_traj = jax.tree.map(lambda x: self.shard_split_playload(x, axis=1), traj)
+
+            # Timestep[(num_envs, ...), ...] -->
+            # [(num_envs / num_learner_devices, ...)] * num_learner_devices
+            sharded_timestep = jax.tree.map(self.shard_split_playload, timestep)
+
+        return sharded_traj, sharded_timestep, actor_episode_metrics
+
     def qsize(self) -> int:
         """Returns the number of trajectories in the pipeline."""
         return self._queue.qsize()
@@ -120,7 +232,10 @@ class OnPolicyPipeline(threading.Thread):
         self, block: bool = True, timeout: Union[float, None] = None
     ) -> Tuple[StoixTransition, TimeStep, Dict[str, List[float]], Dict[str, List[float]]]:
         """Get a trajectory from the pipeline."""
-        return self._queue.get(block, timeout)  # type: ignore
+        item = self._queue.get(block, timeout)
+        if self.parallel_put:
+            self._slots.release()
+        return item  # type: ignore
 
     @partial(jax.jit, static_argnums=(0,))
     def stack_trajectory(self, trajectory: List[StoixTransition]) -> StoixTransition:
@@ -141,45 +256,585 @@ class OnPolicyPipeline(threading.Thread):
 
     def clear(self) -> None:
         """Clear the pipeline."""
+        while not self._queue.empty():
+            self.get()
+
+
+class SampleToInsertRatio:
+    """Rate limiter that keeps the ratio of sampled items to inserted items close to
+    `samples_per_insert`. This mirrors the `SampleToInsertRatio` rate limiter of Reverb.
+
+    Inserts are blocked when the learner has fallen too far behind the actors and samples are
+    blocked when the learner has gotten too far ahead of the actors. The allowed deviation from
+    the exact ratio is controlled by `error_buffer`.
+    """
+
+    def __init__(self, samples_per_insert: float, min_size_to_sample: int, error_buffer: float):
+        """
+        Args:
+            samples_per_insert: The target number of sampled items per inserted item.
+            min_size_to_sample: The minimum number of inserted items before sampling is allowed.
+            error_buffer: The allowed deviation (in sampled items) from the target ratio.
+        """
+        self.samples_per_insert = samples_per_insert
+        self.min_size_to_sample = min_size_to_sample
+        offset = samples_per_insert * min_size_to_sample
+        self.min_diff = offset - error_buffer
+        self.max_diff = offset + error_buffer
+        self.inserts = 0
+        self.samples = 0
+        self._cond = threading.Condition()
+
+    def _can_insert(self, num_inserts: int) -> bool:
+        # Inserting is always allowed until there is enough data to sample from.
+        if self.inserts + num_inserts <= self.min_size_to_sample:
+            return True
+        diff = (self.inserts + num_inserts) * self.samples_per_insert - self.samples
+        return diff <= self.max_diff
+
+    def _can_sample(self, num_samples: int) -> bool:
+        if self.inserts < self.min_size_to_sample:
+            return False
+        diff = self.inserts * self.samples_per_insert - (self.samples + num_samples)
+        return diff >= self.min_diff
+
+    def await_can_insert(self, num_inserts: int, lifetime: ThreadLifetime) -> bool:
+        """Block until `num_inserts` items can be inserted. Returns False if the lifetime
+        was stopped while waiting."""
+        with self._cond:
+            while not self._can_insert(num_inserts):
+                if lifetime.should_stop():
+                    return False
+                self._cond.wait(timeout=1)
+            return True
+
+    def await_can_sample(self, num_samples: int, lifetime: ThreadLifetime) -> bool:
+        """Block until `num_samples` items can be sampled. Returns False if the lifetime
+        was stopped while waiting."""
+        with self._cond:
+            while not self._can_sample(num_samples):
+                if lifetime.should_stop():
+                    return False
+                self._cond.wait(timeout=1)
+            return True
+
+    def insert(self, num_inserts: int) -> None:
+        with self._cond:
+            self.inserts += num_inserts
+            self._cond.notify_all()
+
+    def sample(self, num_samples: int) -> None:
+        with self._cond:
+            self.samples += num_samples
+            self._cond.notify_all()
+
+
+class HostReplayBuffer:
+    """A simple uniform replay buffer stored in host memory as numpy arrays.
+
+    Items are stored in a ring buffer and the storage is lazily allocated from the
+    first inserted batch so that no example transition is needed at construction time.
+    """
+
+    def __init__(self, max_size: int, seed: int):
+        self.max_size = max_size
+        self._storage: Any = None
+        self._next_idx = 0
+        self._size = 0
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, items: Any) -> None:
+        """Add a batch of items with a leading item dimension to the buffer."""
+        num_items = jax.tree_util.tree_leaves(items)[0].shape[0]
+        with self._lock:
+            if self._storage is None:
+                self._storage = jax.tree.map(
+                    lambda x: np.zeros((self.max_size,) + x.shape[1:], dtype=x.dtype), items
+                )
+            indices = (self._next_idx + np.arange(num_items)) % self.max_size
+
+            def _write(storage: np.ndarray, x: np.ndarray) -> None:
+                storage[indices] = x
+
+            jax.tree.map(_write, self._storage, items)
+            self._next_idx = int((self._next_idx + num_items) % self.max_size)
+            self._size = min(self._size + num_items, self.max_size)
+
+    def sample(self, num_items: int) -> Any:
+        """Uniformly sample `num_items` items from the buffer."""
+        with self._lock:
+            indices = self._rng.integers(0, self._size, size=num_items)
+            return jax.tree.map(lambda x: x[indices], self._storage)
+
+
+class OffPolicyPipeline(threading.Thread):
+    """
+    The `OffPolicyPipeline` is a host-side replay service. Actors push trajectories without
+    waiting on the learner, the pipeline thread inserts them into a `HostReplayBuffer` and the
+    learner samples batches from it at its own rate. A `SampleToInsertRatio` rate limiter keeps
+    the number of sampled items per inserted item close to `samples_per_insert`.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        buffer_size: int,
+        rate_limiter: SampleToInsertRatio,
+        learner_devices: List[jax.Device],
+        lifetime: ThreadLifetime,
+        seed: int,
+    ):
+        """
+        Initializes the pipeline.
+
+        Args:
+            max_size: The maximum number of trajectories waiting to be inserted.
+            buffer_size: The maximum number of transitions held by the replay buffer.
+            rate_limiter: The rate limiter controlling inserts and samples.
+            learner_devices: The devices to shard sampled batches across.
+            lifetime: The lifetime used to signal the pipeline to stop.
+            seed: The seed used for sampling.
+        """
+        super().__init__(name="OffPolicyPipeline")
+        self.learner_devices = learner_devices
+        self.rate_limiter = rate_limiter
+        self.buffer = HostReplayBuffer(buffer_size, seed)
+        self._queue: queue.Queue = queue.Queue(maxsize=max_size)
+        self._actor_info: queue.Queue = queue.Queue()
+        self.lifetime = lifetime
+
+    def run(self) -> None:
+        """Insert the trajectories put by the actors into the replay buffer, respecting
+        the rate limiter."""
+        while not self.lifetime.should_stop():
+            try:
+                traj, actor_timings_dict, actor_episode_metrics = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            # [Transition(num_envs)] * rollout_len --> Transition[(rollout_len * num_envs,)]
+            items = jax.tree.map(lambda *x: np.concatenate(x, axis=0), *traj)
+            num_items = jax.tree_util.tree_leaves(items)[0].shape[0]
+            if not self.rate_limiter.await_can_insert(num_items, self.lifetime):
+                break
+            self.buffer.add(items)
+            self.rate_limiter.insert(num_items)
+            self._actor_info.put((actor_timings_dict, actor_episode_metrics))
+
+    def put(
+        self,
+        traj: Sequence[StoixTransition],
+        actor_timings_dict: Dict[str, List[float]],
+        actor_episode_metrics: List[Dict[str, List[float]]],
+    ) -> None:
+        """Put a trajectory on the insert queue. Actors only block here if the insert queue
+        is full, i.e. when the rate limiter is holding back inserts."""
+        actor_episode_metrics = jax.tree.map(
+            lambda *x: np.concatenate(x, axis=0), *actor_episode_metrics
+        )
+        self._queue.put((traj, actor_timings_dict, actor_episode_metrics), block=True, timeout=180)
+
+    def sample(self, num_items_per_device: int, batch_shape: Tuple[int, ...]) -> Any:
+        """Sample `num_items_per_device` items for each learner device, reshape them to
+        `batch_shape` and shard them across the learner devices. Returns None if the
+        pipeline was stopped while waiting for data."""
+        num_items = num_items_per_device * len(self.learner_devices)
+        if not self.rate_limiter.await_can_sample(num_items, self.lifetime):
+            return None
+        batch = self.buffer.sample(num_items)
+        self.rate_limiter.sample(num_items)
+        batch = jax.tree.map(
+            lambda x: x.reshape((len(self.learner_devices),) + batch_shape + x.shape[1:]), batch
+        )
+        return jax.tree.map(
+            lambda x: jax.device_put_sharded(list(x), devices=self.learner_devices), batch
+        )
+
+    def get_actor_info(self) -> Tuple[Dict[str, float], Optional[Dict[str, chex.Array]]]:
+        """Get the mean actor timings and the concatenated episode metrics of the trajectories
+        inserted since the last call. The episode metrics are None if nothing was inserted."""
+        actor_info = []
+        while not self._actor_info.empty():
+            actor_info.append(self._actor_info.get())
+        if not actor_info:
+            return {}, None
+        actor_timings, episode_metrics = zip(*actor_info)
+        episode_metrics = jax.tree.map(lambda *x: np.concatenate(x, axis=0), *episode_metrics)
+        actor_timings = jax.tree.map(lambda *x: np.mean(x), *actor_timings)
+        return actor_timings, episode_metrics
+
+    @property
+    def num_inserted(self) -> int:
+        """The total number of transitions inserted into the replay buffer."""
+        return self.rate_limiter.inserts
+
+    def qsize(self) -> int:
+        """Returns the number of trajectories waiting to be inserted."""
+        return self._queue.qsize()
+
+    def clear(self) -> None:
+        """Clear the insert queue."""
         while not self._queue.empty():
             self._queue.get()
 
 
+def _is_float(x: chex.Array) -> bool:
+    return jnp.issubdtype(x.dtype, jnp.floating)
+
+
+@jax.jit
+def _bf16_encode(params: Parameters) -> Parameters:
+    """Cast the floating point leaves of the params to bfloat16."""
+    return jax.tree.map(lambda x: x.astype(jnp.bfloat16) if _is_float(x) else x, params)
+
+
+@jax.jit
+def _bf16_decode(payload: Parameters, like: Parameters) -> Parameters:
+    """Cast the leaves of a bfloat16 payload back to the dtypes of `like`."""
+    return jax.tree.map(lambda p, x: p.astype(x.dtype), payload, like)
+
+
+@jax.jit
+def _delta_encode(params: Parameters, reference: Parameters) -> Parameters:
+    """Encode the floating point leaves of the params as a bfloat16 delta from `reference`."""
+    return jax.tree.map(
+        lambda x, r: (x - r).astype(jnp.bfloat16) if _is_float(x) else x, params, reference
+    )
+
+
+@jax.jit
+def _delta_decode(payload: Parameters, reference: Parameters) -> Parameters:
+    """Apply a bfloat16 delta payload to `reference`."""
+    return jax.tree.map(
+        lambda p, r: r + p.astype(r.dtype) if _is_float(r) else p, payload, reference
+    )
+
+
 class ParamsSource(threading.Thread):
     """A `ParamSource` is a component that allows networks params to be passed from a
     `Learner` component to `Actor` components.
+
+    The source is a versioned store holding at most one pending version: a newer update
+    overwrites any version that has not been transferred yet, so stale params never pile up.
+    One source is created per actor device and performs a single transfer per version for all
+    the actors on that device. Params that already live on the actor device are not copied.
+
+    Transfers can optionally be compressed:
+        - `bf16`: floating point leaves are sent as bfloat16 and cast back on the actor device.
+        - `delta`: floating point leaves are sent as a bfloat16 delta from the previously sent
+          params. Both sides apply the same delta so the actor params do not drift.
     """
 
-    def __init__(self, init_value: Parameters, device: jax.Device, lifetime: ThreadLifetime):
+    def __init__(
+        self,
+        init_value: Parameters,
+        device: jax.Device,
+        lifetime: ThreadLifetime,
+        compression: Optional[str] = None,
+    ):
+        """
+        Args:
+            init_value: The initial params.
+            device: The actor device to transfer the params to.
+            lifetime: The lifetime used to signal the source to stop.
+            compression: Optional compression of the transfers, one of `bf16` or `delta`.
+        """
         super().__init__(name=f"ParamsSource-{device.id}")
+        if compression not in (None, "bf16", "delta"):
+            raise ValueError(f"Unsupported params compression: {compression}")
         self.value: Parameters = jax.device_put(init_value, device)
         self.device = device
-        self.new_value: queue.Queue = queue.Queue()
         self.lifetime = lifetime
+        self.compression = compression
+        # The params the actor params were reconstructed from, kept next to the learner params.
+        self._reference = init_value
+        # Version of `self.value` and the latest version given by the learner.
+        self.version = 0
+        self.latest_version = 0
+        self._pending: Optional[Parameters] = None
+        self._cond = threading.Condition()
 
     def run(self) -> None:
         """This function is responsible for updating the value of the `ParamSource` when a new value
         is available.
         """
         while not self.lifetime.should_stop():
-            try:
-                waiting = self.new_value.get(block=True, timeout=1)
-                self.value = jax.device_put(jax.block_until_ready(waiting), self.device)
-            except queue.Empty:
-                continue
+            with self._cond:
+                if self._pending is None:
+                    self._cond.wait(timeout=1)
+                    continue
+                new_params, version = self._pending, self.latest_version
+                self._pending = None
+            self.value = self._transfer(new_params)
+            self.version = version
+
+    def _transfer(self, new_params: Parameters) -> Parameters:
+        """Transfer the params to the actor device, compressing them if requested."""
+        new_params = jax.block_until_ready(new_params)
+        if self.compression == "bf16":
+            payload = jax.device_put(_bf16_encode(new_params), self.device)
+            return _bf16_decode(payload, self.value)
+        if self.compression == "delta":
+            payload = _delta_encode(new_params, self._reference)
+            self._reference = _delta_decode(payload, self._reference)
+            return _delta_decode(jax.device_put(payload, self.device), self.value)
+        return jax.device_put(new_params, self.device)
 
     def update(self, new_params: Parameters) -> None:
-        """Update the value of the `ParamSource` with a new value.
+        """Update the value of the `ParamSource` with a new value. Any pending value that
+        has not been transferred yet is dropped.
 
         Args:
             new_params: The new value to update the `ParamSource` with.
         """
-        self.new_value.put(new_params)
+        with self._cond:
+            self._pending = new_params
+            self.latest_version += 1
+            self._cond.notify()
 
     def get(self) -> Parameters:
         """Get the current value of the `ParamSource`."""
         return self.value
 
+    def param_lag(self) -> int:
+        """The number of learner versions the current value of the `ParamSource` is behind."""
+        return self.latest_version - self.version
+
+
+class AsyncEvaluator:
+    """Evaluates param snapshots in a pool of worker threads so that evaluation never blocks
+    the learner.
+
+    Every snapshot is submitted with a payload, e.g. the timestep it was taken at, which is
+    returned with its evaluation metrics. Results are returned in submission order. When the
+    workers fall behind, at most `max_pending` snapshots wait to be evaluated and the oldest
+    waiting snapshots are skipped, so the latest snapshot is always evaluated. An error raised
+    by an evaluation does not stop the workers, it is raised by the next call to `wait` or
+    `get_results` instead.
+    """
+
+    def __init__(
+        self, eval_fns: Sequence[SebulbaEvalFn], max_pending: int, lifetime: ThreadLifetime
+    ):
+        """
+        Args:
+            eval_fns: One evaluation function per worker. Each worker needs its own environments.
+            max_pending: The maximum number of snapshots waiting to be evaluated.
+            lifetime: The lifetime used to signal the workers to stop.
+        """
+        self.max_pending = max_pending
+        self.lifetime = lifetime
+        self.num_skipped = 0
+        self._cond = threading.Condition()
+        self._pending: Deque[Tuple[int, Parameters, chex.PRNGKey]] = deque()
+        self._payloads: Dict[int, Any] = {}
+        # Finished evaluations by sequence number, a skipped snapshot has no metrics.
+        self._finished: Dict[int, Optional[Dict[str, chex.Array]]] = {}
+        self._num_submitted = 0
+        self._next_to_return = 0
+        self._error: Optional[Exception] = None
+        self._workers = [
+            threading.Thread(target=self._run_worker, args=(eval_fn,), name=f"Evaluator-{i}")
+            for i, eval_fn in enumerate(eval_fns)
+        ]
+
+    def start(self) -> None:
+        for worker in self._workers:
+            worker.start()
+
+    def _run_worker(self, eval_fn: SebulbaEvalFn) -> None:
+        """Evaluate the oldest waiting snapshot until the lifetime is stopped."""
+        while True:
+            with self._cond:
+                while not self._pending:
+                    if self.lifetime.should_stop():
+                        return
+                    self._cond.wait(timeout=1)
+                sequence_number, params, key = self._pending.popleft()
+            metrics = None
+            try:
+                metrics = eval_fn(params, key)
+            except Exception as error:
+                # Keep the worker alive so that the snapshot is still accounted for and the
+                # main thread does not wait for it forever.
+                with self._cond:
+                    self._error = self._error or error
+            with self._cond:
+                self._finished[sequence_number] = metrics
+                self._cond.notify_all()
+
+    def _raise_error(self) -> None:
+        """Raise the first error of the evaluation workers in the calling thread."""
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, params: Parameters, key: chex.PRNGKey, payload: Any) -> None:
+        """Submit a snapshot to be evaluated, skipping the oldest waiting snapshots if the
+        workers have fallen behind."""
+        with self._cond:
+            sequence_number = self._num_submitted
+            self._num_submitted += 1
+            self._payloads[sequence_number] = payload
+            self._pending.append((sequence_number, params, key))
+            while len(self._pending) > self.max_pending:
+                skipped, _, _ = self._pending.popleft()
+                self._finished[skipped] = None
+                self.num_skipped += 1
+            self._cond.notify_all()
+
+    def get_results(self) -> List[Tuple[Any, Dict[str, chex.Array]]]:
+        """Get the payloads and metrics of the snapshots evaluated since the last call, in
+        submission order. Skipped snapshots are not returned."""
+        results = []
+        with self._cond:
+            self._raise_error()
+            while self._next_to_return in self._finished:
+                metrics = self._finished.pop(self._next_to_return)
+                payload = self._payloads.pop(self._next_to_return)
+                if metrics is not None:
+                    results.append((payload, metrics))
+                self._next_to_return += 1
+        return results
+
+    def wait(self) -> None:
+        """Block until every submitted snapshot has been evaluated or skipped."""
+        with self._cond:
+            while self._next_to_return + len(self._finished) < self._num_submitted:
+                self._raise_error()
+                self._cond.wait(timeout=1)
+            self._raise_error()
+
+    def stop(self) -> None:
+        """Stop the workers once they finish their current evaluation."""
+        self.lifetime.stop()
+        for worker in self._workers:
+            worker.join()
+
+
+class EvaluationRecorder:
+    """Logs the results of an `AsyncEvaluator` whose payloads are `(eval_step, timestep,
+    learner_state)`, checkpoints the evaluated learner states and keeps the best actor params
+    for the absolute metric."""
+
+    def __init__(
+        self,
+        config: DictConfig,
+        logger: StoixLogger,
+        get_actor_params: Callable[[Parameters], Parameters],
+        initial_actor_params: Parameters,
+    ):
+        self.config = config
+        self.logger = logger
+        self.get_actor_params = get_actor_params
+        # Only the first process saves checkpoints in multi-process runs
+        self.checkpointer: Optional[Checkpointer] = None
+        if config.logger.checkpointing.save_model and jax.process_index() == 0:
+            self.checkpointer = Checkpointer(
+                metadata=config,  # Save all config as metadata in the checkpoint
+                model_name=config.system.system_name,
+                **config.logger.checkpointing.save_args,  # Checkpoint args
+            )
+        self.max_episode_return = jnp.float32(-1e7)
+        self.best_params = initial_actor_params
+        # The metrics of the latest evaluated snapshot
+        self.eval_metrics: Optional[Dict[str, chex.Array]] = None
+
+    def record(self, results: List[Tuple[Tuple[int, int, Any], Dict[str, chex.Array]]]) -> None:
+        """Log, checkpoint and track the best params of the evaluated snapshots."""
+        for (eval_step, t, learner_state), eval_metrics in results:
+            self.logger.log(eval_metrics, t, eval_step, LogEvent.EVAL)
+
+            episode_return = jnp.mean(eval_metrics["episode_return"])
+
+            if self.checkpointer is not None:
+                # Save checkpoint of learner state
+                self.checkpointer.save(
+                    timestep=t,
+                    unreplicated_learner_state=unreplicate_local(learner_state),
+                    episode_return=episode_return,
+                )
+
+            if self.config.arch.absolute_metric and self.max_episode_return <= episode_return:
+                self.best_params = unreplicate_local(self.get_actor_params(learner_state.params))
+                self.max_episode_return = episode_return
+
+            self.eval_metrics = eval_metrics
+
+
+def get_evaluator_devices(
+    config: DictConfig, learner_devices: Sequence[jax.Device]
+) -> List[jax.Device]:
+    """Get the devices used by the evaluator workers. By default the first learner device
+    is used."""
+    if config.arch.evaluator.use_cpu:
+        return [jax.devices("cpu")[0]]
+    if config.arch.evaluator.device_ids is not None:
+        local_devices = jax.local_devices()
+        return [local_devices[device_id] for device_id in config.arch.evaluator.device_ids]
+    return [learner_devices[0]]
+
+
+def get_rollout_buffer_fns(
+    rollout_length: int, actor_device: jax.Device
+) -> Tuple[Callable[[StoixTransition], StoixTransition], Callable[..., StoixTransition]]:
+    """Get the functions to create and fill a fixed-shape rollout buffer on the actor device.
+
+    The buffer has shape [rollout_length, num_envs, ...] and is created once per actor from an
+    example transition. Each step is written in place with a jitted update that donates the
+    buffer, so a full rollout can be handed to the pipeline without a stacking step and the
+    same device memory is reused by every rollout.
+    """
+
+    def init_buffer(transition: StoixTransition) -> StoixTransition:
+        return jax.tree.map(  # type: ignore
+            lambda x: jnp.zeros((rollout_length,) + x.shape, dtype=x.dtype), transition
+        )
+
+    def write_buffer(
+        buffer: StoixTransition, transition: StoixTransition, index: chex.Array
+    ) -> StoixTransition:
+        return jax.tree.map(  # type: ignore
+            lambda b, x: jax.lax.dynamic_update_index_in_dim(b, x.astype(b.dtype), index, axis=0),
+            buffer,
+            transition,
+        )
+
+    init_buffer_fn = jax.jit(init_buffer, device=actor_device)
+    write_buffer_fn = jax.jit(write_buffer, device=actor_device, donate_argnums=0)
+    return init_buffer_fn, write_buffer_fn
+
+
+def initialize_distributed(config: DictConfig) -> None:
+    """Initialise the JAX distributed runtime when the run is spread across several processes.
+
+    Every process runs its own actors and learner threads. The learners of all processes form
+    a single `pmap` so that gradients are averaged across every learner device.
+    """
+    distributed = config.arch.distributed
+    if distributed.num_processes <= 1:
+        return
+    # Allow CPU devices to take part in cross-process collectives. This lets multi-host runs
+    # be tested on a single machine with forced host device counts.
+    jax.config.update("jax_cpu_collectives_implementation", "gloo")
+    jax.distributed.initialize(
+        coordinator_address=distributed.coordinator_address,
+        num_processes=distributed.num_processes,
+        process_id=distributed.process_id,
+    )
+
+
+def get_global_learner_devices(learner_device_ids: Sequence[int]) -> List[jax.Device]:
+    """Get the learner devices of every process, in process order. All processes use the
+    same local learner device ids."""
+    global_learner_devices = []
+    for process_index in range(jax.process_count()):
+        process_devices = [d for d in jax.devices() if d.process_index == process_index]
+        global_learner_devices.extend(process_devices[i] for i in learner_device_ids)
+    return global_learner_devices
+
 
 class RecordTimeTo:
     def __init__(self, to: Any):
@@ -191,3 +846,579 @@ class RecordTimeTo:
     def __exit__(self, *args: Any) -> None:
         end = time.monotonic()
         self.to.append(end - self.start)
+
+
+def get_off_policy_devices(
+    config: DictConfig,
+) -> Tuple[List[jax.Device], List[jax.Device], List[jax.Device]]:
+    """Get the actor, learner and evaluator devices of an off-policy Sebulba system. This also
+    sets the number of devices and the batch size per learner device in the config."""
+    local_devices = jax.local_devices()
+    global_devices = jax.devices()
+    assert len(local_devices) == len(
+        global_devices
+    ), "Local and global devices must be the same for now. We dont support multihost just yet"
+    # Extract the actor and learner devices
+    actor_devices = [local_devices[device_id] for device_id in config.arch.actor.device_ids]
+    learner_devices = [local_devices[device_id] for device_id in config.arch.learner.device_ids]
+    # Get the devices used by the evaluator workers
+    evaluator_devices = get_evaluator_devices(config, learner_devices)
+    print(f"{Fore.BLUE}{Style.BRIGHT}Actors devices: {actor_devices}{Style.RESET_ALL}")
+    print(f"{Fore.GREEN}{Style.BRIGHT}Learner devices: {learner_devices}{Style.RESET_ALL}")
+    print(f"{Fore.MAGENTA}{Style.BRIGHT}Global devices: {global_devices}{Style.RESET_ALL}")
+    # Set the number of learning and acting devices in the config
+    # useful for keeping track of experimental setup
+    config.num_learner_devices = len(learner_devices)
+    config.num_actor_devices = len(actor_devices)
+
+    # Calculate the per learner device batch size.
+    assert config.system.total_batch_size % config.num_learner_devices == 0, (
+        f"{Fore.RED}{Style.BRIGHT}The total batch size should be divisible "
+        + f"by the number of learner devices!{Style.RESET_ALL}"
+    )
+    config.system.batch_size = config.system.total_batch_size // config.num_learner_devices
+    return actor_devices, learner_devices, evaluator_devices
+
+
+def get_off_policy_rollout_fn(
+    env_factory: EnvFactory,
+    actor_device: jax.Device,
+    params_source: ParamsSource,
+    pipeline: OffPolicyPipeline,
+    act_fn: ActFn,
+    transition_cls: Callable[..., StoixTransition],
+    config: DictConfig,
+    seeds: List[int],
+    thread_lifetime: ThreadLifetime,
+) -> Callable[[chex.PRNGKey], None]:
+    """Get the rollout function that is used by the actor threads of off-policy systems.
+    Transitions are kept on the host since they are inserted into a host-side replay buffer."""
+    act_fn = jax.jit(act_fn, device=actor_device)
+    cpu = jax.devices("cpu")[0]
+    move_to_device = lambda tree: jax.tree.map(lambda x: jax.device_put(x, actor_device), tree)
+    split_key_fn = jax.jit(jax.random.split, device=actor_device)
+    # Build the environments
+    envs = env_factory(config.arch.actor.num_envs_per_actor)
+
+    # Create the rollout function
+    def rollout_fn(rng_key: chex.PRNGKey) -> None:
+        # Ensure all computation is on the actor device
+        with jax.default_device(actor_device):
+            # Reset the environment
+            timestep = envs.reset(seed=seeds)
+
+            # Loop until the thread is stopped
+            while not thread_lifetime.should_stop():
+                # Create the list to store transitions
+                traj: List[StoixTransition] = []
+                # Create the dictionary to store timings for metrics
+                actor_timings_dict: Dict[str, List[float]] = defaultdict(list)
+                episode_metrics: List[Dict[str, List[float]]] = []
+                # Rollout the environment
+                with RecordTimeTo(actor_timings_dict["single_rollout_time"]):
+                    # Loop until the rollout length is reached
+                    for _ in range(config.system.rollout_length):
+                        # Get the latest parameters from the source
+                        with RecordTimeTo(actor_timings_dict["get_params_time"]):
+                            params = params_source.get()
+                        actor_timings_dict["param_lag"].append(params_source.param_lag())
+
+                        # Move the environment data to the actor device
+                        obs = timestep.observation
+                        cached_obs = move_to_device(obs)
+
+                        # Run the actor network to get the action
+                        with RecordTimeTo(actor_timings_dict["compute_action_time"]):
+                            rng_key, policy_key = split_key_fn(rng_key)
+                            action = act_fn(params, cached_obs, policy_key)
+
+                        # Move the action to the CPU
+                        action_cpu = np.asarray(jax.device_put(action, cpu))
+
+                        # Step the environment
+                        with RecordTimeTo(actor_timings_dict["env_step_time"]):
+                            timestep = envs.step(action_cpu)
+
+                        # Only true terminations stop bootstrapping, truncated episodes
+                        # bootstrap from the final observation stored in the extras.
+                        dones = np.logical_and(
+                            np.asarray(timestep.last()), np.asarray(timestep.discount == 0.0)
+                        )
+
+                        # Append the host-side transition to the trajectory list
+                        metrics = timestep.extras["metrics"]
+                        traj.append(
+                            transition_cls(
+                                obs,
+                                action_cpu,
+                                np.asarray(timestep.reward),
+                                dones,
+                                timestep.extras["next_obs"],
+                                {},
+                            )
+                        )
+                        episode_metrics.append(metrics)
+
+                # Send the trajectory to the replay pipeline
+                with RecordTimeTo(actor_timings_dict["rollout_put_time"]):
+                    try:
+                        pipeline.put(traj, actor_timings_dict, episode_metrics)
+                    except queue.Full:
+                        warnings.warn(
+                            "Waited too long to add to the replay queue, killing the actor thread",
+                            stacklevel=2,
+                        )
+                        break
+
+            # Close the environments
+            envs.close()
+
+    return rollout_fn
+
+
+def get_off_policy_actor_thread(
+    env_factory: EnvFactory,
+    actor_device: jax.Device,
+    params_source: ParamsSource,
+    pipeline: OffPolicyPipeline,
+    act_fn: ActFn,
+    transition_cls: Callable[..., StoixTransition],
+    rng_key: chex.PRNGKey,
+    config: DictConfig,
+    seeds: List[int],
+    thread_lifetime: ThreadLifetime,
+    name: str,
+) -> threading.Thread:
+    """Get the actor thread that once started will collect data from the
+    environment and send it to the replay pipeline."""
+    rng_key = jax.device_put(rng_key, actor_device)
+
+    rollout_fn = get_off_policy_rollout_fn(
+        env_factory,
+        actor_device,
+        params_source,
+        pipeline,
+        act_fn,
+        transition_cls,
+        config,
+        seeds,
+        thread_lifetime,
+    )
+
+    actor = threading.Thread(
+        target=rollout_fn,
+        args=(rng_key,),
+        name=name,
+    )
+
+    return actor
+
+
+def get_off_policy_learner_rollout_fn(
+    learn_step: SebulbaLearnerFn[CoreLearnerState, StoixTransition],
+    config: DictConfig,
+    eval_queue: queue.Queue,
+    pipeline: OffPolicyPipeline,
+    params_sources: Sequence[ParamsSource],
+    get_actor_params: Callable[[Parameters], Parameters],
+) -> Callable[[CoreLearnerState], None]:
+    """Get the learner rollout function that is used by the learner thread to update the networks.
+    This function is what is actually run by the learner thread. It samples data from the replay
+    pipeline and uses the learner update function to update the networks. It then sends these
+    intermediate network parameters to a queue for evaluation.
+
+    If the learner stops before the end of training, e.g. because the pipeline was stopped or
+    an update raised an exception, `None` is put on the evaluation queue so that the main thread
+    does not wait forever for the remaining evaluations."""
+
+    batch_shape = (config.system.epochs, config.system.batch_size)
+    num_items_per_device = config.system.epochs * config.system.batch_size
+
+    def learn_until_eval(
+        learner_state: CoreLearnerState,
+    ) -> Optional[Tuple[CoreLearnerState, List[Dict], Dict[str, List[float]]]]:
+        """Run the updates of a single evaluation interval. Returns None if the pipeline was
+        stopped while waiting for data."""
+        # Create the lists to store metrics and timings for this learning iteration.
+        train_metrics: List[Dict] = []
+        learner_timings: Dict[str, List[float]] = defaultdict(list)
+        with RecordTimeTo(learner_timings["learner_time_per_eval"]):
+            # Loop for the number of updates per evaluation
+            for _ in range(config.arch.num_updates_per_eval):
+                # Sample the batch from the replay pipeline. This blocks until the
+                # rate limiter allows the learner to sample.
+                with RecordTimeTo(learner_timings["replay_sample_time"]):
+                    traj_batch = pipeline.sample(num_items_per_device, batch_shape)
+                if traj_batch is None:
+                    return None
+                # We then call the update function to update the networks
+                with RecordTimeTo(learner_timings["learner_step_time"]):
+                    learner_state, step_metrics = learn_step(learner_state, traj_batch)
+
+                # We store the metrics for this update
+                train_metrics.append(step_metrics)
+                learner_timings["pipeline_qsize"].append(pipeline.qsize())
+
+                # After the update we need to update the params sources with the new params
+                unreplicated_params = unreplicate(get_actor_params(learner_state.params))
+                # We loop over all params sources and update them with the new params
+                # This is so that all the actors can get the latest params
+                for source in params_sources:
+                    source.update(unreplicated_params)
+        return learner_state, train_metrics, learner_timings
+
+    def learn(learner_state: CoreLearnerState) -> bool:
+        """Run all the evaluation intervals. Returns whether training was completed."""
+        # Loop for the total number of evaluations selected to be performed.
+        for _ in range(config.arch.num_evaluation):
+            output = learn_until_eval(learner_state)
+            if output is None:
+                return False
+            learner_state, train_metrics, learner_timings = output
+
+            # We then pass all the environment metrics, training metrics, current learner state
+            # and timings to the evaluation queue. Since actors are decoupled from the learner,
+            # we gather all the actor data inserted into the replay buffer since the last
+            # evaluation.
+            actor_timings, episode_metrics = pipeline.get_actor_info()
+            train_metrics = jax.tree.map(lambda *x: np.asarray(x), *train_metrics)
+            timing_dict = dict(actor_timings) | learner_timings
+            timing_dict = jax.tree.map(np.mean, timing_dict, is_leaf=lambda x: isinstance(x, list))
+            try:
+                # We add a timeout mainly for sanity checks
+                # If the queue is full for more than 60 seconds we kill the learner thread
+                # This should never happen
+                eval_queue.put(
+                    (
+                        episode_metrics,
+                        train_metrics,
+                        learner_state,
+                        timing_dict,
+                        pipeline.num_inserted,
+                    ),
+                    timeout=60,
+                )
+            except queue.Full:
+                warnings.warn(
+                    "Waited too long to add to the evaluation queue, killing the learner thread. "
+                    "This should not happen.",
+                    stacklevel=2,
+                )
+                return False
+        return True
+
+    def learner_rollout(learner_state: CoreLearnerState) -> None:
+        completed = False
+        try:
+            completed = learn(learner_state)
+        finally:
+            if not completed:
+                # Tell the main thread that no more evaluations are coming.
+                eval_queue.put(None)
+
+    return learner_rollout
+
+
+def get_off_policy_learner_thread(
+    learn_step: SebulbaLearnerFn[CoreLearnerState, StoixTransition],
+    learner_state: CoreLearnerState,
+    config: DictConfig,
+    eval_queue: queue.Queue,
+    pipeline: OffPolicyPipeline,
+    params_sources: Sequence[ParamsSource],
+    get_actor_params: Callable[[Parameters], Parameters],
+) -> threading.Thread:
+    """Get the learner thread that is used to update the networks."""
+
+    learner_rollout_fn = get_off_policy_learner_rollout_fn(
+        learn_step, config, eval_queue, pipeline, params_sources, get_actor_params
+    )
+
+    learner_thread = threading.Thread(
+        target=learner_rollout_fn,
+        args=(learner_state,),
+        name="Learner",
+    )
+
+    return learner_thread
+
+
+def get_off_policy_pipeline(
+    config: DictConfig, learner_devices: List[jax.Device], lifetime: ThreadLifetime
+) -> OffPolicyPipeline:
+    """Create the replay pipeline of an off-policy system with its rate limiter."""
+    # Get the number of steps consumed by a single actor rollout
+    steps_per_actor_rollout = config.system.rollout_length * config.arch.actor.num_envs_per_actor
+
+    # Creating the rate limiter. The error buffer must at least allow a full learner step and a
+    # full actor rollout to happen between two checks, otherwise the actors and the learner
+    # could deadlock.
+    samples_per_learner_step = config.system.epochs * config.system.total_batch_size
+    error_buffer = max(
+        config.system.min_replay_size
+        * config.system.samples_per_insert
+        * config.system.samples_per_insert_tolerance_rate,
+        samples_per_learner_step + steps_per_actor_rollout * config.system.samples_per_insert,
+    )
+    rate_limiter = SampleToInsertRatio(
+        config.system.samples_per_insert, config.system.min_replay_size, error_buffer
+    )
+
+    return OffPolicyPipeline(
+        config.arch.pipeline_queue_size,
+        config.system.total_buffer_size,
+        rate_limiter,
+        learner_devices,
+        lifetime,
+        config.arch.seed,
+    )
+
+
+def start_off_policy_actors(
+    config: DictConfig,
+    env_factory: EnvFactory,
+    actor_devices: List[jax.Device],
+    pipeline: OffPolicyPipeline,
+    act_fn: ActFn,
+    transition_cls: Callable[..., StoixTransition],
+    initial_params: Parameters,
+    key: chex.PRNGKey,
+    np_rng: np.random.Generator,
+    actors_lifetime: ThreadLifetime,
+    params_sources_lifetime: ThreadLifetime,
+) -> Tuple[List[ParamsSource], List[threading.Thread]]:
+    """Start one params source per actor device and `actor_per_device` actor threads on each
+    actor device."""
+    params_sources: List[ParamsSource] = []
+    actor_threads: List[threading.Thread] = []
+    for actor_device in actor_devices:
+        # Create 1 params source per actor device as this will be used
+        # to pass the params to the actors
+        params_source = ParamsSource(
+            initial_params,
+            actor_device,
+            params_sources_lifetime,
+            config.arch.params_compression,
+        )
+        params_source.start()
+        params_sources.append(params_source)
+        # Now for each device we choose to create multiple actor threads
+        for i in range(config.arch.actor.actor_per_device):
+            key, actors_key = jax.random.split(key)
+            seeds = np_rng.integers(
+                np.iinfo(np.int32).max, size=config.arch.actor.num_envs_per_actor
+            ).tolist()
+            actor_thread = get_off_policy_actor_thread(
+                env_factory,
+                actor_device,
+                params_source,
+                pipeline,
+                act_fn,
+                transition_cls,
+                actors_key,
+                config,
+                seeds,
+                actors_lifetime,
+                f"Actor-{actor_device}-{i}",
+            )
+            actor_thread.start()
+            actor_threads.append(actor_thread)
+    return params_sources, actor_threads
+
+
+def stop_sebulba_threads(
+    learner_thread: threading.Thread,
+    actor_threads: Sequence[threading.Thread],
+    actors_lifetime: ThreadLifetime,
+    pipeline: Union[OnPolicyPipeline, OffPolicyPipeline],
+    pipeline_lifetime: ThreadLifetime,
+    params_sources: Sequence[ParamsSource],
+    params_sources_lifetime: ThreadLifetime,
+    learner_done: bool = True,
+) -> None:
+    """Stop the learner, the actors, the pipeline and the params sources of a Sebulba system.
+
+    If the learner is not done, e.g. because the main thread raised, the actors and the pipeline
+    are stopped before waiting for the learner. A learner that samples from the stopped pipeline
+    then stops after its current update, instead of training until the end or waiting forever for
+    data.
+    """
+    if not learner_done:
+        actors_lifetime.stop()
+        pipeline_lifetime.stop()
+
+    print(f"{Fore.MAGENTA}{Style.BRIGHT}Closing learner...{Style.RESET_ALL}")
+    # Now we stop the learner
+    learner_thread.join()
+
+    # First we stop all actors
+    actors_lifetime.stop()
+
+    # Now we stop the actors and params sources
+    print(f"{Fore.MAGENTA}{Style.BRIGHT}Closing actors...{Style.RESET_ALL}")
+    pipeline.clear()
+    for actor in actor_threads:
+        # We clear the pipeline before stopping each actor thread
+        # since actors can be blocked on the pipeline
+        pipeline.clear()
+        actor.join()
+
+    print(f"{Fore.MAGENTA}{Style.BRIGHT}Closing pipeline...{Style.RESET_ALL}")
+    # Stop the pipeline
+    pipeline_lifetime.stop()
+    pipeline.join()
+
+    print(f"{Fore.MAGENTA}{Style.BRIGHT}Closing params sources...{Style.RESET_ALL}")
+    # Stop the params sources
+    params_sources_lifetime.stop()
+    for param_source in params_sources:
+        param_source.join()
+
+
+def log_off_policy_training(
+    config: DictConfig,
+    logger: StoixLogger,
+    learner_output: Tuple,
+    eval_step: int,
+    num_evaluator_skipped: int,
+) -> int:
+    """Log the episode, training and timing metrics put on the evaluation queue by the learner
+    of an off-policy system. Since acting is decoupled from learning, the metrics are logged
+    against the number of environment steps inserted into the replay buffer, which is returned.
+    """
+    episode_metrics, train_metrics, _, timings_dict, num_inserted = learner_output
+    steps_per_actor_rollout = config.system.rollout_length * config.arch.actor.num_envs_per_actor
+
+    t = int(num_inserted)
+    timings_dict["timestep"] = t
+    timings_dict["evaluator_skipped_snapshots"] = num_evaluator_skipped
+    logger.log(timings_dict, t, eval_step, LogEvent.MISC)
+
+    if episode_metrics is not None:
+        episode_metrics, ep_completed = get_final_step_metrics(episode_metrics)
+        # Calculate steps per second for a single actor
+        episode_metrics["steps_per_second"] = (
+            steps_per_actor_rollout / timings_dict["single_rollout_time"]
+        )
+        if ep_completed:
+            logger.log(episode_metrics, t, eval_step, LogEvent.ACT)
+
+    train_metrics["learner_step"] = (eval_step + 1) * config.arch.num_updates_per_eval
+    train_metrics["sgd_steps_per_second"] = (
+        config.arch.num_updates_per_eval * config.system.epochs
+    ) / timings_dict["learner_time_per_eval"]
+    logger.log(train_metrics, t, eval_step, LogEvent.TRAIN)
+    return t
+
+
+def run_off_policy_training(
+    config: DictConfig,
+    env_factory: EnvFactory,
+    learn_step: SebulbaLearnerFn[CoreLearnerState, StoixTransition],
+    learner_state: CoreLearnerState,
+    act_fn: ActFn,
+    transition_cls: Callable[..., StoixTransition],
+    get_actor_params: Callable[[Parameters], Parameters],
+    evaluator: AsyncEvaluator,
+    logger: StoixLogger,
+    key: chex.PRNGKey,
+    np_rng: np.random.Generator,
+    actor_devices: List[jax.Device],
+    learner_devices: List[jax.Device],
+) -> Tuple[Dict[str, chex.Array], Parameters, int, int]:
+    """Train an off-policy Sebulba system. The actors, the replay pipeline, the learner and the
+    evaluator each run in their own threads, while the calling thread logs the metrics put on
+    the evaluation queue by the learner and submits param snapshots for evaluation.
+
+    Args:
+        act_fn: The function used by the actors to select exploratory actions.
+        transition_cls: The transition type stored in the replay buffer.
+        get_actor_params: Selects the params used by the actors from the learner params.
+
+    Returns:
+        The metrics of the last evaluation, the best actor params for the absolute metric and
+        the timestep and evaluation step of the last evaluation.
+    """
+    # Get initial parameters
+    initial_params = unreplicate(get_actor_params(learner_state.params))
+
+    # Set up the logging, checkpointing and best params tracking of the evaluations
+    recorder = EvaluationRecorder(config, logger, get_actor_params, initial_params)
+
+    # Creating the pipeline
+    # First we create the lifetime so we can stop the pipeline when we want
+    pipeline_lifetime = ThreadLifetime()
+    pipeline = get_off_policy_pipeline(config, learner_devices, pipeline_lifetime)
+    # Start the pipeline
+    pipeline.start()
+
+    # Create a single lifetime for all the actors and params sources
+    actors_lifetime = ThreadLifetime()
+    params_sources_lifetime = ThreadLifetime()
+    key, actors_key = jax.random.split(key)
+    params_sources, actor_threads = start_off_policy_actors(
+        config,
+        env_factory,
+        actor_devices,
+        pipeline,
+        act_fn,
+        transition_cls,
+        initial_params,
+        actors_key,
+        np_rng,
+        actors_lifetime,
+        params_sources_lifetime,
+    )
+
+    # Create the evaluation queue
+    eval_queue: queue.Queue = queue.Queue(maxsize=config.arch.num_evaluation)
+    # Create the learner thread
+    learner_thread = get_off_policy_learner_thread(
+        learn_step, learner_state, config, eval_queue, pipeline, params_sources, get_actor_params
+    )
+    learner_thread.start()
+
+    # This is the main loop, all it does is logging and submitting params for evaluation.
+    # Acting, learning and evaluation are happening in their own threads.
+    # This loop waits for the learner to finish an update before logging.
+    # The threads are stopped even if an evaluation fails.
+    learner_done = False
+    try:
+        for eval_step in range(config.arch.num_evaluation):
+            # Get the next set of params and metrics from the learner
+            learner_output = eval_queue.get(block=True)
+            if learner_output is None:
+                break
+            t = log_off_policy_training(
+                config, logger, learner_output, eval_step, evaluator.num_skipped
+            )
+
+            # Submit the current model for evaluation along with the step it was taken at
+            learner_state = learner_output[2]
+            unreplicated_actor_params = unreplicate(get_actor_params(learner_state.params))
+            key, eval_key = jax.random.split(key, 2)
+            evaluator.submit(unreplicated_actor_params, eval_key, (eval_step, t, learner_state))
+            # The last model is always evaluated, so we wait for it once the learner is done
+            if eval_step == config.arch.num_evaluation - 1:
+                evaluator.wait()
+
+            # Log the metrics of the models evaluated so far against the step they were taken at
+            recorder.record(evaluator.get_results())
+        # The learner has either put all its evaluations on the queue or stopped early.
+        learner_done = True
+    finally:
+        evaluator.stop()
+        stop_sebulba_threads(
+            learner_thread,
+            actor_threads,
+            actors_lifetime,
+            pipeline,
+            pipeline_lifetime,
+            params_sources,
+            params_sources_lifetime,
+            learner_done,
+        )
+    if learner_output is None:
+        raise RuntimeError("The learner stopped before the end of training.")
+
+    return recorder.eval_metrics, recorder.best_params, t, eval_step
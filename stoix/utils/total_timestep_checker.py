@@ -1,3 +1,5 @@
+import math
+
 from colorama import Fore, Style
 from omegaconf import DictConfig
 
@@ -26,6 +28,10 @@ def check_total_timesteps_anakin(config: DictConfig) -> DictConfig:
         config.arch.total_num_envs // (config.num_devices * config.arch.update_batch_size)
     )  # Number of environments per device
 
+    # Off-policy systems set the number of gradient updates per rollout from their replay ratio.
+    if "replay_ratio" in config.system:
+        config = check_replay_ratio_anakin(config)
+
     if config.arch.total_timesteps is None:
         config.arch.total_timesteps = (
             config.num_devices
@@ -74,6 +80,63 @@ def check_total_timesteps_anakin(config: DictConfig) -> DictConfig:
         f"{Style.RESET_ALL}"
     )
 
+    if "replay_ratio" in config.system:
+        # The fractional updates per rollout are spread over the rollouts of each evaluation,
+        # and the spreading restarts with every evaluation. The updates per rollout are therefore
+        # rounded so that each evaluation performs an integer number of updates.
+        env_steps_per_eval = (
+            num_updates_per_eval * config.system.rollout_length * config.arch.num_envs
+        )
+        updates_per_eval = round(num_updates_per_eval * config.system.updates_per_rollout)
+        assert updates_per_eval > 0, (
+            f"{Fore.RED}{Style.BRIGHT}The replay ratio is too low to perform a gradient update "
+            + f"within the {num_updates_per_eval} rollouts between two evaluations! Please "
+            + f"increase the replay ratio or decrease the number of evaluations.{Style.RESET_ALL}"
+        )
+        config.system.updates_per_rollout = updates_per_eval / num_updates_per_eval
+        config.system.epochs = math.ceil(config.system.updates_per_rollout)
+        print(
+            f"{Fore.YELLOW}{Style.BRIGHT}Each learner performs {updates_per_eval} gradient "
+            + f"updates per {env_steps_per_eval} environment steps, a replay ratio of "
+            + f"{updates_per_eval / max(env_steps_per_eval, 1):.6g}.{Style.RESET_ALL}"
+        )
+
+    return config
+
+
+def check_replay_ratio_anakin(config: DictConfig) -> DictConfig:
+    """Set the number of gradient updates per rollout of an off-policy Anakin system.
+
+    The replay ratio is the number of gradient updates per environment step of each vectorised
+    learner, which steps `num_envs` environments for `rollout_length` steps per rollout. If it is
+    not set, it is derived from `epochs`. Otherwise `epochs` is the replay ratio times the steps
+    per rollout rounded up, and fractional updates per rollout skip some of the epochs. As the
+    skipped epochs are spread over the rollouts between two evaluations, see
+    `get_num_updates_per_rollout`, `check_total_timesteps_anakin` then rounds the updates per
+    rollout so that the rollouts between two evaluations perform an integer number of updates.
+    """
+    env_steps_per_rollout = config.system.rollout_length * config.arch.num_envs
+    if config.system.replay_ratio is None:
+        config.system.replay_ratio = config.system.epochs / env_steps_per_rollout
+    assert (
+        config.system.replay_ratio > 0
+    ), f"{Fore.RED}{Style.BRIGHT}The replay ratio should be positive!{Style.RESET_ALL}"
+    # Rounded to ignore floating point errors, e.g. with replay ratios of 1 / num_envs.
+    config.system.updates_per_rollout = round(config.system.replay_ratio * env_steps_per_rollout, 6)
+    config.system.epochs = math.ceil(config.system.updates_per_rollout)
+    print(
+        f"{Fore.YELLOW}{Style.BRIGHT}Using a replay ratio of {config.system.replay_ratio:.6g}: "
+        + f"{config.system.updates_per_rollout} gradient updates per rollout of "
+        + f"{env_steps_per_rollout} environment steps, scanned over {config.system.epochs} "
+        + f"epochs.{Style.RESET_ALL}"
+    )
+    if "warmup_steps" in config.system:
+        print(
+            f"{Fore.YELLOW}{Style.BRIGHT}The replay buffer is warmed up with "
+            + f"{config.system.warmup_steps * config.arch.total_num_envs} environment steps "
+            + f"that are not counted in the total number of timesteps.{Style.RESET_ALL}"
+        )
+
     return config
 
 
@@ -82,27 +145,58 @@ def check_total_timesteps_sebulba(config: DictConfig) -> DictConfig:
 
     print(f"{Fore.YELLOW}{Style.BRIGHT}Using Sebulba System!{Style.RESET_ALL}")
 
+    # The total number of envs and timesteps are counted across all processes
+    num_processes = config.arch.distributed.num_processes
     assert (
-        config.arch.total_num_envs % (config.num_actor_devices * config.arch.actor.actor_per_device)
+        config.arch.total_num_envs
+        % (num_processes * config.num_actor_devices * config.arch.actor.actor_per_device)
         == 0
     ), (
-        f"{Fore.RED}{Style.BRIGHT}The total number of environments "
-        + f"should be divisible by the number of actor devices * actor_per_device!{Style.RESET_ALL}"
+        f"{Fore.RED}{Style.BRIGHT}The total number of environments should be divisible by "
+        + f"the number of processes * actor devices * actor_per_device!{Style.RESET_ALL}"
+    )
+    # We first simply take the total number of envs and divide by the number of processes and
+    # actor devices per process to get the number of envs per actor device
+    num_envs_per_actor_device = config.arch.total_num_envs // (
+        num_processes * config.num_actor_devices
     )
-    # We first simply take the total number of envs and divide by the number of actor devices
-    # to get the number of envs per actor device
-    num_envs_per_actor_device = config.arch.total_num_envs // config.num_actor_devices
     # We then divide this by the number of actors per device to get the number of envs per actor
     num_envs_per_actor = int(num_envs_per_actor_device // config.arch.actor.actor_per_device)
     config.arch.actor.num_envs_per_actor = num_envs_per_actor
 
+    # Off-policy systems sample from a replay buffer, in which case a learner step
+    # consumes `epochs * total_batch_size / samples_per_insert` environment steps.
+    is_off_policy = "samples_per_insert" in config.system
+    if is_off_policy:
+        assert num_processes == 1, "Off-policy Sebulba systems only support a single process."
+        assert config.system.min_replay_size >= config.system.total_batch_size, (
+            f"{Fore.RED}{Style.BRIGHT}The minimum replay size should be at least the total "
+            + f"batch size, so that the learner never samples an empty buffer!{Style.RESET_ALL}"
+        )
+        if config.system.samples_per_insert is None:
+            # By default, a single learner step is performed per actor rollout.
+            config.system.samples_per_insert = (
+                config.system.epochs
+                * config.system.total_batch_size
+                / (config.system.rollout_length * config.arch.actor.num_envs_per_actor)
+            )
+            print(
+                f"{Fore.YELLOW}{Style.BRIGHT}Setting samples_per_insert "
+                + f"to {config.system.samples_per_insert}: one learner step per actor rollout."
+                + f"{Style.RESET_ALL}"
+            )
+        steps_per_learner_step = (
+            config.system.epochs * config.system.total_batch_size / config.system.samples_per_insert
+        )
+    else:
+        # Get the number of steps consumed by the learners of all processes per learner step
+        steps_per_learner_step = (
+            config.system.rollout_length * config.arch.actor.num_envs_per_actor * num_processes
+        )
+
     # We base the total number of timesteps based on the number of steps the learner consumes
     if config.arch.total_timesteps is None:
-        config.arch.total_timesteps = (
-            config.arch.num_updates
-            * config.system.rollout_length
-            * config.arch.actor.num_envs_per_actor
-        )
+        config.arch.total_timesteps = int(config.arch.num_updates * steps_per_learner_step)
         print(
             f"{Fore.YELLOW}{Style.BRIGHT}Changing the total number of timesteps "
             + f"to {config.arch.total_timesteps}: If you want to train"
@@ -110,11 +204,7 @@ def check_total_timesteps_sebulba(config: DictConfig) -> DictConfig:
             + f"{Style.RESET_ALL}"
         )
     else:
-        config.arch.num_updates = (
-            config.arch.total_timesteps
-            // config.system.rollout_length
-            // config.arch.actor.num_envs_per_actor
-        )
+        config.arch.num_updates = int(config.arch.total_timesteps // steps_per_learner_step)
         print(
             f"{Fore.YELLOW}{Style.BRIGHT}Changing the number of updates "
             + f"to {config.arch.num_updates}: If you want to train"
@@ -123,12 +213,14 @@ def check_total_timesteps_sebulba(config: DictConfig) -> DictConfig:
         )
 
     # Calculate the number of updates per evaluation
+    assert config.arch.num_evaluation > 0, (
+        f"{Fore.RED}{Style.BRIGHT}The number of evaluations should be positive!"
+        + f"{Style.RESET_ALL}"
+    )
     config.arch.num_updates_per_eval = int(config.arch.num_updates // config.arch.num_evaluation)
-    # Get the number of steps consumed by the learner per learner step
-    steps_per_learner_step = config.system.rollout_length * config.arch.actor.num_envs_per_actor
     # Get the number of steps consumed by the learner per evaluation
     steps_consumed_per_eval = steps_per_learner_step * config.arch.num_updates_per_eval
-    total_actual_timesteps = steps_consumed_per_eval * config.arch.num_evaluation
+    total_actual_timesteps = int(steps_consumed_per_eval * config.arch.num_evaluation)
     print(
         f"{Fore.RED}{Style.BRIGHT}Warning: Due to the interaction of various factors such as "
         f"rollout length, number of evaluations, etc... the actual number of timesteps that "
@@ -146,7 +238,9 @@ def check_total_timesteps_sebulba(config: DictConfig) -> DictConfig:
     # divisible by the number of learner devices. This is because we shard the envs
     # per actor across the learner devices This check is mainly relevant for on-policy
     # algorithms
-    assert config.arch.actor.num_envs_per_actor % config.num_learner_devices == 0, (
+    assert (
+        is_off_policy or config.arch.actor.num_envs_per_actor % config.num_learner_devices == 0
+    ), (
         f"The number of envs per actor must be divisible by the number of learner devices. "
         f"Got {config.arch.actor.num_envs_per_actor} envs per actor "
         f"and {config.num_learner_devices} learner devices"
@@ -1,10 +1,14 @@
-from typing import Callable, Optional, Union
+from typing import Any, Callable, Optional, Tuple, Union
 
+import chex
+import jax
+import jax.numpy as jnp
+import numpy as np
 from omegaconf import DictConfig
 
 
 def make_learning_rate_schedule(
-    init_lr: float, num_updates: int, num_epochs: int, num_minibatches: int
+    init_lr: float, num_updates: int, num_epochs: float, num_minibatches: int
 ) -> Callable:
     """Makes a very simple linear learning rate scheduler.
 
@@ -29,14 +33,14 @@ def make_learning_rate_schedule(
 
 
 def make_learning_rate(
-    init_lr: float, config: DictConfig, num_epochs: int, num_minibatches: Optional[int] = None
+    init_lr: float, config: DictConfig, num_epochs: float, num_minibatches: Optional[int] = None
 ) -> Union[float, Callable]:
     """Returns a constant learning rate or a learning rate schedule.
 
     Args:
         init_lr: initial learning rate.
         config: system configuration.
-        num_epochs: number of epochs.
+        num_epochs: number of epochs, or of updates per rollout for off-policy systems.
         num_minibatches: number of minibatches.
 
     Returns:
@@ -51,3 +55,55 @@ def make_learning_rate(
         )
     else:
         return init_lr
+
+
+def get_num_updates_per_rollout(config: DictConfig, num_rollouts: int) -> np.ndarray:
+    """Number of gradient updates performed after each of `num_rollouts` consecutive rollouts.
+
+    The fractional part of `config.system.updates_per_rollout` is spread over the rollouts, so
+    that the first k rollouts perform floor(k * updates_per_rollout) updates in total. The
+    schedule restarts with every call of the learner, so the updates per rollout are rounded by
+    `check_total_timesteps_anakin` for the `num_rollouts` rollouts to perform an integer number
+    of updates, which is computed with integers here so that none is lost to rounding errors.
+    """
+    num_updates = round(num_rollouts * config.system.updates_per_rollout)
+    cumulative_updates = np.arange(num_rollouts + 1) * num_updates // num_rollouts
+    return np.diff(cumulative_updates).astype(np.int32)
+
+
+def scan_update_epochs(
+    update_epoch_fn: Callable[[Any, Any], Tuple[Any, Any]],
+    update_state: Any,
+    rollout_index: chex.Array,
+    config: DictConfig,
+    xs: Any = None,
+) -> Tuple[Any, Any]:
+    """Scan `update_epoch_fn` over the epochs that follow a rollout.
+
+    Systems with a `replay_ratio` perform `config.system.updates_per_rollout` updates per
+    rollout, see `check_total_timesteps_anakin`. When it is fractional, `config.system.epochs`
+    is rounded up and the epochs beyond the number of updates of the rollout at `rollout_index`
+    are skipped, their loss info is NaN. `xs` are optional per-epoch inputs, with a leading
+    axis of size `config.system.epochs`, e.g. the batches drawn with fused sampling.
+    """
+    updates_per_rollout = config.system.get("updates_per_rollout")
+    if updates_per_rollout is None or float(updates_per_rollout).is_integer():
+        return jax.lax.scan(update_epoch_fn, update_state, xs, config.system.epochs)
+
+    num_updates = jnp.asarray(
+        get_num_updates_per_rollout(config, config.arch.num_updates_per_eval)
+    )[rollout_index]
+
+    def skip_epoch(update_state: Any, x: Any) -> Tuple[Any, Any]:
+        loss_info = jax.eval_shape(lambda state: update_epoch_fn(state, x)[1], update_state)
+        return update_state, jax.tree_util.tree_map(
+            lambda leaf: jnp.full(leaf.shape, jnp.nan, leaf.dtype), loss_info
+        )
+
+    def masked_update_epoch(update_state: Any, epoch_and_x: Tuple) -> Tuple[Any, Any]:
+        # The mask only depends on the rollout index, which is shared by the whole batch, so
+        # the skipped epochs are not computed.
+        epoch, x = epoch_and_x
+        return jax.lax.cond(epoch < num_updates, update_epoch_fn, skip_epoch, update_state, x)
+
+    return jax.lax.scan(masked_update_epoch, update_state, (jnp.arange(config.system.epochs), xs))
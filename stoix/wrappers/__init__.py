@@ -1,4 +1,19 @@
-from stoix.wrappers.brax import BraxWrapper
+from typing import Any
+
 from stoix.wrappers.episode_metrics import RecordEpisodeMetrics
-from stoix.wrappers.gymnax import GymnaxWrapper
 from stoix.wrappers.jumanji import JumanjiWrapper
+
+# The wrappers of other environment suites are imported on first access, so that importing the
+# wrappers does not import every suite.
+_LAZY_WRAPPERS = {
+    "BraxWrapper": "stoix.wrappers.brax",
+    "GymnaxWrapper": "stoix.wrappers.gymnax",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name in _LAZY_WRAPPERS:
+        import importlib
+
+        return getattr(importlib.import_module(_LAZY_WRAPPERS[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
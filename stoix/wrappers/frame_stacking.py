@@ -1,6 +1,7 @@
 from typing import TYPE_CHECKING, Sequence, Tuple
 
 import chex
+import jax
 import jax.numpy as jnp
 import jumanji.specs as specs
 from jumanji.env import Environment, State
@@ -114,7 +115,24 @@ class FrameStackingWrapper(Wrapper):
         self, state: FrameStackEnvState, action: chex.Array
     ) -> Tuple[FrameStackEnvState, TimeStep]:
         env_state, timestep = self._env.step(state.env_state, action)
-        new_stack_state, timestep = self._process_timestep(state.stack_state, timestep)
+        stack_state = state.stack_state
+        if "next_obs" in timestep.extras:
+            # The wrapped environment auto-resets, so on the last step of an episode the
+            # observation is the first of the next episode and the final observation is in the
+            # extras. The final observation completes the current stack and the next episode
+            # starts from an empty one.
+            next_obs = timestep.extras["next_obs"]
+            final_stack_state = self._stacker.step(stack_state, next_obs.agent_view)
+            next_obs = next_obs._replace(
+                agent_view=self.stacked_frames_to_view(final_stack_state.stacked_frames)
+            )
+            timestep = timestep.replace(extras={**timestep.extras, "next_obs": next_obs})
+            stack_state = jax.tree_util.tree_map(
+                lambda reset, current: jnp.where(timestep.last(), reset, current),
+                self._stacker.reset(),
+                stack_state,
+            )
+        new_stack_state, timestep = self._process_timestep(stack_state, timestep)
         return FrameStackEnvState(env_state=env_state, stack_state=new_stack_state), timestep
 
     def observation_spec(self) -> specs.Spec:
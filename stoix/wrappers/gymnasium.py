@@ -2,7 +2,7 @@ from typing import Dict, Optional
 
 import gymnasium
 import numpy as np
-from jumanji.specs import Array, DiscreteArray, Spec
+from jumanji.specs import Array, BoundedArray, DiscreteArray, Spec
 from jumanji.types import StepType, TimeStep
 from numpy.typing import NDArray
 
@@ -149,7 +149,13 @@ class VecGymToJumanji:
         if self.discrete:
             return DiscreteArray(num_values=self.num_actions)
         else:
-            return Array(shape=(self.num_actions,), dtype=float)
+            action_space = self.env.single_action_space
+            return BoundedArray(
+                shape=(self.num_actions,),
+                dtype=float,
+                minimum=action_space.low,
+                maximum=action_space.high,
+            )
 
     def close(self) -> None:
         self.env.close()
@@ -1,7 +1,9 @@
 import threading
-from typing import Optional
+from typing import Any, NamedTuple, Optional, Tuple
 
+import chex
 import jax
+import jax.numpy as jnp
 import numpy as np
 from jumanji.env import Environment
 from jumanji.specs import Spec
@@ -10,20 +12,31 @@ from jumanji.types import TimeStep
 from stoix.utils.env_factory import EnvFactory
 
 
+class JaxToStatefulState(NamedTuple):
+    """State of the `JaxToStateful` wrapper, kept on the environment device."""
+
+    env_state: Any
+    # Temporary variables to keep track of the episode return and length.
+    running_count_episode_return: chex.Array
+    running_count_episode_length: chex.Array
+    # Final episode return and length.
+    episode_return: chex.Array
+    episode_length: chex.Array
+
+
 class JaxToStateful:
-    """Converts a Stoix-ready JAX environment to a stateful one to be used by Sebulba systems."""
+    """Converts a Stoix-ready JAX environment to a stateful one to be used by Sebulba systems.
+
+    The environment step and the episode metric accounting are a single pure function,
+    `pure_step`, which is jitted for the stateful `step` and can also be used inside a jitted
+    `lax.scan` by actors that fuse acting and stepping for a whole rollout.
+    """
 
     def __init__(self, env: Environment, num_envs: int, device: jax.Device, init_seed: int):
         self.env = env
         self.num_envs = num_envs
         self.device = device
 
-        # Create the metrics
-        self.running_count_episode_return = np.zeros(self.num_envs, dtype=float)
-        self.running_count_episode_length = np.zeros(self.num_envs, dtype=int)
-        self.episode_return = np.zeros(self.num_envs, dtype=float)
-        self.episode_length = np.zeros(self.num_envs, dtype=int)
-
         # Create the seeds
         max_int = np.iinfo(np.int32).max
         min_int = np.iinfo(np.int32).min
@@ -32,70 +45,89 @@ class JaxToStateful:
         )
         self.rng_keys = jax.vmap(jax.random.PRNGKey)(init_seeds)
 
-        # Vmap and compile the reset and step functions
-        self.vmapped_reset = jax.jit(jax.vmap(self.env.reset), device=self.device)
-        self.vmapped_step = jax.jit(jax.vmap(self.env.step, in_axes=(0, 0)), device=self.device)
-
-    def reset(
-        self, *, seed: Optional[list[int]] = None, options: Optional[list[dict]] = None
-    ) -> TimeStep:
-        with jax.default_device(self.device):
+        # Compile the reset and step functions
+        self.jitted_reset = jax.jit(self.pure_reset, device=self.device)
+        self.jitted_step = jax.jit(self.pure_step, device=self.device)
+
+    def pure_reset(self, rng_keys: chex.PRNGKey) -> Tuple[JaxToStatefulState, TimeStep]:
+        """Reset all the environments and the episode metrics."""
+        env_state, timestep = jax.vmap(self.env.reset)(rng_keys)
+
+        zero_return = jnp.zeros(self.num_envs, dtype=float)
+        zero_length = jnp.zeros(self.num_envs, dtype=int)
+        state = JaxToStatefulState(env_state, zero_return, zero_length, zero_return, zero_length)
+
+        # Create the metrics dict
+        metrics = {
+            "episode_return": zero_return,
+            "episode_length": zero_length,
+            "is_terminal_step": jnp.zeros(self.num_envs, dtype=bool),
+        }
+
+        timestep_extras = timestep.extras
+        timestep_extras["metrics"] = metrics
+        timestep = timestep.replace(extras=timestep_extras)
+
+        return state, timestep
+
+    def pure_step(
+        self, state: JaxToStatefulState, action: chex.Array
+    ) -> Tuple[JaxToStatefulState, TimeStep]:
+        """Step all the environments and update the episode metrics."""
+        env_state, timestep = jax.vmap(self.env.step, in_axes=(0, 0))(state.env_state, action)
+
+        ep_done = timestep.last()
+        not_done = ~ep_done
+
+        # Counting episode return and length.
+        new_episode_return = state.running_count_episode_return + timestep.reward
+        new_episode_length = state.running_count_episode_length + 1
+
+        # Update the episode return and length if the episode is done otherwise
+        # keep the previous values
+        episode_return_info = state.episode_return * not_done + new_episode_return * ep_done
+        episode_length_info = state.episode_length * not_done + new_episode_length * ep_done
+
+        state = JaxToStatefulState(
+            env_state=env_state,
+            running_count_episode_return=new_episode_return * not_done,
+            running_count_episode_length=new_episode_length * not_done,
+            episode_return=episode_return_info,
+            episode_length=episode_length_info,
+        )
 
-            self.state, timestep = self.vmapped_reset(self.rng_keys)
+        # Create the metrics dict
+        metrics = {
+            "episode_return": episode_return_info,
+            "episode_length": episode_length_info,
+            "is_terminal_step": ep_done,
+        }
 
-            # Reset the metrics
-            self.running_count_episode_return = np.zeros(self.num_envs, dtype=float)
-            self.running_count_episode_length = np.zeros(self.num_envs, dtype=int)
-            self.episode_return = np.zeros(self.num_envs, dtype=float)
-            self.episode_length = np.zeros(self.num_envs, dtype=int)
+        timestep_extras = timestep.extras
+        timestep_extras["metrics"] = metrics
+        timestep = timestep.replace(extras=timestep_extras)
 
-            # Create the metrics dict
-            metrics = {
-                "episode_return": np.zeros(self.num_envs, dtype=float),
-                "episode_length": np.zeros(self.num_envs, dtype=int),
-                "is_terminal_step": np.zeros(self.num_envs, dtype=bool),
-            }
+        return state, timestep
 
-            timestep_extras = timestep.extras
+    def get_state(self) -> JaxToStatefulState:
+        """Get the pure state of the environments, e.g. to pass it to a jitted rollout."""
+        return self.state
 
-            timestep_extras["metrics"] = metrics
+    def set_state(self, state: JaxToStatefulState) -> None:
+        """Set the pure state of the environments, e.g. after stepping them with `pure_step`."""
+        self.state = state
 
-            timestep = timestep.replace(extras=timestep_extras)
+    def reset(
+        self, *, seed: Optional[list[int]] = None, options: Optional[list[dict]] = None
+    ) -> TimeStep:
+        with jax.default_device(self.device):
+            self.state, timestep = self.jitted_reset(self.rng_keys)
 
         return timestep
 
     def step(self, action: list) -> TimeStep:
         with jax.default_device(self.device):
-            self.state, timestep = self.vmapped_step(self.state, action)
-
-            ep_done = timestep.last()
-            not_done = ~ep_done
-
-            # Counting episode return and length.
-            new_episode_return = self.running_count_episode_return + timestep.reward
-            new_episode_length = self.running_count_episode_length + 1
-
-            # Update the episode return and length if the episode is done otherwise
-            # keep the previous values
-            episode_return_info = self.episode_return * not_done + new_episode_return * ep_done
-            episode_length_info = self.episode_length * not_done + new_episode_length * ep_done
-            # Update the running count
-            self.running_count_episode_return = new_episode_return * not_done
-            self.running_count_episode_length = new_episode_length * not_done
-
-            self.episode_return = episode_return_info
-            self.episode_length = episode_length_info
-
-            # Create the metrics dict
-            metrics = {
-                "episode_return": episode_return_info,
-                "episode_length": episode_length_info,
-                "is_terminal_step": ep_done,
-            }
-
-            timestep_extras = timestep.extras
-            timestep_extras["metrics"] = metrics
-            timestep = timestep.replace(extras=timestep_extras)
+            self.state, timestep = self.jitted_step(self.state, action)
 
         return timestep
 
@@ -122,8 +154,9 @@ class JaxEnvFactory(EnvFactory):
         # We want to make sure all seeds are unique
         self.lock = threading.Lock()
 
-    def __call__(self, num_envs: int) -> JaxToStateful:
+    def __call__(self, num_envs: int, device: Optional[jax.Device] = None) -> JaxToStateful:
+        """Create `num_envs` environments on `device`, which defaults to the CPU."""
         with self.lock:
             seed = self.seed
             self.seed += num_envs
-            return JaxToStateful(self.jax_env, num_envs, self.cpu, seed)
+            return JaxToStateful(self.jax_env, num_envs, device or self.cpu, seed)
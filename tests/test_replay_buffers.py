@@ -0,0 +1,208 @@
+import operator
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+import pytest
+from omegaconf import OmegaConf
+
+from stoix.base_types import Observation
+from stoix.systems.q_learning.dqn_types import Transition
+from stoix.utils.replay_buffers import (
+    make_compact_item_buffer,
+    make_prioritised_buffer,
+    make_priority_fns,
+)
+from stoix.utils.replay_codec import get_nbytes
+
+
+def _make_full_prioritised_buffer(priorities: np.ndarray, sample_batch_size: int):
+    """Fill a prioritised item buffer with one transition per slot, whose value is its slot."""
+    num_slots = len(priorities)
+    buffer = make_prioritised_buffer(
+        max_length=num_slots,
+        min_length=1,
+        sample_batch_size=sample_batch_size,
+        priority_exponent=1.0,
+    )
+    state = buffer.init({"slot": jnp.zeros((), dtype=jnp.int32)})
+    # Items are added time-major, as a single step of num_slots environments.
+    state = buffer.add(state, {"slot": jnp.arange(num_slots, dtype=jnp.int32)[None]})
+    state = buffer.set_priorities(state, jnp.arange(num_slots), jnp.asarray(priorities))
+    return buffer, state
+
+
+def test_prioritised_sampling_is_proportional_to_priority() -> None:
+    priorities = np.array([1.0, 2.0, 3.0, 4.0, 0.0, 6.0, 8.0, 8.0], dtype=np.float32)
+    buffer, state = _make_full_prioritised_buffer(priorities, sample_batch_size=64)
+
+    samples = jax.vmap(buffer.sample, in_axes=(None, 0))(
+        state, jax.random.split(jax.random.PRNGKey(0), 500)
+    )
+    indices = np.asarray(samples.indices).reshape(-1)
+    expected = priorities / priorities.sum()
+
+    np.testing.assert_array_equal(np.asarray(samples.experience["slot"]).reshape(-1), indices)
+    np.testing.assert_allclose(np.asarray(samples.probabilities).reshape(-1), expected[indices])
+    frequencies = np.bincount(indices, minlength=len(priorities)) / len(indices)
+    np.testing.assert_allclose(frequencies, expected, atol=0.01)
+    # Priorities are clipped above zero rather than set to it, but remain negligible.
+    assert frequencies[4] == 0
+
+
+def test_prioritised_sampling_is_stratified() -> None:
+    # With equal priorities, each of the batch's slices of the total priority is one slot.
+    buffer, state = _make_full_prioritised_buffer(np.ones(8, dtype=np.float32), 8)
+    sample = buffer.sample(state, jax.random.PRNGKey(1))
+    np.testing.assert_array_equal(np.sort(np.asarray(sample.indices)), np.arange(8))
+
+
+def test_added_items_get_the_max_priority() -> None:
+    buffer = make_prioritised_buffer(
+        max_length=4, min_length=1, sample_batch_size=4, priority_exponent=0.5
+    )
+    state = buffer.init({"slot": jnp.zeros((), dtype=jnp.int32)})
+    assert not buffer.can_sample(state)
+
+    state = buffer.add(state, {"slot": jnp.arange(2, dtype=jnp.int32)[None]})
+    state = buffer.set_priorities(state, jnp.array([0, 1]), jnp.array([4.0, 1.0]))
+    state = buffer.add(state, {"slot": jnp.arange(2, 4, dtype=jnp.int32)[None]})
+
+    assert buffer.can_sample(state)
+    leaves = np.asarray(state.sum_tree[len(state.sum_tree) // 2 :])
+    np.testing.assert_allclose(leaves, [2.0, 1.0, 2.0, 2.0])
+    np.testing.assert_allclose(state.sum_tree[1], leaves.sum())
+    assert state.num_updates == 1
+
+
+def test_importance_weights_are_annealed() -> None:
+    priorities = np.array([1.0, 2.0, 3.0, 4.0], dtype=np.float32)
+    buffer, state = _make_full_prioritised_buffer(priorities, sample_batch_size=4)
+    config = OmegaConf.create(
+        {
+            "system": {"importance_sampling_exponent": 0.5, "updates_per_rollout": 1},
+            "arch": {"num_updates": 2},
+        }
+    )
+    importance_weights_fn, set_priorities_fn = make_priority_fns(buffer, config)
+    sample = buffer.sample(state, jax.random.PRNGKey(2))
+    probabilities = priorities[np.asarray(sample.indices)] / priorities.sum()
+
+    # The buffer was updated once by set_priorities, half way through the annealing to 1.
+    weights = (1.0 / probabilities) ** 0.75
+    np.testing.assert_allclose(
+        importance_weights_fn(state, sample), weights / weights.max(), rtol=1e-5
+    )
+
+    state = set_priorities_fn(state, sample, jnp.ones(4))
+    weights = 1.0 / probabilities
+    np.testing.assert_allclose(
+        importance_weights_fn(state, sample), weights / weights.max(), rtol=1e-5
+    )
+    assert state.num_updates == 2
+
+
+def _make_trajectory(
+    num_steps: int, num_envs: int, num_stacked_frames: int = 1, flatten: bool = True
+) -> Transition:
+    """Make the time-major transitions of auto-resetting environments.
+
+    Each transition is identified by its action, `env * 1000 + step + 1`, which is also the value
+    of its newest frame while terminal frames are negative. Frames are stacked like the
+    `FrameStackingWrapper` does, with zeros before the start of an episode.
+    """
+    done = np.random.default_rng(0).random((num_steps, num_envs)) < 0.3
+    ids = np.arange(num_envs)[None] * 1000 + np.arange(num_steps + 1)[:, None] + 1
+    frames = np.stack([ids, ids + 0.5], axis=-1).astype(np.float32)
+    stacks = np.zeros((num_envs, 2, num_stacked_frames), dtype=np.float32)
+    obs, next_obs = [], []
+    for t in range(num_steps):
+        stacks = np.concatenate([stacks[..., 1:], frames[t, ..., None]], axis=-1)
+        next_frames = np.where(done[t, :, None], -frames[t], frames[t + 1])
+        obs.append(stacks)
+        next_obs.append(np.concatenate([stacks[..., 1:], next_frames[..., None]], axis=-1))
+        stacks = np.where(done[t, :, None, None], 0.0, stacks)
+
+    def _observation(agent_view: np.ndarray) -> Observation:
+        if flatten:
+            agent_view = agent_view.reshape(agent_view.shape[:-2] + (-1,))
+        return Observation(
+            agent_view=jnp.asarray(agent_view),
+            action_mask=jnp.ones((num_steps, num_envs, 2), dtype=bool),
+            step_count=jnp.zeros((num_steps, num_envs), dtype=jnp.int32),
+        )
+
+    return Transition(
+        obs=_observation(np.stack(obs)),
+        action=jnp.asarray(ids[:-1], dtype=jnp.int32),
+        reward=jnp.zeros((num_steps, num_envs), dtype=jnp.float32),
+        done=jnp.asarray(done),
+        next_obs=_observation(np.stack(next_obs)),
+        info={},
+    )
+
+
+def _check_compact_buffer(num_stacked_frames: int, flatten: bool = True) -> None:
+    """Add a trajectory to a compact buffer a rollout at a time, wrapping around it, and check
+    that every sampled transition is one of the stored transitions, with its observations."""
+    num_envs, max_length_time_axis, rollout_length = 4, 8, 4
+    trajectory = _make_trajectory(24, num_envs, num_stacked_frames, flatten)
+    buffer = make_compact_item_buffer(
+        max_length=num_envs * max_length_time_axis,
+        min_length=1,
+        sample_batch_size=512,
+        add_batch_size=num_envs,
+        terminal_length=max_length_time_axis,
+        num_stacked_frames=num_stacked_frames,
+        flatten_stacked_frames=flatten,
+    )
+    add, sample = jax.jit(buffer.add), jax.jit(buffer.sample)
+    state = buffer.init(jax.tree_util.tree_map(lambda x: x[0, 0], trajectory))
+    num_stored = max_length_time_axis - (num_stacked_frames - 1)
+    rollouts = jax.tree_util.tree_map(
+        lambda x: x.reshape((-1, rollout_length) + x.shape[1:]), trajectory
+    )
+
+    for i in range(6):
+        state = add(state, jax.tree_util.tree_map(operator.itemgetter(i), rollouts))
+        num_added = (i + 1) * rollout_length
+        experience = sample(state, jax.random.PRNGKey(num_added)).experience
+
+        env_ids, time_ids = np.divmod(np.asarray(experience.action) - 1, 1000)
+        assert np.all(time_ids < num_added) and np.all(time_ids >= num_added - num_stored)
+        assert np.any(experience.done), "No episode boundary was sampled."
+        for field in ("obs", "next_obs"):
+            np.testing.assert_array_equal(
+                getattr(experience, field).agent_view,
+                getattr(trajectory, field).agent_view[time_ids, env_ids],
+            )
+
+
+def test_compact_buffer_rebuilds_next_observations() -> None:
+    _check_compact_buffer(num_stacked_frames=1)
+
+
+@pytest.mark.parametrize("flatten", [True, False])
+def test_stacked_frames_buffer_rebuilds_frame_stacks(flatten: bool) -> None:
+    _check_compact_buffer(num_stacked_frames=3, flatten=flatten)
+
+
+def test_stacked_frames_buffer_stores_each_frame_once() -> None:
+    buffer = make_compact_item_buffer(
+        max_length=32, min_length=1, sample_batch_size=1, add_batch_size=4, terminal_length=8
+    )
+    stacked_buffer = make_compact_item_buffer(
+        max_length=32,
+        min_length=1,
+        sample_batch_size=1,
+        add_batch_size=4,
+        terminal_length=8,
+        num_stacked_frames=3,
+    )
+    transition = jax.tree_util.tree_map(lambda x: x[0, 0], _make_trajectory(1, 1, 3))
+    frame = jax.tree_util.tree_map(lambda x: x[0, 0], _make_trajectory(1, 1))
+
+    # Only the newest frame of each observation is stored, so stacking frames is free.
+    stacked_state = stacked_buffer.init(transition)
+    assert stacked_state.experience.obs.agent_view.shape == (4, 8, 2)
+    assert get_nbytes(stacked_state) == get_nbytes(buffer.init(frame))
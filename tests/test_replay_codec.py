@@ -0,0 +1,89 @@
+import jax
+import jax.numpy as jnp
+import numpy as np
+import pytest
+from jumanji import specs
+
+from stoix.base_types import Observation
+from stoix.utils.replay_codec import get_nbytes, make_replay_codec
+
+
+def _observation_spec(agent_view_spec: specs.Array) -> specs.Spec:
+    return specs.Spec(
+        Observation,
+        "ObservationSpec",
+        agent_view=agent_view_spec,
+        action_mask=specs.Array(shape=(2,), dtype=float),
+        step_count=specs.Array(shape=(), dtype=int),
+    )
+
+
+def _observation(agent_view: np.ndarray) -> Observation:
+    batch_shape = agent_view.shape[:1]
+    return Observation(
+        agent_view=jnp.asarray(agent_view),
+        action_mask=jnp.ones(batch_shape + (2,)),
+        step_count=jnp.zeros(batch_shape, dtype=int),
+    )
+
+
+def _round_trip(name: str, observation_spec: specs.Spec, agent_view: np.ndarray) -> np.ndarray:
+    """Encode and decode a transition's observations and return the decoded agent view."""
+    codec = make_replay_codec(name, observation_spec)
+    transition = {"obs": _observation(agent_view), "reward": jnp.ones(len(agent_view))}
+    encoded = codec.encode(transition)
+    assert get_nbytes(encoded) < get_nbytes(transition)
+    decoded = codec.decode(encoded)
+    # Only the agent views are encoded.
+    np.testing.assert_array_equal(decoded["reward"], transition["reward"])
+    np.testing.assert_array_equal(decoded["obs"].action_mask, transition["obs"].action_mask)
+    assert decoded["obs"].agent_view.dtype == jnp.float32
+    return np.asarray(decoded["obs"].agent_view)
+
+
+def test_uint8_codec_is_lossless_for_pixels() -> None:
+    spec = _observation_spec(specs.Array(shape=(4, 4, 3), dtype=np.float32))
+    pixels = np.random.default_rng(0).integers(0, 256, (8, 4, 4, 3)).astype(np.float32)
+    np.testing.assert_array_equal(_round_trip("uint8", spec, pixels), pixels)
+
+
+def test_bfloat16_codec_error_is_relative() -> None:
+    spec = _observation_spec(specs.Array(shape=(16,), dtype=np.float32))
+    agent_view = np.random.default_rng(0).normal(scale=100.0, size=(64, 16)).astype(np.float32)
+    # bfloat16 has 8 bits of precision, so rounding is within half of 2 ** -7.
+    np.testing.assert_allclose(
+        _round_trip("bfloat16", spec, agent_view), agent_view, rtol=2**-8, atol=0
+    )
+
+
+def test_affine_codec_error_is_within_half_a_step() -> None:
+    minimum = np.array([-1.0, 0.0, 5.0, -100.0], dtype=np.float32)
+    maximum = np.array([1.0, 10.0, 5.0, 100.0], dtype=np.float32)
+    spec = _observation_spec(
+        specs.BoundedArray(shape=(4,), dtype=np.float32, minimum=minimum, maximum=maximum)
+    )
+    agent_view = np.random.default_rng(0).uniform(minimum, maximum, (256, 4)).astype(np.float32)
+
+    decoded = _round_trip("affine", spec, agent_view)
+    step = (maximum - minimum) / 255
+    assert np.all(np.abs(decoded - agent_view) <= step / 2 + 1e-5)
+    # Constant features are stored exactly.
+    np.testing.assert_array_equal(decoded[:, 2], agent_view[:, 2])
+
+
+def test_codecs_store_other_dtypes_as_is() -> None:
+    spec = _observation_spec(specs.Array(shape=(3,), dtype=np.int32))
+    codec = make_replay_codec("uint8", spec)
+    observation = _observation(np.arange(6, dtype=np.int32).reshape(2, 3))
+    is_equal = jax.tree_util.tree_map(np.array_equal, codec.encode(observation), observation)
+    assert all(jax.tree_util.tree_leaves(is_equal))
+
+
+def test_affine_codec_requires_finite_bounds() -> None:
+    spec = _observation_spec(
+        specs.BoundedArray(shape=(2,), dtype=np.float32, minimum=0.0, maximum=np.inf)
+    )
+    with pytest.raises(ValueError):
+        make_replay_codec("affine", spec)
+    with pytest.raises(ValueError):
+        make_replay_codec("float8", spec)
@@ -0,0 +1,78 @@
+import threading
+import time
+from typing import Callable, List
+
+import numpy as np
+
+from stoix.utils.sebulba_utils import HostReplayBuffer, SampleToInsertRatio, ThreadLifetime
+
+
+def _start(fn: Callable[[], bool]) -> List[bool]:
+    """Run a blocking call in a thread and return the list its result is appended to."""
+    results: List[bool] = []
+    threading.Thread(target=lambda: results.append(fn()), daemon=True).start()
+    return results
+
+
+def _wait_for(results: List[bool], timeout: float = 5.0) -> bool:
+    """Wait for the result of a call started with `_start` and return whether it finished."""
+    deadline = time.monotonic() + timeout
+    while not results and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return bool(results)
+
+
+def test_sample_to_insert_ratio_blocks_sampling() -> None:
+    rate_limiter = SampleToInsertRatio(samples_per_insert=2, min_size_to_sample=4, error_buffer=2)
+    lifetime = ThreadLifetime()
+
+    # Sampling waits for the minimum number of inserts.
+    results = _start(lambda: rate_limiter.await_can_sample(2, lifetime))
+    rate_limiter.insert(3)
+    assert not _wait_for(results, timeout=0.2)
+    rate_limiter.insert(1)
+    assert _wait_for(results) and results == [True]
+
+    # The learner may then get up to error_buffer samples ahead of the ratio.
+    rate_limiter.sample(2)
+    results = _start(lambda: rate_limiter.await_can_sample(1, lifetime))
+    assert not _wait_for(results, timeout=0.2)
+    rate_limiter.insert(1)
+    assert _wait_for(results) and results == [True]
+
+
+def test_sample_to_insert_ratio_blocks_inserts() -> None:
+    rate_limiter = SampleToInsertRatio(samples_per_insert=2, min_size_to_sample=4, error_buffer=2)
+    lifetime = ThreadLifetime()
+
+    # Inserts are free until sampling is possible, after which the actors may get up to
+    # error_buffer samples ahead of the ratio.
+    assert rate_limiter.await_can_insert(5, lifetime)
+    rate_limiter.insert(5)
+    results = _start(lambda: rate_limiter.await_can_insert(1, lifetime))
+    assert not _wait_for(results, timeout=0.2)
+    rate_limiter.sample(2)
+    assert _wait_for(results) and results == [True]
+
+    # Stopping the lifetime releases blocked threads.
+    rate_limiter.insert(1)
+    results = _start(lambda: rate_limiter.await_can_insert(1, lifetime))
+    assert not _wait_for(results, timeout=0.2)
+    lifetime.stop()
+    assert _wait_for(results) and results == [False]
+
+
+def test_host_replay_buffer_keeps_the_latest_items() -> None:
+    buffer = HostReplayBuffer(max_size=5, seed=0)
+    buffer.add({"obs": np.arange(3, dtype=np.float32)[:, None], "done": np.zeros(3, dtype=bool)})
+    assert len(buffer) == 3
+    sample = buffer.sample(100)
+    assert sample["obs"].shape == (100, 1) and sample["obs"].dtype == np.float32
+    assert set(sample["obs"][:, 0]) == {0, 1, 2}
+
+    # The ring overwrites the oldest items.
+    buffer.add({"obs": np.arange(3, 7, dtype=np.float32)[:, None], "done": np.ones(4, dtype=bool)})
+    assert len(buffer) == 5
+    sample = buffer.sample(200)
+    assert set(sample["obs"][:, 0]) == {2, 3, 4, 5, 6}
+    np.testing.assert_array_equal(sample["done"], sample["obs"][:, 0] >= 3)